@@ -0,0 +1,186 @@
+"""Serve the project through ASGI, holding idle event streams without threads
+
+Django 2.0 handles requests synchronously only, so ASGIHandler runs it in a bounded pool of
+threads, translating ASGI HTTP connections to WSGI calls; bodies of responses are sent as the
+pool produces them. The event stream, whose connections stay open while nothing happens, is
+served by a coroutine instead, so idle clients take no threads at all."""
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.http import QueryDict
+from django.urls import Resolver404, resolve
+
+from flights.events import KEEPALIVE_SECONDS, STREAM_START, backend, encode_event, live_updates
+
+DEFAULT_THREADS = 16
+EVENTS_VIEW = 'REST/events'
+STREAM_HEADERS = [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                  (b'x-accel-buffering', b'no')]
+
+
+def wsgi_environ(scope, body):
+    """Make a WSGI environ out of an ASGI HTTP connection scope and the request body"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': str(client[0]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            environ[name] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def read_body(receive):
+    """Collect the whole request body; return None if the client disconnected meanwhile"""
+    body = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(body)
+
+
+class ASGIHandler:
+    """ASGI 3 application of the project"""
+
+    def __init__(self, threads=None):
+        self.wsgi = WSGIHandler()
+        self.pool = ThreadPoolExecutor(
+            threads or getattr(settings, 'ASGI_THREADS', DEFAULT_THREADS), 'asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported connection type %s' % scope['type'])
+        body = await read_body(receive)
+        if body is None:
+            return
+        if scope['method'] == 'GET' and self.is_event_stream(scope['path']):
+            await self.stream_events(scope, receive, send)
+        else:
+            await self.respond(scope, body, send)
+
+    def run(self, func, *args):
+        """Run blocking code in the thread pool"""
+        return asyncio.get_event_loop().run_in_executor(self.pool, partial(func, *args))
+
+    @staticmethod
+    def is_event_stream(path):
+        """Tell whether a path leads to the event stream view, which is served with live updates
+        on only"""
+        if not live_updates():
+            return False
+        try:
+            return resolve(path).view_name == EVENTS_VIEW
+        except Resolver404:
+            return False
+
+    async def respond(self, scope, body, send):
+        """Let Django handle a request in the thread pool, sending the response chunk by chunk as
+        it gets produced, so that streamed responses aren't buffered whole"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+
+        content = await self.run(self.wsgi, wsgi_environ(scope, body), start_response)
+        try:
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            chunks = iter(content)
+            while True:
+                chunk = await self.run(next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await self.run(content.close)
+
+    @staticmethod
+    async def stream_events(scope, receive, send):
+        """Serve the event stream like views.get_events does, waking up for new events and
+        keep-alive comments only, until the client disconnects"""
+        query = QueryDict(scope.get('query_string', b'').decode('latin-1'))
+        headers = dict(scope.get('headers', ()))
+        try:
+            flight = query.get('flight')
+            flight = None if flight is None else int(flight)
+            last_id = headers.get(b'last-event-id')
+            last_id = None if last_id is None else int(last_id)
+        except ValueError:
+            await send({'type': 'http.response.start', 'status': 400, 'headers': []})
+            await send({'type': 'http.response.body',
+                        'body': b'Flight and event ids have to be numbers'})
+            return
+
+        loop = asyncio.get_event_loop()
+        wakeup = asyncio.Event()
+        subscription = backend().subscribe(last_id)
+        subscription.listener = partial(loop.call_soon_threadsafe, wakeup.set)
+        disconnect = asyncio.ensure_future(receive())
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': STREAM_HEADERS})
+            await send({'type': 'http.response.body', 'body': STREAM_START.encode(),
+                        'more_body': True})
+            while not disconnect.done():
+                wakeup.clear()
+                event = subscription.get(timeout=0)
+                if event is None:
+                    waiting = asyncio.ensure_future(wakeup.wait())
+                    done, _ = await asyncio.wait([waiting, disconnect], timeout=KEEPALIVE_SECONDS,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    waiting.cancel()
+                    if done:
+                        continue
+                chunk = encode_event(event, flight)
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk.encode(),
+                                'more_body': True})
+        finally:
+            subscription.close()
+            disconnect.cancel()
+
+    @staticmethod
+    async def lifespan(receive, send):
+        """Acknowledge server startup and shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,137 @@
+"""Check a whole stored schedule against the rules of Flight.clean() and Reservation.clean()
+
+Tables are loaded once into NumPy arrays (see flights.export) and every rule is checked with
+sorting and comparisons of whole arrays, instead of validating flights one by one.
+
+Overlaps of flights of a plane (or a crew) are found by sorting them by the plane and takeoff
+time: a flight overlaps an earlier one iff it takes off no later than the latest landing before
+it. To get running maxima restarting with every plane from a single cumulative maximum, times
+are replaced by their ranks among all times and offset by the plane's number times the number
+of ranks, which keeps planes apart without overflowing int64."""
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from flights.export import NO_CREW, airport_columns, flight_columns, load_table, \
+    plane_columns, require_numpy
+from flights.models import DAILY_FLIGHTS_PER_PLANE, MIN_FLIGHT_MINUTES, Flight, Reservation
+from flights.validation import SWEEP_ERRORS
+
+try:
+    import numpy as np
+except ImportError:  # only needed for audits
+    np = None
+
+MICROSECONDS = 10 ** 6
+DAY = 24 * 3600 * MICROSECONDS
+OFFSET_STEP = 15 * 60 * MICROSECONDS  # timezone offsets change at quarters of hours at most
+
+Violation = namedtuple('Violation', ('rule', 'flights', 'message'))
+
+
+def overlaps(groups, takeoffs, landings):
+    """Find flights overlapping an earlier one of the same group; return positions of such
+    flights and positions of the earlier flights that they overlap"""
+    times, ranks = np.unique(np.concatenate([takeoffs, landings]), return_inverse=True)
+    span = len(times) + 1
+    order = np.lexsort((landings, takeoffs, groups))
+    base = groups[order].astype(np.int64) * span
+    starts = base + ranks[:len(takeoffs)][order]
+    ends = np.maximum.accumulate(base + ranks[len(takeoffs):][order])
+    latest = np.concatenate([[-1], ends[:-1]])  # latest landing before each flight
+    later = np.flatnonzero(starts <= latest)
+    # the first position reaching a running maximum is the flight landing then
+    earlier = np.searchsorted(ends, latest[later], side='left')
+    return order[later], order[earlier]
+
+
+def local_days(times):
+    """Numbers of days of epoch microsecond times in the current timezone"""
+    local = timezone.get_current_timezone()
+    steps, inverse = np.unique(times // OFFSET_STEP, return_inverse=True)
+    offsets = np.array([
+        timezone.localtime(datetime.fromtimestamp(step * OFFSET_STEP // MICROSECONDS,
+                                                  timezone.utc), local).utcoffset()
+        // timedelta(microseconds=1) for step in steps.tolist()], dtype=np.int64)
+    return (times + offsets[inverse]) // DAY
+
+
+def day_name(day):
+    """ISO date of a day number"""
+    return (datetime(1970, 1, 1) + timedelta(days=int(day))).date().isoformat()
+
+
+def route_violations(flights):
+    """Flights breaking rules of Flight.clean_route()"""
+    duration = flights['landingTime'] - flights['takeoffTime']
+    rules = (
+        ('route', flights['takeoffAirport'] == flights['landingAirport'], 'Zero-length flight'),
+        ('times', duration <= 0, 'Takeoff and landing times are invalid'),
+        ('duration', (duration > 0) & (duration < MIN_FLIGHT_MINUTES * 60 * MICROSECONDS),
+         'Flight time is too short'),
+    )
+    for rule, broken, message in rules:
+        for pkey in flights['id'][broken].tolist():
+            yield Violation(rule, (pkey,), message)
+
+
+def overlap_violations(flights):
+    """Pairs of overlapping flights of a plane or a crew"""
+    crewed = flights['crew'] != NO_CREW
+    for rule, selected, group in (('plane overlap', slice(None), flights['plane']),
+                                  ('crew overlap', crewed, flights['crew'][crewed])):
+        ids = flights['id'][selected]
+        later, earlier = overlaps(group, flights['takeoffTime'][selected],
+                                  flights['landingTime'][selected])
+        message = SWEEP_ERRORS['overlap' if rule == 'plane overlap' else 'crew overlap']
+        for first, second in zip(ids[earlier].tolist(), ids[later].tolist()):
+            yield Violation(rule, (first, second), message)
+
+
+def daily_violations(flights, planes):
+    """Days on which a plane makes more flights than allowed, counting a flight on every day
+    that it touches"""
+    first, last = local_days(flights['takeoffTime']), local_days(flights['landingTime'])
+    spans = np.maximum(last - first, 0) + 1
+    rows = np.repeat(np.arange(len(spans)), spans)
+    days = first[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(spans) - spans, spans)
+    if not len(days):
+        return
+    lowest = days.min()
+    keys = flights['plane'][rows].astype(np.int64) * (days.max() - lowest + 1) + days - lowest
+    order = np.argsort(keys, kind='stable')
+    keys, rows = keys[order], rows[order]
+    unique, begins, counts = np.unique(keys, return_index=True, return_counts=True)
+    for key, begin, count in zip(*(values[counts > DAILY_FLIGHTS_PER_PLANE].tolist()
+                                   for values in (unique, begins, counts))):
+        plane, day = divmod(key, days.max() - lowest + 1)
+        yield Violation('daily limit', tuple(flights['id'][rows[begin:begin + count]].tolist()),
+                        'Plane %s makes %d flights on %s, more than %d' % (
+                            planes['identifier'][plane], count, day_name(day + lowest),
+                            DAILY_FLIGHTS_PER_PLANE))
+
+
+def capacity_violations(flights, planes, reservations):
+    """Flights with more tickets reserved than seats in their planes"""
+    order = np.argsort(flights['id'])
+    positions = order[np.searchsorted(flights['id'], reservations['flight'], sorter=order)]
+    tickets = np.bincount(positions, weights=reservations['ticketCount'],
+                          minlength=len(flights['id'])).astype(np.int64)
+    limits = planes['passengerLimit'][flights['plane']]
+    for pkey, reserved, limit in zip(*(values[tickets > limits].tolist()
+                                       for values in (flights['id'], tickets, limits))):
+        yield Violation('capacity', (pkey,), '%d seats reserved of %d' % (reserved, limit))
+
+
+def audit_schedule():
+    """Load the schedule and list all its violations of flight and reservation rules; to get
+    a consistent snapshot, run it in a transaction (see flights.routers.snapshot)"""
+    require_numpy()
+    airports, planes = airport_columns(), plane_columns()
+    flights = load_table(Flight.objects, flight_columns(airports, planes))
+    reservations = load_table(Reservation.objects.filter(ticketCount__gt=0), {
+        'flight': ('flight_id', np.int64, list), 'ticketCount': ('ticketCount', np.int64, list)})
+    return [*route_violations(flights), *overlap_violations(flights),
+            *daily_violations(flights, planes),
+            *capacity_violations(flights, planes, reservations)]
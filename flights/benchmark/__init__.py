@@ -0,0 +1,5 @@
+"""Measure latency and throughput of the busiest endpoints under concurrent load
+
+Scenarios are run by threads of a single process with the Django test client, against a
+throwaway database seeded by the same generator as init_data.py; a run can be saved as JSON and
+used as a baseline to detect regressions of later runs."""
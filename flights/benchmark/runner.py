@@ -0,0 +1,88 @@
+"""Run scenarios in concurrent threads and summarize their latencies and query counts"""
+import math
+import random
+import threading
+from time import perf_counter
+
+from django.db import connection
+from django.test import Client
+
+MILLISECONDS = 1000
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted, non-empty list"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    """Make a report of a scenario run out of latencies of requests and their query counts"""
+    ordered = sorted(latencies)
+    report = {'requests': len(ordered), 'errors': errors,
+              'rps': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+              'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0}
+    for name, fraction in (('p50_ms', .5), ('p95_ms', .95), ('p99_ms', .99)):
+        report[name] = round(percentile(ordered, fraction) * MILLISECONDS, 2) if ordered else 0.0
+    return report
+
+
+def worker(scenario, fixture, count, seed, samples):
+    """Send [count] requests of a scenario from one client, recording each request's latency,
+    query count and whether it failed (raised or got a 5xx status)"""
+    rand = random.Random(seed)
+    client = Client(HTTP_HOST='localhost')
+    if scenario.login:
+        client.force_login(fixture.user)
+    executed = []
+
+    def count_query(execute, sql, params, many, context):
+        executed.append(sql)
+        return execute(sql, params, many, context)
+
+    try:
+        with connection.execute_wrapper(count_query):
+            for _ in range(count):
+                del executed[:]
+                start = perf_counter()
+                try:
+                    failed = scenario.send(client, fixture, rand).status_code >= 500
+                except Exception:  # pylint: disable=broad-except
+                    failed = True
+                samples.append((perf_counter() - start, len(executed), failed))
+    finally:
+        connection.close()
+
+
+def run_scenario(scenario, fixture, threads, requests, seed=0):
+    """Send [requests] requests of a scenario spread over [threads] concurrent clients"""
+    samples = []
+    workers = [threading.Thread(target=worker, args=(
+        scenario, fixture, requests // threads + (i < requests % threads), seed + i, samples))
+               for i in range(threads)]
+    start = perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = perf_counter() - start
+    return summarize([latency for latency, _, _ in samples],
+                     [queries for _, queries, _ in samples],
+                     sum(failed for _, _, failed in samples), elapsed)
+
+
+def compare(results, baseline, tolerance):
+    """List regressions of scenario reports against a baseline: latency, query counts or errors
+    growing or throughput dropping by more than a [tolerance] fraction"""
+    regressions = []
+    for name, report in sorted(results.items()):
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request', 'errors'):
+            if report[metric] > before[metric] * (1 + tolerance):
+                regressions.append('%s: %s went up from %s to %s' % (
+                    name, metric, before[metric], report[metric]))
+        if report['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append('%s: rps went down from %s to %s' % (
+                name, before['rps'], report['rps']))
+    return regressions
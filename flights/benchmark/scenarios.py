@@ -0,0 +1,66 @@
+"""Requests made by the benchmark and the data they pick their parameters from"""
+import json
+import random
+from collections import namedtuple, OrderedDict
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from flights.models import Crew, Flight
+from flights.seeding import FLIGHTS_PER_PLANE, PLANE_COUNT, seed_planes, seed_schedule
+
+PASSENGER_COUNT = 100
+MAX_TICKETS = 3
+BENCH_USER = 'benchmark'
+
+Scenario = namedtuple('Scenario', ('name', 'login', 'send'))
+Fixture = namedtuple('Fixture', ('user', 'flights', 'crews', 'days'))
+
+
+def seed(scale, rand=random):
+    """Fill an empty database with [scale] times as many planes as init_data.py creates, crews
+    to lead them and a user to log in as"""
+    identifiers = seed_planes(PLANE_COUNT * scale, rand)
+    seed_schedule(identifiers, FLIGHTS_PER_PLANE, rand)
+    Crew.objects.bulk_create(Crew(cptName='Captain', cptSurname=str(i))
+                             for i in range(PLANE_COUNT * scale))
+
+    flights = list(Flight.objects.values_list('pk', flat=True))
+    days = sorted({timezone.localtime(takeoff).date().isoformat()
+                   for takeoff in Flight.objects.values_list('takeoffTime', flat=True)})
+    return Fixture(User.objects.create_user(BENCH_USER), flights,
+                   list(Crew.objects.values_list('pk', flat=True)), days)
+
+
+# pylint: disable=unused-argument
+# All scenarios share a signature
+def reserve(client, fixture, rand):
+    """Book a random number of seats (zero cancels) for a random passenger and flight"""
+    return client.post('/reserve', {
+        'name': 'Passenger', 'surname': str(rand.randrange(PASSENGER_COUNT)),
+        'flight': rand.choice(fixture.flights), 'ticketCount': rand.randint(0, MAX_TICKETS)})
+
+
+def set_crew(client, fixture, rand):
+    """Assign a random crew to a random flight"""
+    return client.post('/REST/setCrew', content_type='application/json', data=json.dumps({
+        'crew': rand.choice(fixture.crews), 'flight': rand.choice(fixture.flights)}))
+
+
+def timetable(client, fixture, rand):
+    """Fetch the first page of flights of a random day through the API"""
+    return client.get('/REST/flights', {'search': rand.choice(fixture.days)})
+
+
+def details(client, fixture, rand):
+    """Show the details page of a random flight"""
+    return client.get('/details/%d' % rand.choice(fixture.flights))
+# pylint: enable=unused-argument
+
+
+SCENARIOS = OrderedDict((scenario.name, scenario) for scenario in (
+    Scenario('reserve', True, reserve),
+    Scenario('set_crew', True, set_crew),
+    Scenario('flights', False, timetable),
+    Scenario('details', False, details),
+))
@@ -0,0 +1,193 @@
+"""Reserve seats for one passenger, or for many passengers on many flights in a single
+transaction
+
+A single reservation is booked either with its flight and reservation rows locked for the rest of
+the transaction, or optimistically: the reservation and the flight's seats change only if their
+versions are still the ones that were read, retrying a few times otherwise, so that neither row
+is locked while bookings read and check them. The FLIGHTS_OPTIMISTIC_RESERVATIONS setting
+chooses the latter."""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
+from django.db import IntegrityError, transaction
+from django.db.models import BinaryField, Case, F, Q, Value, When
+from django.utils import timezone
+
+from flights.caching import schedule_changed
+from flights.events import publish_seats
+from flights.models import Flight, Passenger, Reservation, reseat
+from flights.passengers import PASSENGERS
+from flights.validation import QUERY_CHUNK, validate_reservations
+
+DEFAULT_RETRIES = 5
+CONCURRENT_CHANGE = 'The reservation is being changed concurrently, please try again'
+
+BatchItem = namedtuple('BatchItem', ('name', 'surname', 'flight', 'ticketCount'))
+
+
+def parse_items(records):
+    """Read (name, surname, flight, ticketCount) items out of JSON objects; return the items
+    and {position: ValidationError} of malformed ones"""
+    items, errors = [], {}
+    if not isinstance(records, list):
+        raise ValidationError('Expected a list of reservations')
+    for index, record in enumerate(records):
+        try:
+            item = BatchItem(str(record['name']), str(record['surname']), int(record['flight']),
+                             record.get('ticketCount', 0))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            item = None
+        if item is None or not item.name or not item.surname:
+            errors[index] = ValidationError(
+                'Expected an object with name, surname, flight and ticketCount')
+        items.append(item)
+    return items, errors
+
+
+def lock_flights(flight_ids, using=None):
+    """Lock rows of flights in the order of their primary keys, so that batches touching the
+    same flights can't deadlock each other; [using] names the database if it's not the routed
+    one"""
+    flight_ids = sorted(set(flight_ids))
+    for i in range(0, len(flight_ids), QUERY_CHUNK):
+        list(Flight.objects.db_manager(using).select_for_update()
+             .filter(pk__in=flight_ids[i:i + QUERY_CHUNK])
+             .order_by('pk').values_list('pk', flat=True))
+
+
+def check_passengers(passenger_ids):
+    """Raise Passenger.DoesNotExist unless passengers of all given primary keys are stored"""
+    passenger_ids = list(set(passenger_ids))
+    for i in range(0, len(passenger_ids), QUERY_CHUNK):
+        chunk = passenger_ids[i:i + QUERY_CHUNK]
+        if Passenger.objects.filter(pk__in=chunk).count() != len(chunk):
+            raise Passenger.DoesNotExist('A passenger has been deleted')
+
+
+def stored_reservations(pairs):
+    """Map (passenger id, flight id) pairs to their stored reservations"""
+    pairs = list(pairs)
+    found = {}
+    for i in range(0, len(pairs), QUERY_CHUNK // 2):
+        condition = Q(pk__in=[])
+        for passenger, flight in pairs[i:i + QUERY_CHUNK // 2]:
+            condition |= Q(passenger_id=passenger, flight_id=flight)
+        found.update(((reservation.passenger_id, reservation.flight_id), reservation)
+                     for reservation in Reservation.objects.filter(condition))
+    return found
+
+
+def save_reservations(reservations):
+    """Write validated reservations: move seats of their flights, a few queries per flight,
+    then insert new reservations in bulk and update changed ones with a single query"""
+    change = {}
+    for reservation in reservations:
+        if reservation.ticketCount != reservation.saved_ticket_count:
+            change.setdefault(reservation.flight_id, []).append(reservation)
+    for flight_id, moved in sorted(change.items()):
+        seat_maps = reseat(flight_id, [(reservation.seatMap, reservation.ticketCount)
+                                       for reservation in moved])
+        if seat_maps is None:
+            raise ValidationError({NON_FIELD_ERRORS: [
+                'Such reservation would exceed plane passenger capacity limit']})
+        for reservation, seat_map in zip(moved, seat_maps):
+            reservation.seatMap = seat_map
+
+    Reservation.objects.bulk_create(reservation for reservation in reservations
+                                    if reservation.pk is None)
+    changed = [reservation for reservation in reservations if reservation.pk is not None and
+               reservation.ticketCount != reservation.saved_ticket_count]
+    if changed:
+        condition = Q(pk__in=[])
+        for reservation in changed:
+            condition |= Q(pk=reservation.pk, version=reservation.version)
+        if Reservation.objects.filter(condition).update(
+                ticketCount=Case(*[When(pk=reservation.pk, then=reservation.ticketCount)
+                                   for reservation in changed]),
+                seatMap=Case(*[When(pk=reservation.pk, then=Value(reservation.seatMap))
+                               for reservation in changed], output_field=BinaryField()),
+                version=F('version') + 1, updated=timezone.now()) != len(changed):
+            raise ValidationError({NON_FIELD_ERRORS: [CONCURRENT_CHANGE]})
+    schedule_changed(Reservation)
+    publish_seats(change)
+
+
+def book_reservations(records):
+    """Create or change reservations described by JSON objects with name, surname, flight and
+    ticketCount, all of them or none; must run in a transaction, which has to be rolled back if
+    errors are returned. Return the saved reservations and {position: ValidationError}"""
+    items, errors = parse_items(records)
+    if errors:
+        return [], errors
+    lock_flights(item.flight for item in items)
+    return PASSENGERS.resolve_for(((item.name, item.surname) for item in items),
+                                  lambda passengers: book_items(items, passengers))
+
+
+def book_items(items, passengers):
+    """Book parsed items for passengers mapped from (name, surname) pairs to primary keys, like
+    book_reservations()"""
+    check_passengers(passengers.values())
+    stored = stored_reservations({(passengers[item.name, item.surname], item.flight)
+                                  for item in items})
+
+    reservations, seen, errors = [], set(), {}
+    for index, item in enumerate(items):
+        pair = (passengers[item.name, item.surname], item.flight)
+        if pair in seen:
+            errors[index] = ValidationError('Passenger has another reservation of this flight '
+                                            'in the batch')
+        seen.add(pair)
+        reservation = stored.get(pair) or Reservation(passenger_id=pair[0], flight_id=pair[1])
+        reservation.ticketCount = item.ticketCount
+        reservations.append(reservation)
+
+    errors.update((index, error) for index, error in validate_reservations(reservations).items()
+                  if index not in errors)
+    if errors:
+        return [], errors
+    save_reservations(reservations)
+    stored = stored_reservations(seen)
+    return [stored[reservation.passenger_id, reservation.flight_id]
+            for reservation in reservations], errors
+
+
+def lock_reservation(passenger_id, flight_id, ticket_count):
+    """Set tickets of a passenger on a flight, holding locks of the flight and reservation rows
+    until the transaction ends"""
+    flight = Flight.objects.select_for_update().get(pk=flight_id)
+    reservation, _ = Reservation.objects.select_for_update() \
+        .get_or_create(passenger_id=passenger_id, flight=flight)
+    reservation.ticketCount = ticket_count
+    reservation.save()
+    return reservation
+
+
+def swap_reservation(passenger_id, flight_id, ticket_count, retries):
+    """Set tickets of a passenger on a flight without locking, trying again up to [retries]
+    times if the reservation or the flight's seats are changed concurrently. A new reservation
+    is stored without tickets first, which takes no seats"""
+    for _ in range(retries):
+        reservation = Reservation.objects.filter(passenger_id=passenger_id,
+                                                 flight_id=flight_id).first()
+        try:
+            with transaction.atomic():
+                if reservation is None:
+                    reservation = Reservation(passenger_id=passenger_id, flight_id=flight_id)
+                    reservation.save()
+                if reservation.swap_tickets(ticket_count):
+                    return reservation
+        except IntegrityError:  # created by someone else meanwhile
+            continue
+    raise ValidationError({NON_FIELD_ERRORS: [CONCURRENT_CHANGE]})
+
+
+def book_reservation(passenger_id, flight_id, ticket_count):
+    """Set tickets of a passenger on a flight, optimistically or with locks as configured; must
+    run in a transaction. Return the reservation, raise ValidationError if it can't be made"""
+    check_passengers([passenger_id])
+    if getattr(settings, 'FLIGHTS_OPTIMISTIC_RESERVATIONS', False):
+        return swap_reservation(passenger_id, flight_id, ticket_count,
+                                getattr(settings, 'FLIGHTS_RESERVATION_RETRIES', DEFAULT_RETRIES))
+    return lock_reservation(passenger_id, flight_id, ticket_count)
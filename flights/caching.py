@@ -0,0 +1,87 @@
+"""Reuse timetable and crew list responses until the schedule changes
+
+Cache keys carry a schedule version, which every save or delete of a model shown by these
+endpoints bumps, so entries of older versions are simply never read again. The version is read
+before the database, so a change committed in the meantime can only make a cached entry newer
+than its version. It is bumped again once a transaction commits, as requests that read the bumped
+version before that could still see the old rows."""
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.db import router, transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, set_response_etag
+
+VERSION_KEY = 'flights:version'
+TIMEOUT = 24 * 60 * 60
+
+
+def initial_version():
+    """Start versions from the current time, so that they don't repeat if the cache loses the
+    version key while keeping older entries"""
+    return int(time.time() * 1000)
+
+
+def schedule_version():
+    """Return the current schedule version"""
+    return cache.get_or_set(VERSION_KEY, initial_version, None)
+
+
+def invalidate():
+    """Make all cached responses stale"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, initial_version(), None)
+
+
+# pylint: disable=unused-argument
+# This format of function arguments is needed by Django
+def schedule_changed(sender, *args, **kwargs):
+    # pylint: enable=unused-argument
+    """Invalidate cached responses now and once the ongoing transaction commits"""
+    invalidate()
+    transaction.on_commit(invalidate, using=router.db_for_write(sender))
+
+
+def cache_key(endpoint, request):
+    """Key of a response to a request, made of an endpoint name and all query parameters"""
+    query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()
+    return 'flights:%d:%s:%s' % (schedule_version(), endpoint, query)
+
+
+def cached(endpoint, request, compute):
+    """Return a value computed for a request, reusing the one of the current schedule version"""
+    key = cache_key(endpoint, request)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, TIMEOUT)
+    return value
+
+
+def cached_response(endpoint):
+    """Serve responses of a view from the cache, with an ETag of their content; respond with
+    304 Not Modified if a request has a matching If-None-Match header. Streamed and unsuccessful
+    responses aren't stored"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = cache_key(endpoint, request)
+            entry = cache.get(key)
+            if entry is None:
+                response = view(request, *args, **kwargs)
+                if response.streaming or response.status_code != 200:
+                    return response
+                set_response_etag(response)
+                cache.set(key, (response.content, response['Content-Type'], response['ETag']),
+                          TIMEOUT)
+            else:
+                content, content_type, etag = entry
+                response = HttpResponse(content, content_type=content_type)
+                response['ETag'] = etag
+            return get_conditional_response(request, etag=response['ETag'], response=response)
+        return wrapper
+    return decorator
@@ -0,0 +1,247 @@
+"""Detect schedule conflicts of planes and crews without querying the database
+
+Every plane and every crew gets its own pair of sorted lists holding takeoff and landing times of
+its flights. Since for any interval takeoff <= landing, the number of flights touching a closed
+time window [begin, end] is (takeoffs <= end) - (landings < begin), which takes two bisections.
+
+The index is built lazily from the database on first use and then kept in sync with flights
+committed by the current process (see flights.indexing); checks made in a transaction also count
+the flights it changed. Since the index can't see flights saved by other processes, it's only
+used when FLIGHTS_SCHEDULE_INDEX is set, which suits a single process serving the site;
+otherwise schedule() checks the same rules with indexed queries, under locks of the plane and
+crew rows."""
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, time, timedelta
+from threading import RLock
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+
+from flights.indexing import PENDING, track
+
+
+class IntervalIndex:
+    """Sorted takeoff and landing times of flights, grouped by a key (plane or crew id)"""
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+        self.intervals = {}  # flight pk -> (key, start, end)
+
+    def add(self, key, pkey, start, end):
+        """Register (or move) a flight interval under a given key"""
+        self.remove(pkey)
+        if key is None:
+            return
+        insort(self.starts.setdefault(key, []), start)
+        insort(self.ends.setdefault(key, []), end)
+        self.intervals[pkey] = (key, start, end)
+
+    def remove(self, pkey):
+        """Forget a flight interval if it was registered"""
+        entry = self.intervals.pop(pkey, None)
+        if entry is None:
+            return
+        key, start, end = entry
+        for values, value in ((self.starts[key], start), (self.ends[key], end)):
+            del values[bisect_left(values, value)]
+
+    def load(self, rows):
+        """Replace the whole index with (key, pk, start, end) rows, sorting each group once"""
+        self.starts, self.ends, self.intervals = {}, {}, {}
+        for key, pkey, start, end in rows:
+            if key is None:
+                continue
+            self.starts.setdefault(key, []).append(start)
+            self.ends.setdefault(key, []).append(end)
+            self.intervals[pkey] = (key, start, end)
+        for values in (*self.starts.values(), *self.ends.values()):
+            values.sort()
+
+    def count(self, key, begin, end, exclude=None, end_inclusive=True, changed=None):
+        """How many intervals under [key] touch the window between [begin] and [end], not counting
+        the one of flight [exclude]; [changed] maps flights to (key, start, end) intervals, or
+        None, that replace their registered ones"""
+        def touches(interval):
+            return interval is not None and interval[0] == key and interval[2] >= begin and (
+                interval[1] <= end if end_inclusive else interval[1] < end)
+
+        starts = self.starts.get(key, ())
+        upper = bisect_right(starts, end) if end_inclusive else bisect_left(starts, end)
+        total = upper - bisect_left(self.ends.get(key, ()), begin)
+
+        changed = changed or {}
+        for pkey in {exclude, *changed}:
+            if touches(self.intervals.get(pkey)):
+                total -= 1
+        for pkey, interval in changed.items():
+            if pkey != exclude and touches(interval):
+                total += 1
+        return total
+
+
+class ScheduleIndex:
+    """Per-plane and per-crew interval indexes of all committed flights"""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.plane = IntervalIndex()
+        self.crew = IntervalIndex()
+        self.loaded = False
+
+    def reset(self):
+        """Drop the index so that it gets rebuilt from the database on next use"""
+        with self.lock:
+            self.plane = IntervalIndex()
+            self.crew = IntervalIndex()
+            self.loaded = False
+
+    def ensure_loaded(self):
+        """Build the index with a single query if it's not there yet"""
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            rows = list(apps.get_model('flights', 'Flight').objects
+                        .values_list('pk', 'plane_id', 'crew_id', 'takeoffTime', 'landingTime')
+                        .iterator())
+            self.plane.load((plane, pkey, start, end) for pkey, plane, _, start, end in rows)
+            self.crew.load((crew, pkey, start, end) for pkey, _, crew, start, end in rows)
+            self.loaded = True
+
+    def update(self, flight):
+        """Reflect a saved flight in the index"""
+        with self.lock:
+            if not self.loaded:
+                return
+            self.plane.add(flight.plane_id, flight.pk, flight.takeoffTime, flight.landingTime)
+            self.crew.add(flight.crew_id, flight.pk, flight.takeoffTime, flight.landingTime)
+
+    def discard(self, pkey):
+        """Reflect a deleted flight in the index"""
+        with self.lock:
+            if not self.loaded:
+                return
+            self.plane.remove(pkey)
+            self.crew.remove(pkey)
+
+    def pending(self):
+        """Flights changed by the ongoing transaction, mapped by primary keys to their states
+        (see PendingFlights.flights), which the index has to be read with; None if it can't
+        tell them, because they were written in bulk or the index isn't loaded yet, since
+        loading would then take in uncommitted flights"""
+        if PENDING.untracked():
+            return None
+        changed = PENDING.flights()
+        if changed and not self.loaded:
+            return None
+        self.ensure_loaded()
+        return changed
+
+    def lock_rows(self, flight):
+        """Nothing to lock, the index only serves the current process"""
+
+    def plane_conflicts(self, flight):
+        """How many other flights of the plane overlap with a given flight"""
+        changed = self.pending()
+        if changed is None:
+            return QUERIES.plane_conflicts(flight)
+        return self.plane.count(flight.plane_id, flight.takeoffTime, flight.landingTime,
+                                exclude=flight.pk, changed=intervals(changed, 'plane_id'))
+
+    def crew_conflicts(self, flight):
+        """How many other flights of the crew overlap with a given flight"""
+        if flight.crew_id is None:
+            return 0
+        changed = self.pending()
+        if changed is None:
+            return QUERIES.crew_conflicts(flight)
+        return self.crew.count(flight.crew_id, flight.takeoffTime, flight.landingTime,
+                               exclude=flight.pk, changed=intervals(changed, 'crew_id'))
+
+    def daily_flights(self, flight, moment):
+        """How many flights does the plane of [flight] make on the day of [moment], including
+        [flight] itself"""
+        changed = self.pending()
+        if changed is None:
+            return QUERIES.daily_flights(flight, moment)
+        begin, end = day_bounds(moment)
+        return 1 + self.plane.count(flight.plane_id, begin, end, exclude=flight.pk,
+                                    end_inclusive=False, changed=intervals(changed, 'plane_id'))
+
+
+def intervals(flights, key):
+    """Map flights of PendingFlights.flights() to (key, takeoff, landing) intervals of them"""
+    return {pkey: None if flight is None else
+            (getattr(flight, key), flight.takeoffTime, flight.landingTime)
+            for pkey, flight in flights.items()}
+
+
+class QuerySchedule:
+    """The checks of ScheduleIndex done with queries on the primary database, answered with
+    the plane and crew indexes of flights"""
+
+    @staticmethod
+    def others(flight):
+        """Flights other than the given one, read from the database it's written to"""
+        model = apps.get_model('flights', 'Flight')
+        return model.objects.using(router.db_for_write(model)).exclude(pk=flight.pk)
+
+    def lock_rows(self, flight):
+        """Serialize schedule changes of the flight's plane and crew until the ongoing
+        transaction ends, so that concurrent saves can't both pass the checks"""
+        model = apps.get_model('flights', 'Flight')
+        alias = router.db_for_write(model)
+        if not connections[alias].in_atomic_block:
+            return
+        for related, pkey in (('plane', flight.plane_id), ('crew', flight.crew_id)):
+            if pkey is not None:
+                list(model._meta.get_field(related).related_model.objects.using(alias)
+                     .select_for_update().filter(pk=pkey).values_list('pk'))
+
+    def plane_conflicts(self, flight):
+        """How many other flights of the plane overlap with a given flight"""
+        return self.others(flight).filter(plane_id=flight.plane_id,
+                                          takeoffTime__lte=flight.landingTime,
+                                          landingTime__gte=flight.takeoffTime).count()
+
+    def crew_conflicts(self, flight):
+        """How many other flights of the crew overlap with a given flight"""
+        if flight.crew_id is None:
+            return 0
+        return self.others(flight).filter(crew_id=flight.crew_id,
+                                          takeoffTime__lte=flight.landingTime,
+                                          landingTime__gte=flight.takeoffTime).count()
+
+    def daily_flights(self, flight, moment):
+        """How many flights does the plane of [flight] make on the day of [moment], including
+        [flight] itself"""
+        begin, end = day_bounds(moment)
+        return 1 + self.others(flight).filter(plane_id=flight.plane_id, takeoffTime__lt=end,
+                                              landingTime__gte=begin).count()
+
+
+def day_bounds(moment):
+    """Return the [begin, end) datetime range of a day of a given moment in current timezone"""
+    if timezone.is_naive(moment):
+        day = datetime.combine(moment.date(), time.min)
+        return day, day + timedelta(days=1)
+    return date_bounds(timezone.localtime(moment).date())
+
+
+def date_bounds(day):
+    """Return the [begin, end) range of aware datetimes of a date in current timezone"""
+    begin = datetime.combine(day, time.min)
+    return timezone.make_aware(begin), timezone.make_aware(begin + timedelta(days=1))
+
+
+SCHEDULE = track(ScheduleIndex())
+QUERIES = QuerySchedule()
+
+
+def schedule():
+    """The schedule conflict checks to use, see the FLIGHTS_SCHEDULE_INDEX setting"""
+    return SCHEDULE if getattr(settings, 'FLIGHTS_SCHEDULE_INDEX', False) else QUERIES
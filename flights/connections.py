@@ -0,0 +1,185 @@
+"""Find itineraries of up to a few connected flights between airports
+
+The search is a Connection Scan: flights of a time window are scanned once in takeoff order,
+keeping the earliest arrival at every airport for every number of flights taken so far; a
+flight extends an itinerary arriving at its takeoff airport early enough for the transfer. The
+scan stops once the earliest direct flight lands, as later itineraries can't beat it, or at the
+end of the window. It runs over a timetable of all flights sorted by takeoff time, kept in
+memory like the schedule index when FLIGHTS_TIMETABLE_INDEX is set: built lazily with a single
+query, then kept in sync with flights committed by the current process (see flights.indexing).
+Otherwise, or in transactions that changed flights, flights of the window are queried. Free
+seats change far more often, so they are checked when the flights found are read and the scan
+is repeated without the full ones; after a few repeats all full flights of the window are read
+at once instead."""
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import timedelta
+from threading import RLock
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import F
+
+from flights.dates import stored_datetime, stored_time
+from flights.indexing import PENDING, track
+
+MAX_CONNECTIONS = 3
+MIN_TRANSFER = timedelta(minutes=30)
+HORIZON = timedelta(hours=48)
+SEAT_ATTEMPTS = 3
+
+# times are integer seconds since the epoch, which compare much faster than datetimes
+Connection = namedtuple('Connection', ('takeoff', 'pk', 'landing', 'origin', 'destination'))
+
+
+def seconds(moment):
+    """Seconds since the epoch of an aware datetime"""
+    return int(moment.timestamp())
+
+
+def read_connections(flights):
+    """Connections of a queryset of flights, sorted"""
+    rows = flights.values_list(stored_time('takeoffTime'), 'pk', stored_time('landingTime'),
+                               'takeoffAirport_id', 'landingAirport_id')
+    return sorted(Connection(seconds(stored_datetime(takeoff)), pkey,
+                             seconds(stored_datetime(landing)), origin, destination)
+                  for takeoff, pkey, landing, origin, destination in rows.iterator())
+
+
+class Timetable:
+    """All flights as Connections sorted by takeoff time"""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.connections = []
+        self.entries = {}  # flight pk -> Connection
+        self.loaded = False
+
+    def reset(self):
+        """Drop the timetable so that it gets rebuilt from the database on next use"""
+        with self.lock:
+            self.connections, self.entries = [], {}
+            self.loaded = False
+
+    def ensure_loaded(self):
+        """Build the timetable with a single query if it's not there yet"""
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            connections = read_connections(apps.get_model('flights', 'Flight').objects.all())
+            self.connections = connections
+            self.entries = {connection.pk: connection for connection in connections}
+            self.loaded = True
+
+    def update(self, flight):
+        """Reflect a saved flight in the timetable"""
+        with self.lock:
+            if not self.loaded:
+                return
+            self.discard(flight.pk)
+            connection = Connection(seconds(flight.takeoffTime), flight.pk,
+                                    seconds(flight.landingTime), flight.takeoffAirport_id,
+                                    flight.landingAirport_id)
+            insort(self.connections, connection)
+            self.entries[flight.pk] = connection
+
+    def discard(self, pkey):
+        """Reflect a deleted flight in the timetable"""
+        with self.lock:
+            connection = self.entries.pop(pkey, None)
+            if connection is not None:
+                del self.connections[bisect_left(self.connections, connection)]
+
+    def window(self, begin, end):
+        """Connections taking off between two moments (in seconds), inclusive"""
+        self.ensure_loaded()
+        with self.lock:
+            return self.connections[bisect_left(self.connections, (begin,)):
+                                    bisect_left(self.connections, (end + 1,))]
+
+
+TIMETABLE = track(Timetable())
+
+
+def window(begin, end):
+    """Connections taking off between two aware datetimes, inclusive, from the timetable if the
+    FLIGHTS_TIMETABLE_INDEX setting is True and the ongoing transaction hasn't changed flights,
+    queried otherwise"""
+    if getattr(settings, 'FLIGHTS_TIMETABLE_INDEX', False) and not PENDING.untracked() and \
+            not PENDING.flights():
+        return TIMETABLE.window(seconds(begin), seconds(end))
+    return read_connections(apps.get_model('flights', 'Flight').objects.filter(
+        takeoffTime__gte=begin, takeoffTime__lte=end))
+
+
+def scan(connections, origin, destination, max_flights, transfer, skipped=()):
+    """Find the earliest arriving itineraries from [origin] to [destination] through
+    [connections] sorted by takeoff, using at most [max_flights] flights and at least [transfer]
+    seconds between them, not using flights in [skipped]. Return lists of flight ids, one for
+    every number of flights that arrives earlier than any itinerary with fewer flights"""
+    # (airport, flights taken) -> (arrival, flight, label it continues)
+    labels = {}
+    direct = None  # itineraries arriving after the earliest direct flight are of no use
+    for takeoff, pkey, landing, start, end in connections:
+        if direct is not None and takeoff >= direct:
+            break
+        if pkey in skipped or start == destination:
+            continue
+        for taken in range(max_flights, 0, -1):
+            if taken == 1:
+                if start != origin:
+                    continue
+                previous = None
+            else:
+                previous = labels.get((start, taken - 1))
+                if previous is None or previous[0] + transfer > takeoff:
+                    continue
+            label = labels.get((end, taken))
+            if label is None or landing < label[0]:
+                labels[end, taken] = (landing, pkey, previous)
+                if end == destination and taken == 1:
+                    direct = landing
+
+    itineraries, earliest = [], None
+    for taken in range(1, max_flights + 1):
+        label = labels.get((destination, taken))
+        if label is None or (earliest is not None and label[0] >= earliest):
+            continue
+        earliest = label[0]
+        legs = []
+        while label is not None:
+            legs.append(label[1])
+            label = label[2]
+        itineraries.append(legs[::-1])
+    return itineraries
+
+
+def search_connections(origin, destination, after, seats=1, max_connections=MAX_CONNECTIONS,
+                       transfer=MIN_TRANSFER, horizon=HORIZON):
+    """Find itineraries from [origin] to [destination] airports with flights taking off between
+    [after] and [after] + [horizon], changing flights at most [max_connections] times with at
+    least [transfer] time for every change, and at least [seats] free seats on every flight.
+    Return lists of flights of the earliest arriving itineraries, ones with more connections
+    only if they arrive earlier"""
+    connections = window(after, after + horizon)
+    flights = apps.get_model('flights', 'Flight').objects
+    skipped = set()
+    for attempt in range(SEAT_ATTEMPTS + 1):
+        if attempt == SEAT_ATTEMPTS:
+            # many full flights on the way, skip all of them at once
+            skipped.update(flights.filter(
+                takeoffTime__gte=after, takeoffTime__lte=after + horizon,
+                reservedSeats__gt=F('plane__passengerLimit') - seats).values_list('pk', flat=True))
+        itineraries = scan(connections, origin, destination, max_connections + 1,
+                           transfer // timedelta(seconds=1), skipped)
+        found = {flight.pk: flight for flight in flights.for_api().filter(
+            pk__in={pkey for legs in itineraries for pkey in legs})}
+        full = {pkey for pkey, flight in found.items()
+                if flight.reservedSeats + seats > flight.plane.passengerLimit}
+        if not full:
+            break
+        skipped |= full
+    return [[found[pkey] for pkey in legs] for legs in itineraries
+            if all(pkey in found for pkey in legs)]
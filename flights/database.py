@@ -0,0 +1,22 @@
+"""Check persistent database connections before requests reuse them
+
+Django 2.0 drops a persistent connection (CONN_MAX_AGE) only after an error or once it gets too
+old, so a connection closed meanwhile by the server or a pooler fails the next request using it.
+With the FLIGHTS_DB_HEALTH_CHECKS setting on, idle connections are pinged when a request starts
+and reopened on demand if they don't answer, like CONN_HEALTH_CHECKS of newer Django versions."""
+from django.conf import settings
+from django.db import connections
+
+
+# connected to request_started in flights.models
+# pylint: disable=unused-argument
+# This format of function arguments is needed by Django
+def check_connections(sender, **kwargs):
+    # pylint: enable=unused-argument
+    """Close persistent connections that stopped working"""
+    if not getattr(settings, 'FLIGHTS_DB_HEALTH_CHECKS', False):
+        return
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block and \
+                not connection.is_usable():
+            connection.close()
@@ -0,0 +1,28 @@
+"""Read datetimes of flights as the database stores them, for code that loads whole tables"""
+from datetime import datetime
+
+from django.db import connections
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from django.utils.dateparse import parse_datetime
+
+from flights.routers import read_alias
+
+
+def stored_time(field):
+    """Select a datetime field as it is stored: SQLite keeps UTC times as ISO text, which NumPy
+    or datetime.fromisoformat() parse many times faster than Django converts it to datetimes"""
+    if connections[read_alias()].vendor == 'sqlite':
+        return Cast(field, CharField())
+    return field
+
+
+def stored_datetime(value):
+    """Aware datetime of a value selected with stored_time(), with the fast standard library
+    parser where it's available"""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value + '+00:00')  # faster than setting tzinfo
+        except (AttributeError, ValueError):
+            return parse_datetime(value + '+00:00')
+    return value
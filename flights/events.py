@@ -0,0 +1,182 @@
+"""Publish changes of seat counters and flight crews to subscribers of an event stream
+
+Changes are published once their transaction commits, with data read after the commit. The
+backend passing events to subscribers is chosen with the FLIGHTS_EVENTS_BACKEND setting; the
+default LocalEventBackend only reaches subscribers in the same process, a backend shared by all
+processes (e.g. on Redis pub/sub) has to provide the same publish() and subscribe() methods.
+
+Pages subscribe only with the FLIGHTS_LIVE_UPDATES setting on, as a WSGI server gives every
+open stream a thread of its own; the ASGI entry point (task2.asgi) turns it on by default."""
+import queue
+import threading
+from collections import deque, namedtuple
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import router, transaction
+from django.db.models.signals import post_delete
+from django.forms import model_to_dict
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'flights.events.LocalEventBackend'
+HISTORY_SIZE = 1000
+QUEUE_SIZE = 1000
+QUERY_CHUNK = 500  # keep "IN" lists below SQLite's limit of query parameters
+KEEPALIVE_SECONDS = 15
+RETRY_MILLISECONDS = 3000
+STREAM_START = 'retry: %d\n\n' % RETRY_MILLISECONDS
+KEEPALIVE = ': keepalive\n\n'
+
+Event = namedtuple('Event', ('id', 'kind', 'data'))
+RESET = Event(None, 'reset', {})  # tells a subscriber that it missed events
+ENCODER = DjangoJSONEncoder()
+
+
+class Subscription:
+    """Events published since subscribing, waiting to be read"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.events = queue.Queue(QUEUE_SIZE)
+        self.overflowed = False
+        self.listener = None  # called after every put, by readers that can't block on get()
+
+    def put(self, event):
+        """Queue an event, or remember that some were lost if the reader is too slow"""
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+        if self.listener is not None:
+            self.listener()
+
+    def get(self, timeout=None):
+        """Wait for the next event; return RESET if some were lost and None on timeout"""
+        if self.overflowed:
+            self.overflowed = False
+            with self.events.mutex:
+                self.events.queue.clear()
+            return RESET
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """Stop receiving events"""
+        self.backend.unsubscribe(self)
+
+
+class LocalEventBackend:
+    """Pass events to subscribers in this process, keeping recent ones for resuming streams"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.subscribers = set()
+
+    def publish(self, kind, data):
+        """Send an event to all subscribers"""
+        with self.lock:
+            self.last_id += 1
+            event = Event(self.last_id, kind, data)
+            self.history.append(event)
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def subscribe(self, last_id=None):
+        """Start receiving events, beginning with the ones after [last_id] if it's given"""
+        subscription = Subscription(self)
+        with self.lock:
+            if last_id is not None:
+                if self.history and last_id < self.history[0].id - 1:
+                    subscription.overflowed = True
+                for event in self.history:
+                    if event.id > last_id:
+                        subscription.put(event)
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop sending events to a subscriber"""
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+
+def encode_event(event, flight=None):
+    """Encode an event for a text/event-stream, a keep-alive comment for None; return an empty
+    string for events of flights other than [flight] if it's given"""
+    if event is None:
+        return KEEPALIVE
+    if flight is not None and event.data.get('flight', flight) != flight:
+        return ''
+    event_id = '' if event.id is None else 'id: %d\n' % event.id
+    return '%sevent: %s\ndata: %s\n\n' % (event_id, event.kind, ENCODER.encode(event.data))
+
+
+def live_updates():
+    """Whether the event stream is served and pages subscribe to it"""
+    return getattr(settings, 'FLIGHTS_LIVE_UPDATES', False)
+
+
+@lru_cache(maxsize=None)
+def backend():
+    """The configured event backend, created on first use"""
+    return import_string(getattr(settings, 'FLIGHTS_EVENTS_BACKEND', DEFAULT_BACKEND))()
+
+
+def publish_seats(flight_ids):
+    """Once the ongoing transaction commits, publish seat counters of given flights, with
+    their versions to let subscribers drop events older than ones they've already got"""
+    flight_ids = sorted(set(flight_ids))
+    flight_model = apps.get_model('flights', 'Flight')
+
+    def publish():
+        flights = flight_model.objects
+        for i in range(0, len(flight_ids), QUERY_CHUNK):
+            rows = flights.filter(pk__in=flight_ids[i:i + QUERY_CHUNK]) \
+                .values_list('pk', 'reservedSeats', 'plane__passengerLimit', 'seatsVersion')
+            for pkey, reserved, limit, version in rows:
+                backend().publish('seats', {'flight': pkey, 'reservedSeats': reserved,
+                                            'freeSeats': limit - reserved, 'version': version})
+    transaction.on_commit(publish, using=router.db_for_write(flight_model))
+
+
+def publish_crews(flight_ids):
+    """Once the ongoing transaction commits, publish flights with changed crews, in the shape
+    REST/flights lists them in"""
+    flight_ids = sorted(set(flight_ids))
+    flight_model = apps.get_model('flights', 'Flight')
+
+    def publish():
+        flights = flight_model.objects.for_api()
+        for i in range(0, len(flight_ids), QUERY_CHUNK):
+            for flight in flights.filter(pk__in=flight_ids[i:i + QUERY_CHUNK]):
+                backend().publish('crew', dict(model_to_dict(flight), title=str(flight)))
+    transaction.on_commit(publish, using=router.db_for_write(flight_model))
+
+
+# pylint: disable=unused-argument
+# This format of function arguments is needed by Django
+def reservation_changed(sender, instance, *args, **kwargs):
+    # pylint: enable=unused-argument
+    """Publish the seat counter of a flight after a reservation takes or gives back seats"""
+    if kwargs['signal'] is post_delete:
+        taken = instance.saved_ticket_count
+    else:
+        taken = int(instance.ticketCount) - instance.saved_ticket_count
+    if taken:
+        publish_seats([instance.flight_id])
+
+
+# pylint: disable=unused-argument
+# This format of function arguments is needed by Django
+def flight_changed(sender, instance, *args, **kwargs):
+    # pylint: enable=unused-argument
+    """Publish a flight that was added or got another crew"""
+    if kwargs.get('created') or instance.crew_id != instance.saved_crew_id:
+        publish_crews([instance.pk])
@@ -0,0 +1,191 @@
+"""Export the schedule as columns of NumPy arrays, for analytics
+
+Every column of a table becomes an .npy file named <table>.<column>.npy, so that consumers can
+memory-map the ones they need with numpy.load(path, mmap_mode='r'). Times are int64 microseconds
+since the Unix epoch, UTC. Airports and planes are dictionary-encoded: flights refer to them by
+their int32 position in airports.* and planes.* arrays, a missing crew is -1. Reservations refer
+to flights by primary key, like flights.id.
+
+Tables are read in chunks ordered by primary key and columns are written to disk chunk by chunk,
+so memory use doesn't grow with the number of rows; only the dictionaries are kept whole."""
+import os
+import shutil
+import zipfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from flights.dates import stored_time
+from flights.models import Airport, Flight, Plane, Reservation
+
+try:
+    import numpy as np
+except ImportError:  # only needed for exports
+    np = None
+
+CHUNK_SIZE = 10000
+NO_CREW = -1
+
+
+def chunks(queryset, fields, size=CHUNK_SIZE):
+    """Yield lists of (pk, *fields) rows of a queryset in primary key order, a query per chunk
+    continuing after the last key read, so that no query scans skipped rows"""
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(page.values_list('pk', *fields)[:size])
+        if not rows:
+            return
+        yield rows
+        last = rows[-1][0]
+
+
+def epoch_microseconds(times):
+    """Convert aware datetimes, or ISO texts of UTC times, to int64 microseconds since the
+    epoch"""
+    if times and isinstance(times[0], str):
+        return np.array(times, dtype='datetime64[us]').astype(np.int64)
+    return np.array([time.astimezone(timezone.utc).replace(tzinfo=None) for time in times],
+                    dtype='datetime64[us]').astype(np.int64)
+
+
+class ColumnWriter:
+    """Append values to an .npy file of a one-dimensional array whose length isn't known in
+    advance: data goes to a temporary file, the final file gets written once it's complete"""
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.data = open(path + '.part', 'w+b')
+
+    def append(self, values):
+        """Write a chunk of values"""
+        values = np.asarray(values, dtype=self.dtype)
+        self.data.write(values.tobytes())
+        self.length += len(values)
+
+    def close(self):
+        """Write the .npy file and remove the temporary one"""
+        self.data.seek(0)
+        with open(self.path, 'wb') as out:
+            np.lib.format.write_array_header_1_0(out, {
+                'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                'shape': (self.length,)})
+            shutil.copyfileobj(self.data, out)
+        self.data.close()
+        os.remove(self.path + '.part')
+
+
+def column_chunks(queryset, columns):
+    """Yield chunks of columns of a table as {name: array}, primary keys under "id"; [columns]
+    maps names to (field, dtype, convert), where convert turns a chunk of field values into the
+    column's values"""
+    fields = [field for field, _, _ in columns.values()]
+    for rows in chunks(queryset, fields):
+        values = list(zip(*rows))
+        chunk = {'id': np.asarray(values[0], dtype=np.int64)}
+        for (name, (_, dtype, convert)), column in zip(columns.items(), values[1:]):
+            chunk[name] = np.asarray(convert(column), dtype=dtype)
+        yield chunk
+
+
+def load_table(queryset, columns):
+    """Read whole columns of a table into memory, see column_chunks()"""
+    loaded = {'id': [np.zeros(0, dtype=np.int64)]}
+    loaded.update((name, [np.zeros(0, dtype=dtype)]) for name, (_, dtype, _) in columns.items())
+    for chunk in column_chunks(queryset, columns):
+        for name, values in chunk.items():
+            loaded[name].append(values)
+    return {name: np.concatenate(parts) for name, parts in loaded.items()}
+
+
+def export_table(directory, table, queryset, columns):
+    """Write columns of a table chunk by chunk, see column_chunks(); return the number of rows"""
+    writers = {name: ColumnWriter(os.path.join(directory, '%s.%s.npy' % (table, name)), dtype)
+               for name, (_, dtype, _) in columns.items()}
+    writers['id'] = ColumnWriter(os.path.join(directory, '%s.id.npy' % table), np.int64)
+    for chunk in column_chunks(queryset, columns):
+        for name, values in chunk.items():
+            writers[name].append(values)
+    for writer in writers.values():
+        writer.close()
+    return writers['id'].length
+
+
+def require_numpy():
+    """Fail unless NumPy is installed"""
+    if np is None:
+        raise ImproperlyConfigured('Exporting the schedule requires NumPy')
+
+
+def airport_columns():
+    """Whole columns of airports, in primary key order"""
+    airports = list(Airport.objects.order_by('pk').values_list('pk', 'name'))
+    return {'id': np.array([pkey for pkey, _ in airports], dtype=np.int64),
+            'name': np.array([name for _, name in airports], dtype=str)}
+
+
+def plane_columns():
+    """Whole columns of planes, in primary key order"""
+    planes = list(Plane.objects.order_by('pk').values_list('pk', 'passengerLimit'))
+    return {'identifier': np.array([identifier for identifier, _ in planes], dtype=str),
+            'passengerLimit': np.array([limit for _, limit in planes], dtype=np.int32)}
+
+
+def encoder(keys):
+    """Function turning a chunk of keys into their positions in [keys]"""
+    codes = {key: code for code, key in enumerate(keys.tolist())}
+    return lambda chunk: [codes[key] for key in chunk]
+
+
+def flight_columns(airports, planes):
+    """Columns of flights, referring to airports and planes by positions in their columns"""
+    return {
+        'plane': ('plane_id', np.int32, encoder(planes['identifier'])),
+        'takeoffAirport': ('takeoffAirport_id', np.int32, encoder(airports['id'])),
+        'landingAirport': ('landingAirport_id', np.int32, encoder(airports['id'])),
+        'takeoffTime': (stored_time('takeoffTime'), np.int64, epoch_microseconds),
+        'landingTime': (stored_time('landingTime'), np.int64, epoch_microseconds),
+        'crew': ('crew_id', np.int64,
+                 lambda crews: [NO_CREW if crew is None else crew for crew in crews]),
+        'reservedSeats': ('reservedSeats', np.int32, list),
+    }
+
+
+def reservation_columns():
+    """Columns of reservations"""
+    return {
+        'passenger': ('passenger_id', np.int64, list),
+        'flight': ('flight_id', np.int64, list),
+        'ticketCount': ('ticketCount', np.int32, list),
+        'updated': (stored_time('updated'), np.int64, epoch_microseconds),
+    }
+
+
+def export_schedule(directory):
+    """Write airports, planes, flights and reservations into a directory; to get a consistent
+    snapshot, run it in a transaction (see flights.routers.snapshot). Return {table: rows}"""
+    require_numpy()
+    os.makedirs(directory, exist_ok=True)
+    airports, planes = airport_columns(), plane_columns()
+    for table, columns in (('airports', airports), ('planes', planes)):
+        for name, values in columns.items():
+            np.save(os.path.join(directory, '%s.%s.npy' % (table, name)), values)
+
+    flights = export_table(directory, 'flights', Flight.objects,
+                           flight_columns(airports, planes))
+    reservations = export_table(directory, 'reservations', Reservation.objects,
+                                reservation_columns())
+    return {'airports': len(airports['id']), 'planes': len(planes['identifier']),
+            'flights': flights, 'reservations': reservations}
+
+
+def archive(directory, target):
+    """Pack the .npy files of an export into an uncompressed .npz archive written to a file
+    object, loadable with numpy.load"""
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_STORED, allowZip64=True) as npz:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.npy'):
+                npz.write(os.path.join(directory, name), name)
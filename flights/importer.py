@@ -0,0 +1,207 @@
+"""Validate flight schedules in memory and write them to the database in bulk
+
+Schedules are read record by record and imported in batches: each batch is validated against
+the flights already stored, those of earlier batches included, and saved before the next one is
+read, so only a batch is held in memory."""
+import csv
+import json
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from flights.conflicts import date_bounds
+from flights.indexing import flights_written
+from flights.models import Airport, Crew, Flight, Plane, DAILY_FLIGHTS_PER_PLANE, \
+    MIN_FLIGHT_MINUTES
+from flights.validation import SWEEP_ERRORS, existing_intervals, sweep
+
+COLUMNS = ('plane', 'takeoffAirport', 'takeoffTime', 'landingAirport', 'landingTime', 'crew')
+DEFAULT_BATCH_SIZE = 10000
+JSON_CHUNK = 1 << 16  # characters of a JSON array read at a time
+JSON_SEPARATORS = ' \t\r\n,[]'
+
+ScheduledFlight = namedtuple('ScheduledFlight', ('line', 'plane', 'takeoffAirport',
+                                                 'takeoffTime', 'landingAirport',
+                                                 'landingTime', 'crew'))
+
+
+def read_csv(stream):
+    """Yield (line number, record) pairs of a CSV file with a header row of COLUMNS"""
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def read_json_lines(stream):
+    """Yield (line number, record) pairs of a file with one JSON object per line, malformed
+    lines give None records"""
+    for line, text in enumerate(stream, 1):
+        if text.strip():
+            try:
+                yield line, json.loads(text)
+            except ValueError:
+                yield line, None
+
+
+def read_json(stream):
+    """Yield (line number, record) pairs of a file with a JSON array of objects, decoding them
+    one by one as the file is read; a malformed object gives a None record and ends the file"""
+    decoder = json.JSONDecoder()
+    text, line, more = '', 1, True
+    while True:
+        start = len(text) - len(text.lstrip(JSON_SEPARATORS))
+        line += text.count('\n', 0, start)
+        text = text[start:]
+        if not text and not more:
+            return
+        try:
+            record, end = decoder.raw_decode(text)
+        except ValueError:
+            if not more:
+                yield line, None
+                return
+            chunk = stream.read(JSON_CHUNK)
+            more = bool(chunk)
+            text += chunk
+            continue
+        yield line, record
+        line += text.count('\n', 0, end)
+        text = text[end:]
+
+
+def parse_time(value):
+    """Read an ISO 8601 datetime, None if it's malformed"""
+    return parse_datetime(value)
+
+
+class ScheduleImport:
+    """Collect schedule records, check them against Flight.clean() rules and save in bulk"""
+
+    def __init__(self):
+        self.airports = dict(Airport.objects.values_list('name', 'pk'))
+        self.planes = set(Plane.objects.values_list('pk', flat=True))
+        self.crews = set(Crew.objects.values_list('pk', flat=True))
+        self.timezone = timezone.get_current_timezone()
+        self.by_plane = defaultdict(list)
+        self.pending = 0  # flights in by_plane
+        self.accepted = []
+        self.rejected = []  # (line, reason)
+        self.saved = self.rejections = 0  # flights streamed so far
+
+    def add(self, line, record):
+        """Parse a single record, rejecting it right away if it's invalid on its own"""
+        try:
+            flight = ScheduledFlight(
+                line, record['plane'], self.airports.get(record['takeoffAirport']),
+                parse_time(record['takeoffTime']),
+                self.airports.get(record['landingAirport']),
+                parse_time(record['landingTime']),
+                int(record['crew']) if record.get('crew') else None)
+        except (KeyError, TypeError, ValueError) as err:
+            self.rejected.append((line, 'Malformed record: %s' % err))
+            return
+
+        reason = self.check(flight)
+        if reason:
+            self.rejected.append((line, reason))
+        else:
+            self.by_plane[flight.plane].append(flight._replace(
+                takeoffTime=flight.takeoffTime.astimezone(self.timezone),
+                landingTime=flight.landingTime.astimezone(self.timezone)))
+            self.pending += 1
+
+    def check(self, flight):
+        """Validate what can be told from a single flight, return the reason of rejection"""
+        if flight.plane not in self.planes:
+            return 'Unknown plane'
+        if flight.takeoffAirport is None or flight.landingAirport is None:
+            return 'Unknown airport'
+        if flight.crew is not None and flight.crew not in self.crews:
+            return 'Unknown crew'
+        if flight.takeoffTime is None or flight.landingTime is None:
+            return 'Malformed date'
+        if timezone.is_naive(flight.takeoffTime) or timezone.is_naive(flight.landingTime):
+            return 'Date without timezone'
+        if flight.takeoffAirport == flight.landingAirport:
+            return 'Zero-length flight'
+        if flight.landingTime <= flight.takeoffTime:
+            return 'Takeoff and landing times are invalid'
+        if flight.landingTime - flight.takeoffTime < timedelta(minutes=MIN_FLIGHT_MINUTES):
+            return 'Flight time is too short'
+        return None
+
+    def validate(self):
+        """Sweep flights of every plane and then of every crew in takeoff order, against stored
+        flights of the days they touch"""
+        flights = [flight for flights in self.by_plane.values() for flight in flights]
+        within = (date_bounds(min(flight.takeoffTime for flight in flights).date())[0],
+                  date_bounds(max(flight.landingTime for flight in flights).date())[1]) \
+            if flights else None
+        existing = existing_intervals('plane', self.by_plane.keys(), within=within)
+        by_crew = defaultdict(list)
+        for plane, flights in self.by_plane.items():
+            accepted, rejected = sweep(flights, existing.get(plane, ()), DAILY_FLIGHTS_PER_PLANE)
+            self.reject(rejected)
+            for flight in accepted:
+                by_crew[flight.crew].append(flight)
+        self.by_plane.clear()
+        self.pending = 0
+
+        self.accepted = by_crew.pop(None, [])
+        existing = existing_intervals('crew', by_crew.keys(), within=within)
+        for crew, flights in by_crew.items():
+            accepted, rejected = sweep(flights, existing.get(crew, ()))
+            self.reject((flight, 'crew ' + reason) for flight, reason in rejected)
+            self.accepted += accepted
+        self.accepted.sort()
+        self.rejected.sort()
+
+    def reject(self, rejected):
+        """Record flights rejected by a sweep"""
+        self.rejected += [(flight.line, SWEEP_ERRORS[reason]) for flight, reason in rejected]
+
+    def save(self, batch_size=DEFAULT_BATCH_SIZE):
+        """Insert accepted flights in one transaction, [batch_size] rows per statement batch"""
+        insert_flights(self.accepted, batch_size)
+        flights_written()
+        return len(self.accepted)
+
+    def stream(self, records, batch_size=DEFAULT_BATCH_SIZE):
+        """Import (line, record) pairs in batches of [batch_size] flights, each validated and
+        inserted before the next one is read, all in one transaction; yield (line, reason) of
+        rejected records batch by batch, counting them in rejections and inserted flights in
+        saved"""
+        with transaction.atomic():
+            for line, record in records:
+                self.add(line, record)
+                if self.pending >= batch_size:
+                    yield from self.flush(batch_size)
+            yield from self.flush(batch_size)
+            if self.saved:
+                flights_written()
+
+    def flush(self, batch_size):
+        """Validate and insert the flights added so far, yield (line, reason) of rejected
+        records"""
+        self.validate()
+        insert_flights(self.accepted, batch_size)
+        self.saved += len(self.accepted)
+        self.rejections += len(self.rejected)
+        rejected = self.rejected
+        self.accepted, self.rejected = [], []
+        yield from rejected
+
+
+def insert_flights(flights, batch_size):
+    """Bulk create flights in one transaction, [batch_size] rows per statement. bulk_create()
+    sends no signals, so callers report the write with flights_written()"""
+    with transaction.atomic():
+        for i in range(0, len(flights), batch_size):
+            Flight.objects.bulk_create([
+                Flight(plane_id=flight.plane, takeoffAirport_id=flight.takeoffAirport,
+                       takeoffTime=flight.takeoffTime, landingAirport_id=flight.landingAirport,
+                       landingTime=flight.landingTime, crew_id=flight.crew)
+                for flight in flights[i:i + batch_size]], batch_size)
@@ -0,0 +1,139 @@
+"""Keep in-memory indexes of flights in step with committed transactions
+
+Indexes registered with track() learn about flights saved or deleted through models only once
+the transaction that changed them commits, so rolled back changes never reach them. Until then,
+the changes are pending in the thread that made them, the only one that sees them in the
+database: checks made in its transaction take them into account along with the index, or use
+queries instead. A pending change is dropped when its transaction, or the savepoint it was made
+in, rolls back, which is when Django drops its on_commit callback.
+
+Writes that bypass signals report changed flights with flights_saved(), or call
+flights_written() if they can't tell which flights they changed, e.g. bulk inserts; indexes
+are then rebuilt once the transaction commits and until then its thread uses queries only."""
+import threading
+from copy import copy
+
+from django.apps import apps
+from django.db import connections, router, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from flights.caching import schedule_changed
+
+INDEXES = []
+
+
+def track(index):
+    """Keep an index with update(flight), discard(pk) and reset() methods in sync with
+    committed flights; return the index"""
+    INDEXES.append(index)
+    return index
+
+
+def flight_model():
+    """The Flight model, which imports this module"""
+    return apps.get_model('flights', 'Flight')
+
+
+class PendingFlights(threading.local):
+    """Flight changes of ongoing transactions of the current thread"""
+
+    def __init__(self):
+        super().__init__()
+        self.changes = {}  # flight pk -> [(flight copy, None if deleted; on_commit callback)]
+        self.written = None  # on_commit callback of writes bypassing signals
+
+    @staticmethod
+    def connection():
+        """Connection that flights are written with"""
+        return connections[router.db_for_write(flight_model())]
+
+    def live(self):
+        """on_commit callbacks of the ongoing transaction that haven't been rolled back"""
+        connection = self.connection()
+        if not connection.in_atomic_block:
+            return set()
+        return {callback for _, callback in connection.run_on_commit}
+
+    def flights(self):
+        """Map primary keys of flights changed by the ongoing transaction to their current
+        states, None for deleted flights"""
+        if not self.changes:
+            return {}
+        live = self.live()
+        changes = {}
+        for pkey, states in self.changes.items():
+            states = [state for state in states if state[1] in live]
+            if states:
+                changes[pkey] = states
+        self.changes = changes
+        return {pkey: states[-1][0] for pkey, states in changes.items()}
+
+    def untracked(self):
+        """Whether the ongoing transaction wrote flights that indexes can't tell"""
+        if self.written is not None and self.written not in self.live():
+            self.written = None
+        return self.written is not None
+
+    def change(self, pkey, flight):
+        """Apply a saved flight, or None for a deleted one, to indexes once the ongoing
+        transaction commits"""
+        def commit():
+            for index in INDEXES:
+                if flight is None:
+                    index.discard(pkey)
+                else:
+                    index.update(flight)
+            if pkey in self.changes:
+                self.changes[pkey] = [state for state in self.changes[pkey]
+                                      if state[1] is not commit]
+
+        if self.connection().in_atomic_block:
+            self.changes.setdefault(pkey, []).append((flight, commit))
+        transaction.on_commit(commit, using=self.connection().alias)
+
+    def write(self):
+        """Rebuild indexes once the ongoing transaction commits"""
+        def commit():
+            for index in INDEXES:
+                index.reset()
+            if self.written is commit:
+                self.written = None
+
+        if self.connection().in_atomic_block:
+            self.written = commit
+        transaction.on_commit(commit, using=self.connection().alias)
+
+
+PENDING = PendingFlights()
+
+
+def flights_saved(flights):
+    """Report flights written bypassing signals, in their current states"""
+    for flight in flights:
+        PENDING.change(flight.pk, copy(flight))
+
+
+def flights_written():
+    """Report writes of flights that bypassed signals: indexes get rebuilt and cached
+    responses invalidated"""
+    PENDING.write()
+    schedule_changed(flight_model())
+
+
+@receiver(post_save, sender='flights.Flight')
+# pylint: disable=unused-argument
+# This format of function arguments is needed by Django
+def flight_saved(sender, instance, *args, **kwargs):
+    # pylint: enable=unused-argument
+    """Keep indexes in sync with saved flights"""
+    PENDING.change(instance.pk, copy(instance))
+
+
+@receiver(post_delete, sender='flights.Flight')
+# pylint: disable=unused-argument
+# This format of function arguments is needed by Django
+def flight_deleted(sender, instance, *args, **kwargs):
+    # pylint: enable=unused-argument
+    """Keep indexes in sync with deleted flights"""
+    PENDING.change(instance.pk, None)
@@ -0,0 +1,149 @@
+"""Count queries and time database, template and whole request work per view
+
+Measurements of the request handled by the current thread are gathered in a RequestTimings
+object by a database execute wrapper and by the TimedDjangoTemplates backend, then added to
+per-view totals of the METRICS registry, which are exposed in Prometheus text format."""
+import threading
+from collections import OrderedDict
+from time import perf_counter
+
+from django.template.backends.django import DjangoTemplates
+
+DURATION_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+_CURRENT = threading.local()
+
+
+class RequestTimings:
+    """Queries made and seconds spent on them, on rendering templates and on the whole request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.database = 0.0
+        self.templates = 0.0
+        self.total = 0.0
+
+    def count_query(self, execute, sql, params, many, context):
+        """Database execute wrapper timing every query"""
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.database += perf_counter() - start
+
+    def server_timing(self):
+        """Value of a Server-Timing header, in milliseconds"""
+        return 'db;dur=%.2f;desc="%d queries", tpl;dur=%.2f, total;dur=%.2f' % (
+            self.database * 1000, self.queries, self.templates * 1000, self.total * 1000)
+
+
+def current_timings():
+    """Timings of the request handled by this thread, None outside of instrumented requests"""
+    return getattr(_CURRENT, 'timings', None)
+
+
+def set_current_timings(timings):
+    """Start (or with None, stop) gathering timings of a request in this thread"""
+    _CURRENT.timings = timings
+
+
+class ViewMetrics:
+    """Totals of requests to a single view"""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.database = 0.0
+        self.templates = 0.0
+        self.total = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+
+class MetricsRegistry:
+    """Per-view totals of all instrumented requests handled by this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, timings):
+        """Add timings of a finished request to the totals of its view"""
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            metrics.requests += 1
+            metrics.queries += timings.queries
+            metrics.database += timings.database
+            metrics.templates += timings.templates
+            metrics.total += timings.total
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if timings.total <= bound:
+                    metrics.buckets[i] += 1
+
+    def reset(self):
+        """Forget all totals"""
+        with self.lock:
+            self.views = {}
+
+    def prometheus(self):
+        """Render the totals in Prometheus text exposition format"""
+        with self.lock:
+            views = sorted((view, dict(vars(metrics), buckets=list(metrics.buckets)))
+                           for view, metrics in self.views.items())
+        families = OrderedDict((
+            ('flights_requests_total', ('counter', 'Requests handled', 'requests')),
+            ('flights_db_queries_total', ('counter', 'SQL queries made', 'queries')),
+            ('flights_db_seconds_total', ('counter', 'Time spent on SQL queries', 'database')),
+            ('flights_template_seconds_total', ('counter', 'Time spent rendering templates',
+                                                'templates')),
+        ))
+        lines = []
+        for name, (kind, description, field) in families.items():
+            lines += ['# HELP %s %s' % (name, description), '# TYPE %s %s' % (name, kind)]
+            lines += ['%s{view="%s"} %s' % (name, view, metrics[field])
+                      for view, metrics in views]
+
+        name = 'flights_request_duration_seconds'
+        lines += ['# HELP %s Time of handling requests' % name, '# TYPE %s histogram' % name]
+        for view, metrics in views:
+            for bound, count in zip(DURATION_BUCKETS, metrics['buckets']):
+                lines.append('%s_bucket{view="%s",le="%s"} %d' % (name, view, bound, count))
+            lines.append('%s_bucket{view="%s",le="+Inf"} %d' % (name, view, metrics['requests']))
+            lines.append('%s_sum{view="%s"} %s' % (name, view, metrics['total']))
+            lines.append('%s_count{view="%s"} %d' % (name, view, metrics['requests']))
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+
+
+class TimedTemplate:
+    """Template of the Django backend adding its render time to the current request timings"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        """Render the wrapped template, timing it"""
+        start = perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timings = current_timings()
+            if timings is not None:
+                timings.templates += perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Django template backend whose templates time their rendering"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
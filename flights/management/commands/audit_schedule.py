@@ -0,0 +1,36 @@
+"""Check the whole stored schedule against flight and reservation rules"""
+from collections import Counter
+from time import perf_counter
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from flights.audit import audit_schedule
+from flights.routers import snapshot
+
+
+class Command(BaseCommand):
+    """Load flights and reservations into arrays once and report every rule they break"""
+    help = 'Report flights and reservations breaking schedule rules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Report at most this many violations of each rule')
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        try:
+            violations = snapshot(audit_schedule, any_database=True)()
+        except ImproperlyConfigured as err:
+            raise CommandError(err) from err
+
+        reported = Counter()
+        for violation in violations:
+            reported[violation.rule] += 1
+            if options['limit'] is None or reported[violation.rule] <= options['limit']:
+                self.stdout.write('%s, flight%s %s: %s' % (
+                    violation.rule, 's' if len(violation.flights) > 1 else '',
+                    ', '.join(map(str, violation.flights)), violation.message))
+        self.stdout.write('%d violations found in %.1f s%s' % (
+            len(violations), perf_counter() - start,
+            ''.join(', %d of %s' % (count, rule) for rule, count in sorted(reported.items()))))
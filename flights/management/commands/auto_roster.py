@@ -0,0 +1,40 @@
+"""Give crews to flights that don't have one"""
+from time import perf_counter
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from flights.rostering import STRATEGIES, auto_roster
+
+
+class Command(BaseCommand):
+    """Roster crew-less flights of a date range in one sweep, keeping crews from leading
+    simultaneous flights"""
+    help = 'Assign crews to crew-less flights taking off between two dates (inclusive)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('first_day', help='YYYY-MM-DD')
+        parser.add_argument('last_day', nargs='?', help='YYYY-MM-DD, first_day by default')
+        parser.add_argument('--strategy', choices=STRATEGIES, default=STRATEGIES[0],
+                            help='"tight" keeps crew idle gaps short, "balanced" spreads flights '
+                                 'among crews')
+
+    def handle(self, *args, **options):
+        try:
+            first_day = parse_date(options['first_day'])
+            last_day = parse_date(options['last_day'] or options['first_day'])
+        except ValueError:
+            first_day = last_day = None
+        if first_day is None or last_day is None or last_day < first_day:
+            raise CommandError('Expected a valid range of dates')
+
+        start = perf_counter()
+        try:
+            with transaction.atomic():
+                assigned, unassigned = auto_roster(first_day, last_day, options['strategy'])
+        except ValidationError as err:
+            raise CommandError('; '.join(err.messages)) from err
+        self.stdout.write('%d flights got crews, %d left without one in %.1f s' % (
+            assigned, unassigned, perf_counter() - start))
@@ -0,0 +1,144 @@
+"""Compare how WSGI and ASGI serving copes with many idle event streams"""
+import asyncio
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+
+from flights.asgi import ASGIHandler, wsgi_environ
+from flights.events import backend, live_updates
+from flights.models import Flight
+
+READ_PATHS = ('/REST/flights', '/REST/crews', '/', '/details/%d')
+HEADERS = [(b'host', b'localhost')]
+
+
+def scope_for(path, query=b''):
+    """ASGI scope of a GET request"""
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query,
+            'headers': HEADERS, 'server': ('localhost', 80)}
+
+
+def percentiles(latencies):
+    """Median and 95th percentile latency in milliseconds"""
+    ordered = sorted(latencies)
+    return [round(ordered[max(0, math.ceil(fraction * len(ordered)) - 1)] * 1000, 1)
+            for fraction in (.5, .95)]
+
+
+def wsgi_run(threads, streams, reads, paths, hold):
+    """Serve like a threaded WSGI server would: a thread per connection from a fixed pool"""
+    handler = WSGIHandler()
+
+    def stream(until):
+        content = handler(wsgi_environ(scope_for('/REST/events'), b''), lambda *args: None)
+        try:
+            for _ in content:
+                if perf_counter() >= until:
+                    break
+        finally:
+            content.close()
+
+    def read(path, queued):
+        content = handler(wsgi_environ(scope_for(path), b''), lambda *args: None)
+        b''.join(content)
+        content.close()
+        return perf_counter() - queued
+
+    def wake(until, done):
+        # streams only look at the clock when they get an event, so keep sending some
+        while not done.wait(max(0.05, until - perf_counter())):
+            backend().publish('benchmark', {})
+
+    done = threading.Event()
+    until = perf_counter() + hold
+    waker = threading.Thread(target=wake, args=(until, done))
+    waker.start()
+    try:
+        with ThreadPoolExecutor(threads) as pool:
+            for _ in range(streams):
+                pool.submit(stream, until)
+            latencies = [pool.submit(read, paths[i % len(paths)], perf_counter())
+                         for i in range(reads)]
+            return [future.result() for future in latencies]
+    finally:
+        done.set()
+        waker.join()
+
+
+def asgi_run(threads, streams, reads, paths, hold):
+    """Serve with the ASGI handler: Django in a pool of threads, event streams in coroutines"""
+    application = ASGIHandler(threads)
+
+    async def stream(until):
+        requested = []
+
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {'type': 'http.request', 'body': b''}
+            await asyncio.sleep(until - perf_counter())
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            pass
+        await application(scope_for('/REST/events'), receive, send)
+
+    async def read(path):
+        queued = perf_counter()
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            pass
+        await application(scope_for(path), receive, send)
+        return perf_counter() - queued
+
+    async def run():
+        until = perf_counter() + hold
+        holders = [asyncio.ensure_future(stream(until)) for _ in range(streams)]
+        await asyncio.sleep(0)
+        latencies = await asyncio.gather(*(read(paths[i % len(paths)]) for i in range(reads)))
+        await asyncio.gather(*holders)
+        return latencies
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        application.pool.shutdown()
+        loop.close()
+
+
+class Command(BaseCommand):
+    """Open idle event streams, then send read requests meanwhile, served either like a threaded
+    WSGI server or with the ASGI handler, with the same number of threads"""
+    help = 'Compare read latency of WSGI and ASGI serving while event streams are held open'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--streams', type=int, default=64,
+                            help='Idle event stream connections')
+        parser.add_argument('--reads', type=int, default=200)
+        parser.add_argument('--hold', type=float, default=2,
+                            help='Seconds for which streams stay open')
+
+    def handle(self, *args, **options):
+        flight = Flight.objects.order_by('pk').first()
+        if flight is None:
+            raise CommandError('There are no flights, load some with init_data.py first')
+        if not live_updates():
+            raise CommandError('The event stream is off, turn it on with FLIGHTS_LIVE_UPDATES=1')
+        paths = [path % flight.pk if '%' in path else path for path in READ_PATHS]
+
+        for name, run in (('WSGI', wsgi_run), ('ASGI', asgi_run)):
+            start = perf_counter()
+            latencies = run(options['threads'], options['streams'], options['reads'], paths,
+                            options['hold'])
+            self.stdout.write('%s: %d reads with %d open streams in %.1f s, p50 %.1f ms, '
+                              'p95 %.1f ms' % (name, len(latencies), options['streams'],
+                                               perf_counter() - start, *percentiles(latencies)))
@@ -0,0 +1,89 @@
+"""Compare the indexed schedule conflict checks against plain database queries"""
+from datetime import timedelta
+from random import Random
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from flights.conflicts import SCHEDULE
+from flights.models import Airport, Flight, Plane
+
+
+def query_conflicts(flight):
+    """Overlap and daily limit checks done the old way, with database queries"""
+    simultaneous_flights = Flight.objects.filter(
+        Q(takeoffTime__range=(flight.takeoffTime, flight.landingTime)) |
+        Q(landingTime__range=(flight.takeoffTime, flight.landingTime)) |
+        (Q(takeoffTime__lte=flight.takeoffTime) & Q(landingTime__gte=flight.landingTime)))
+    daily = [Flight.objects.filter(plane_id=flight.plane_id)
+             .exclude(landingTime__date__lt=day).exclude(takeoffTime__date__gt=day).count()
+             for day in (flight.takeoffTime.date(), flight.landingTime.date())]
+    return (daily, simultaneous_flights.filter(plane_id=flight.plane_id).exclude(pk=flight.pk)
+            .exists())
+
+
+def index_conflicts(flight):
+    """Overlap and daily limit checks done with the schedule index"""
+    daily = [SCHEDULE.daily_flights(flight, moment)
+             for moment in (flight.takeoffTime, flight.landingTime)]
+    return daily, SCHEDULE.plane_conflicts(flight) > 0
+
+
+class Command(BaseCommand):
+    """Seed a large schedule inside a rolled back transaction and time both kinds of checks"""
+    help = 'Benchmark schedule conflict detection on a generated schedule'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--flights', type=int, default=100000)
+        parser.add_argument('--planes', type=int, default=500)
+        parser.add_argument('--checks', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rand = Random(options['seed'])
+        with transaction.atomic():
+            flights = self.seed(rand, options['flights'], options['planes'])
+            sample = list(Flight.objects.filter(
+                pk__in=rand.sample(flights, min(options['checks'], len(flights)))))
+
+            SCHEDULE.reset()
+            start = perf_counter()
+            SCHEDULE.ensure_loaded()
+            build_time = perf_counter() - start
+
+            timings = {}
+            for name, check in (('database', query_conflicts), ('index', index_conflicts)):
+                start = perf_counter()
+                for flight in sample:
+                    check(flight)
+                timings[name] = (perf_counter() - start) / len(sample)
+
+            transaction.set_rollback(True)
+        SCHEDULE.reset()
+
+        self.stdout.write('Flights: %d, checks: %d' % (len(flights), len(sample)))
+        self.stdout.write('Index build: %.3f s' % build_time)
+        for name, took in timings.items():
+            self.stdout.write('%s check: %.1f us' % (name.capitalize(), took * 1e6))
+        self.stdout.write('Speedup: %.0fx' % (timings['database'] / timings['index']))
+
+    @staticmethod
+    def seed(rand, flight_count, plane_count):
+        """Create a conflict-free schedule spread evenly among planes"""
+        airports = [Airport.objects.create(name='Bench airport %d' % i) for i in range(2)]
+        planes = Plane.objects.bulk_create(
+            Plane(identifier='BENCH%05d' % i, passengerLimit=100) for i in range(plane_count))
+        start = timezone.now()
+        flights = []
+        for i in range(flight_count):
+            plane = planes[i % plane_count]
+            takeoff = start + timedelta(hours=7 * (i // plane_count), minutes=rand.randrange(60))
+            flights.append(Flight(plane=plane, takeoffTime=takeoff,
+                                  landingTime=takeoff + timedelta(minutes=rand.randrange(60, 300)),
+                                  takeoffAirport=airports[i % 2],
+                                  landingAirport=airports[1 - i % 2]))
+        Flight.objects.bulk_create(flights)
+        return list(Flight.objects.filter(plane__in=planes).values_list('pk', flat=True))
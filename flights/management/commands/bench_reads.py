@@ -0,0 +1,89 @@
+"""Measure how read throughput holds up while seats are being booked"""
+import threading
+from itertools import cycle
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from flights.models import Flight, Passenger
+
+READ_PATHS = ('/', '/details/%d', '/REST/flights', '/REST/crews')
+BENCH_USER = 'bench-reads'
+
+
+def hammer(make_request, until, results):
+    """Repeat requests until a deadline, counting the successful ones and the failures"""
+    done = failed = 0
+    try:
+        while perf_counter() < until:
+            try:
+                ok = make_request()
+            except Exception:  # pylint: disable=broad-except
+                ok = False
+            done += ok
+            failed += not ok
+    finally:
+        connection.close()
+    results.append((done, failed))
+
+
+class Command(BaseCommand):
+    """Run readers alone, then readers together with bookers, with the Django test client in
+    threads of this process against the configured database"""
+    help = 'Compare read throughput alone and during a booking storm on a single flight'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--bookers', type=int, default=8)
+
+    def handle(self, *args, **options):
+        flight = Flight.objects.order_by('pk').first()
+        if flight is None:
+            raise CommandError('There are no flights, load some with init_data.py first')
+        user = User.objects.create_user(BENCH_USER)
+        try:
+            alone = self.run_phase(options, flight, user, bookers=0)
+            storm = self.run_phase(options, flight, user, bookers=options['bookers'])
+        finally:
+            Passenger.objects.filter(surname=BENCH_USER).delete()
+            user.delete()
+
+        for name, (reads, failed_reads, bookings, failed_bookings) in (('alone', alone),
+                                                                       ('storm', storm)):
+            self.stdout.write('Reads %s: %.1f/s (%d failed), bookings: %.1f/s (%d failed)' % (
+                name, reads / options['seconds'], failed_reads,
+                bookings / options['seconds'], failed_bookings))
+
+    @staticmethod
+    def run_phase(options, flight, user, bookers):
+        """Run reader and booker threads for a while, sum up what they managed to do"""
+        until = perf_counter() + options['seconds']
+        read_results, booking_results, threads = [], [], []
+
+        for _ in range(options['readers']):
+            client = Client(HTTP_HOST='localhost')
+            paths = cycle(path % flight.pk if '%' in path else path for path in READ_PATHS)
+            threads.append(threading.Thread(target=hammer, args=(
+                lambda client=client, paths=paths: client.get(next(paths)).status_code == 200,
+                until, read_results)))
+        for i in range(bookers):
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(user)
+            tickets = cycle((1, 0))
+            threads.append(threading.Thread(target=hammer, args=(
+                lambda client=client, name='n%d' % i, tickets=tickets: client.post('/reserve', {
+                    'name': name, 'surname': BENCH_USER, 'flight': flight.pk,
+                    'ticketCount': next(tickets)}).status_code == 302,
+                until, booking_results)))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (sum(done for done, _ in read_results), sum(failed for _, failed in read_results),
+                sum(done for done, _ in booking_results),
+                sum(failed for _, failed in booking_results))
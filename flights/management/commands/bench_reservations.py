@@ -0,0 +1,112 @@
+"""Compare booking throughput of locking and optimistic reservations under contention"""
+import threading
+from datetime import timedelta
+from functools import partial
+from random import Random
+from time import perf_counter
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from flights.benchmark.runner import summarize
+from flights.booking import DEFAULT_RETRIES, lock_reservation, swap_reservation
+from flights.models import Airport, Flight, Passenger, Plane, Reservation
+from flights.passengers import PASSENGERS
+
+MODES = (('locking', lock_reservation),
+         ('optimistic', partial(swap_reservation, retries=DEFAULT_RETRIES)))
+
+
+def booker(book, flight_ids, passenger_ids, count, seed, samples):
+    """Book [count] random reservations, a transaction each, recording their latencies and
+    whether they were rejected (e.g. after running out of retries) or failed in the database
+    (e.g. SQLite's "database is locked")"""
+    rand = Random(seed)
+    try:
+        for _ in range(count):
+            start = perf_counter()
+            outcome = None
+            try:
+                with transaction.atomic():
+                    book(rand.choice(passenger_ids), rand.choice(flight_ids), rand.randint(1, 4))
+            except ValidationError:
+                outcome = 'rejected'
+            except DatabaseError:
+                outcome = 'database'
+            samples.append((perf_counter() - start, outcome))
+    finally:
+        connection.close()
+
+
+def consistent(flight_ids):
+    """Tell whether seat counters of flights match their reservations"""
+    reserved = dict(Reservation.objects.filter(flight_id__in=flight_ids).order_by()
+                    .values_list('flight').annotate(total=Sum('ticketCount')))
+    return all(stored == reserved.get(pkey, 0) for pkey, stored in
+               Flight.objects.filter(pk__in=flight_ids).values_list('pk', 'reservedSeats'))
+
+
+class Command(BaseCommand):
+    """Let many threads book seats on a few hot flights for a few passengers, in both modes, on
+    flights created for the run and removed afterwards"""
+    help = 'Compare throughput of locking and optimistic reservations with concurrent bookers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookers', type=int, default=64, help='Concurrent threads')
+        parser.add_argument('--bookings', type=int, default=20, help='Bookings per thread')
+        parser.add_argument('--flights', type=int, default=1, help='Hot flights')
+        parser.add_argument('--passengers', type=int, default=16,
+                            help='Passengers whose reservations are changed')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        flight_ids, passenger_ids = self.seed(options['flights'], options['passengers'])
+        try:
+            for name, book in MODES:
+                samples = []
+                threads = [threading.Thread(target=booker, args=(
+                    book, flight_ids, passenger_ids, options['bookings'], options['seed'] + i,
+                    samples)) for i in range(options['bookers'])]
+                start = perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = perf_counter() - start
+                booked = [took for took, outcome in samples if outcome is None]
+                report = summarize(booked, [], len(samples) - len(booked), elapsed)
+                outcomes = [outcome for _, outcome in samples]
+                self.stdout.write(
+                    '%s: %d of %d bookings by %d bookers done (%d rejected, %d database errors), '
+                    '%.1f/s, p50 %.1f ms, p99 %.1f ms, counters %s' % (
+                        name, len(booked), len(samples), options['bookers'],
+                        outcomes.count('rejected'), outcomes.count('database'), report['rps'],
+                        report['p50_ms'], report['p99_ms'],
+                        'consistent' if consistent(flight_ids) else 'broken'))
+                Reservation.objects.filter(flight_id__in=flight_ids).delete()
+        finally:
+            Flight.objects.filter(pk__in=flight_ids).delete()
+            Plane.objects.filter(identifier='BENCHRES').delete()
+            Airport.objects.filter(name__startswith='Bench reservations').delete()
+            Passenger.objects.filter(pk__in=passenger_ids).delete()
+            PASSENGERS.reset()
+
+    @staticmethod
+    def seed(flight_count, passenger_count):
+        """Create flights of a large plane and their passengers; return their ids"""
+        with transaction.atomic():
+            airports = [Airport.objects.create(name='Bench reservations %d' % i)
+                        for i in range(2)]
+            plane = Plane.objects.create(identifier='BENCHRES', passengerLimit=10 ** 6)
+            start = timezone.now()
+            flights = [Flight.objects.create(
+                plane=plane, takeoffAirport=airports[i % 2], landingAirport=airports[1 - i % 2],
+                takeoffTime=start + timedelta(hours=8 * i),
+                landingTime=start + timedelta(hours=8 * i + 2))
+                       for i in range(flight_count)]
+            passengers = PASSENGERS.resolve_many(('Bench', 'Booker %d' % i)
+                                                 for i in range(passenger_count))
+        return [flight.pk for flight in flights], list(passengers.values())
@@ -0,0 +1,79 @@
+"""Load test the reservation, crew assignment, timetable and flight details endpoints"""
+import json
+import os
+import random
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from flights.benchmark.runner import compare, run_scenario
+from flights.benchmark.scenarios import SCENARIOS, seed
+
+
+class Command(BaseCommand):
+    """Seed a throwaway test database, run each chosen scenario with concurrent clients and
+    print a JSON report; with --baseline, fail if a scenario got slower than in a saved report"""
+    help = 'Measure p50/p95/p99 latency, queries per request and requests per second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1,
+                            help='Multiple of the data size of init_data.py')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=400,
+                            help='Requests per scenario')
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                            help='Scenario to run, all of them by default')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also save the report to a file')
+        parser.add_argument('--baseline', help='Report of an earlier run to compare with')
+        parser.add_argument('--tolerance', type=float, default=.2,
+                            help='Fraction by which metrics may get worse than the baseline')
+
+    def handle(self, *args, **options):
+        if min(options['scale'], options['threads'], options['requests']) < 1:
+            raise CommandError('Scale, threads and requests have to be positive')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as stream:
+                    baseline = json.load(stream)['scenarios']
+            except (OSError, ValueError, KeyError) as err:
+                raise CommandError('Cannot read baseline %s: %s' % (options['baseline'],
+                                                                    err)) from err
+
+        report = {'scale': options['scale'], 'threads': options['threads'],
+                  'scenarios': self.run(options)}
+        output = json.dumps(report, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(output)
+
+        if baseline is not None:
+            regressions = compare(report['scenarios'], baseline, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError('%d regressions against %s' % (len(regressions),
+                                                                  options['baseline']))
+
+    @staticmethod
+    def run(options):
+        """Run scenarios against a test database created for this run only; SQLite gets a file
+        instead of its default in-memory test database, so that all threads see the data"""
+        old_name = connection.settings_dict['NAME']
+        test_settings = connection.settings_dict['TEST']
+        temporary = connection.vendor == 'sqlite' and not test_settings.get('NAME')
+        if temporary:
+            test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            fixture = seed(options['scale'], random.Random(options['seed']))
+            return {name: run_scenario(SCENARIOS[name], fixture, options['threads'],
+                                       options['requests'], options['seed'])
+                    for name in options['scenario'] or SCENARIOS}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if temporary:
+                os.rmdir(os.path.dirname(test_settings.pop('NAME')))
@@ -0,0 +1,34 @@
+"""Export the schedule as NumPy arrays for analytics"""
+import tempfile
+from time import perf_counter
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from flights.export import archive, export_schedule
+from flights.routers import snapshot
+
+
+class Command(BaseCommand):
+    """Write a snapshot of airports, planes, flights and reservations as columns of .npy files,
+    or as a single .npz archive of them"""
+    help = 'Export the schedule into a directory of .npy files, or an .npz file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Directory to write, or a file ending with .npz')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        start = perf_counter()
+        try:
+            if path.endswith('.npz'):
+                with tempfile.TemporaryDirectory() as directory, open(path, 'wb') as target:
+                    rows = snapshot(export_schedule, any_database=True)(directory)
+                    archive(directory, target)
+            else:
+                rows = snapshot(export_schedule, any_database=True)(path)
+        except (OSError, ImproperlyConfigured) as err:
+            raise CommandError('Cannot export to %s: %s' % (path, err)) from err
+        self.stdout.write('%s exported in %.1f s' % (
+            ', '.join('%d %s' % (count, table) for table, count in rows.items()),
+            perf_counter() - start))
@@ -0,0 +1,54 @@
+"""Load a flight schedule from a CSV, JSON or JSON lines file"""
+import csv
+import os
+import sys
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from flights.importer import ScheduleImport, read_csv, read_json, read_json_lines, \
+    DEFAULT_BATCH_SIZE, COLUMNS
+
+READERS = {'csv': read_csv, 'json': read_json, 'jsonl': read_json_lines}
+
+
+class Command(BaseCommand):
+    """Read a schedule in batches, each validated and inserted in bulk before the next one"""
+    help = 'Import flights from a CSV, JSON or JSON lines file with fields: %s' % \
+        ', '.join(COLUMNS)
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Schedule file, "-" for standard input')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='File format, guessed from the extension by default')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='How many flights to validate and insert at a time')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only validate the schedule and report rejected rows')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1][1:].lower()
+        if file_format not in READERS:
+            raise CommandError('Cannot tell the format of %s, choose one with --format' % path)
+        if options['batch_size'] < 1:
+            raise CommandError('Batch size has to be positive')
+
+        start = perf_counter()
+        schedule = ScheduleImport()
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+            # a dry run validates batches against the earlier ones too, and then rolls back
+            with stream, transaction.atomic():
+                for line, reason in schedule.stream(READERS[file_format](stream),
+                                                    options['batch_size']):
+                    self.stderr.write('Line %d rejected: %s' % (line, reason))
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+        except (OSError, csv.Error) as err:
+            raise CommandError('Cannot read %s: %s' % (path, err)) from err
+
+        saved = 0 if options['dry_run'] else schedule.saved
+        self.stdout.write('%d flights imported, %d rejected in %.1f s' % (
+            saved, schedule.rejections, perf_counter() - start))
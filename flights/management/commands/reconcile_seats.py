@@ -0,0 +1,97 @@
+"""Verify and repair seat maps and counters of flights"""
+from collections import defaultdict, namedtuple
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from flights.models import Flight, Plane, Reservation, rebuild_seats
+from flights.seating import seat_count, to_bits, to_map
+
+# Seats of a flight: its counter, its seat map, seats of its reservations' maps and their tickets
+StaleSeats = namedtuple('StaleSeats', ('flight', 'counted', 'mapped', 'held', 'reserved',
+                                       'misseated'))
+
+
+class Holdings:
+    """Seats held and tickets reserved by reservations of a flight"""
+
+    def __init__(self):
+        self.seats = 0  # union of their seat maps
+        self.overlapping = False
+        self.tickets = 0
+        self.misseated = []  # reservations holding other numbers of seats than tickets
+
+    def add(self, pkey, seat_map, ticket_count):
+        """Count a reservation in"""
+        bits = to_bits(seat_map)
+        self.overlapping |= bool(self.seats & bits)
+        self.seats |= bits
+        self.tickets += ticket_count
+        if seat_count(bits) != ticket_count:
+            self.misseated.append(pkey)
+
+
+def stale_seats():
+    """Find flights whose seat counter, seat map and reservations' seat maps and tickets don't
+    all agree, as StaleSeats"""
+    holdings = defaultdict(Holdings)
+    for flight, pkey, seat_map, ticket_count in Reservation.objects.order_by('pk') \
+            .values_list('flight', 'pk', 'seatMap', 'ticketCount').iterator():
+        holdings[flight].add(pkey, seat_map, ticket_count)
+    stale = []
+    for pkey, counted, seat_map in Flight.objects.order_by('pk') \
+            .values_list('pk', 'reservedSeats', 'seatMap').iterator():
+        held = holdings.get(pkey, Holdings())
+        bits = to_bits(seat_map)
+        if counted != held.tickets or bits != held.seats or held.overlapping or held.misseated:
+            stale.append(StaleSeats(pkey, counted, seat_count(bits), seat_count(held.seats),
+                                    held.tickets, held.misseated))
+    return stale
+
+
+def repair_seats(flight_id):
+    """Lock the row of a flight and give its reservations as many seats as they have tickets,
+    keeping the seats they hold where possible, then set the flight's seat map and counter"""
+    plane = Flight.objects.select_for_update().filter(pk=flight_id) \
+        .values_list('plane_id', flat=True).get()
+    capacity = Plane.objects.filter(pk=plane).values_list('passengerLimit', flat=True).get()
+    reservations = list(Reservation.objects.filter(flight=flight_id).order_by('pk')
+                        .values_list('pk', 'seatMap', 'ticketCount'))
+    taken, seat_maps = rebuild_seats(capacity, [(seat_map, ticket_count)
+                                                for _, seat_map, ticket_count in reservations])
+    for (pkey, seat_map, _), new_map in zip(reservations, seat_maps):
+        if bytes(seat_map) != new_map:
+            Reservation.objects.filter(pk=pkey).update(seatMap=new_map, version=F('version') + 1)
+    Flight.objects.filter(pk=flight_id).update(seatMap=to_map(taken),
+                                               reservedSeats=seat_count(taken),
+                                               seatsVersion=F('seatsVersion') + 1)
+
+
+class Command(BaseCommand):
+    """Compare Flight.reservedSeats and seat maps of flights with seat maps and tickets of their
+    reservations, optionally rebuild them"""
+    help = 'Check that flight seats match reservations, repair them with --fix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rebuild mismatched seats')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            stale = stale_seats()
+            for seats in stale:
+                line = 'Flight %d: %d seats counted, %d in its seat map, %d held by ' \
+                    'reservations, %d reserved' % seats[:5]
+                if seats.misseated:
+                    line += '; reservations %s hold other numbers of seats than tickets' % \
+                        ', '.join(str(pkey) for pkey in seats.misseated)
+                self.stdout.write(line)
+            if options['fix']:
+                for seats in stale:
+                    repair_seats(seats.flight)
+                overbooked = stale_seats()
+
+        status = 'repaired' if options['fix'] else 'found'
+        self.stdout.write('%d flights with stale seats %s' % (len(stale), status))
+        if options['fix'] and overbooked:
+            self.stdout.write('%d flights have more tickets than seats' % len(overbooked))
@@ -0,0 +1,36 @@
+"""Measure every request and report it in a Server-Timing header and in per-view metrics"""
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.db import connections
+
+from flights.instrumentation import METRICS, RequestTimings, set_current_timings
+
+UNRESOLVED_VIEW = 'unresolved'
+
+
+class InstrumentationMiddleware:
+    """Count queries and time database work, template rendering and the whole request, per
+    view name. Content of streaming responses is produced after this middleware returns, so
+    only the part before the first chunk is measured"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        set_current_timings(timings)
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.count_query))
+                response = self.get_response(request)
+        finally:
+            timings.total = perf_counter() - start
+            set_current_timings(None)
+
+        match = getattr(request, 'resolver_match', None)
+        METRICS.record(match.view_name if match else UNRESOLVED_VIEW, timings)
+        response['Server-Timing'] = timings.server_timing()
+        return response
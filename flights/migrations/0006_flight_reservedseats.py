@@ -0,0 +1,30 @@
+# Generated by Django 2.0.13 on 2026-10-18 09:25
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def count_reserved_seats(apps, schema_editor):
+    """Fill seat counters of existing flights with sums of their reservations"""
+    flight_model = apps.get_model('flights', 'Flight')
+    reservation_model = apps.get_model('flights', 'Reservation')
+    totals = reservation_model.objects.filter(flight=OuterRef('pk')).values('flight') \
+        .annotate(total=Sum('ticketCount')).values('total')
+    flight_model.objects.update(reservedSeats=Coalesce(Subquery(totals), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0005_auto_20180607_2040'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flight',
+            name='reservedSeats',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_reserved_seats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.0.13 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0006_flight_reservedseats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['plane', 'takeoffTime'], name='flight_plane_takeoff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['plane', 'landingTime'], name='flight_plane_landing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['crew', 'takeoffTime'], name='flight_crew_takeoff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['takeoffTime', 'landingTime'], name='flight_times_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+from flights.passengers import passenger_key
+
+
+def fill_name_keys(apps, schema_editor):
+    """Key existing passengers, merging the ones whose names differ only in letter case or
+    whitespace into the earliest of them; their reservations of one flight are added up, which
+    leaves seat counters of flights as they are"""
+    passenger_model = apps.get_model('flights', 'Passenger')
+    reservation_model = apps.get_model('flights', 'Reservation')
+    kept = {}
+    for passenger in passenger_model.objects.order_by('pk'):
+        key = passenger_key(passenger.name, passenger.surname)
+        if key not in kept:
+            kept[key] = passenger
+            passenger.nameKey = key
+            passenger.save(update_fields=['nameKey'])
+            continue
+        for reservation in reservation_model.objects.filter(passenger=passenger):
+            same_flight = reservation_model.objects.filter(passenger=kept[key],
+                                                           flight_id=reservation.flight_id).first()
+            if same_flight is None:
+                reservation.passenger = kept[key]
+                reservation.save(update_fields=['passenger'])
+            else:
+                same_flight.ticketCount += reservation.ticketCount
+                same_flight.save(update_fields=['ticketCount'])
+                reservation.delete()
+        passenger.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0007_flight_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='passenger',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='passenger',
+            name='nameKey',
+            field=models.TextField(default='', editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='passenger',
+            name='nameKey',
+            field=models.TextField(editable=False, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0008_passenger_namekey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='flight',
+            index=models.Index(fields=['takeoffAirport', 'landingAirport', 'takeoffTime'],
+                               name='flight_route_takeoff_idx'),
+        ),
+    ]
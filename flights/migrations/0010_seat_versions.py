@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0009_flight_route_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flight',
+            name='seatsVersion',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
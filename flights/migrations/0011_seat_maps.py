@@ -0,0 +1,65 @@
+# Generated by Django 2.0.13 on 2026-10-18 10:32
+
+import django.core.validators
+from django.db import migrations, models
+
+from flights.seating import seat_count, take_seats, to_map
+
+
+def assign_seats(apps, schema_editor):
+    """Give reservations made before seat maps the lowest seats free, in the order they were
+    made, and recount seats of their flights; tickets over the capacity get no seats, and
+    reservations left with fewer seats than tickets are listed, as reconcile_seats lists them"""
+    flight_model = apps.get_model('flights', 'Flight')
+    reservation_model = apps.get_model('flights', 'Reservation')
+    flight_id, taken, capacity = None, 0, 0
+    misseated = []
+    reserved = reservation_model.objects.filter(ticketCount__gt=0) \
+        .select_related('flight__plane').order_by('flight_id', 'pk')
+    for reservation in reserved.iterator():
+        if reservation.flight_id != flight_id:
+            if flight_id is not None:
+                flight_model.objects.filter(pk=flight_id).update(
+                    seatMap=to_map(taken), reservedSeats=seat_count(taken))
+            flight_id, taken = reservation.flight_id, 0
+            capacity = reservation.flight.plane.passengerLimit
+        free = capacity - seat_count(taken)
+        held = take_seats(taken, min(reservation.ticketCount, free), capacity)
+        taken |= held
+        if seat_count(held) < reservation.ticketCount:
+            misseated.append(reservation.pk)
+        reservation_model.objects.filter(pk=reservation.pk).update(seatMap=to_map(held))
+    if flight_id is not None:
+        flight_model.objects.filter(pk=flight_id).update(
+            seatMap=to_map(taken), reservedSeats=seat_count(taken))
+    if misseated:
+        print('\n  Reservations with more tickets than seats, see reconcile_seats: %s' %
+              ', '.join(str(pkey) for pkey in misseated))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flights', '0010_seat_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flight',
+            name='seatMap',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.AddField(
+            model_name='plane',
+            name='seatsPerRow',
+            field=models.PositiveSmallIntegerField(default=6, validators=[
+                django.core.validators.MinValueValidator(1),
+                django.core.validators.MaxValueValidator(10)]),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='seatMap',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(assign_seats, migrations.RunPython.noop),
+    ]
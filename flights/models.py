@@ -1,29 +1,39 @@
 """Define data entities used by the whole flight management app"""
 from datetime import timedelta
 
-from django.core.exceptions import ValidationError
-from django.core.validators import MinValueValidator
-from django.db.models import Value, Q
-from django.db.models.functions import Coalesce
+from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models import F
 from django.dispatch import receiver
-from django.db.models.signals import post_save
-from django.db import models
+from django.core.signals import request_started
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.db import models, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from flights.caching import schedule_changed
+from flights.events import flight_changed, publish_seats, reservation_changed
+from flights.conflicts import date_bounds, schedule
+from flights.database import check_connections
+from flights.passengers import passenger_deleted, passenger_key
+from flights.seating import DEFAULT_SEATS_PER_ROW, SEAT_LETTERS, last_seats, seat_count, \
+    take_seats, to_bits, to_map
 
 DAILY_FLIGHTS_PER_PLANE = 4
 MIN_SEAT_COUNT = 20
 MIN_FLIGHT_MINUTES = 30
+SEAT_FIELDS = ('seatMap', 'reservedSeats', 'seatsVersion')  # of a flight, see reseat()
 
 
-#
-@receiver(post_save)
+# connected to models of this app only, at the bottom of this file
 # pylint: disable=unused-argument
 # This format of function arguments is needed by Django
-def post_save_handler(sender, instance, *args, **kwargs):
+def pre_save_handler(sender, instance, *args, **kwargs):
     # pylint: enable=unused-argument
-    """Ensure after a change made to the db state that everything is all right; throw an exception
-    that will cause a rollback of an atomic transaction in case of database integrity violation
-    during the ongoing model instance update/creation"""
-    instance.full_clean()
+    """Ensure before a change is made to the db state that everything is all right; throw an
+    exception that will stop the ongoing model instance update/creation. Uniqueness is left to
+    database constraints"""
+    instance.full_clean(validate_unique=False)
 
 
 class Airport(models.Model):
@@ -38,6 +48,10 @@ class Plane(models.Model):
     """Vehicle that a flight is made with, has a limited seat space"""
     identifier = models.TextField(unique=True, primary_key=True)
     passengerLimit = models.PositiveIntegerField(validators=[MinValueValidator(MIN_SEAT_COUNT)])
+    # seats are laid out in rows of this many, see flights.seating
+    seatsPerRow = models.PositiveSmallIntegerField(
+        default=DEFAULT_SEATS_PER_ROW,
+        validators=[MinValueValidator(1), MaxValueValidator(len(SEAT_LETTERS))])
 
     def __str__(self):
         return 'Plane %s with %d seats' % (self.identifier, self.passengerLimit)
@@ -60,12 +74,25 @@ class Passenger(models.Model):
     name = models.TextField()
     surname = models.TextField()
 
-    class Meta:
-        unique_together = ('name', 'surname')
+    # identifies the passenger regardless of letter case and whitespace, see flights.passengers
+    nameKey = models.TextField(unique=True, editable=False)
 
     def __str__(self):
         return 'Passenger %s %s' % (self.name, self.surname)
 
+    def save(self, *args, **kwargs):
+        """Key the passenger by the current names"""
+        self.nameKey = passenger_key(self.name, self.surname)
+        super().save(*args, **kwargs)
+
+
+class ReservationQuerySet(models.QuerySet):
+    """Shapes of reservation queries used by views"""
+
+    def for_details(self):
+        """Reservations listed on a flight's page, with their passengers"""
+        return self.select_related('passenger').filter(ticketCount__gt=0).order_by('-updated')
+
 
 class Reservation(models.Model):
     """Tells about how many seats has a passenger reserved"""
@@ -76,6 +103,14 @@ class Reservation(models.Model):
 
     updated = models.DateTimeField(auto_now=True)
 
+    # incremented by every change of ticketCount, see swap_tickets(), and of seats repaired by
+    # reconcile_seats
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # seats held, as many as ticketCount, see flights.seating
+    seatMap = models.BinaryField(default=b'', editable=False)
+
+    objects = ReservationQuerySet.as_manager()
+
     class Meta:
         unique_together = ('passenger', 'flight')
 
@@ -83,22 +118,191 @@ class Reservation(models.Model):
         return 'Reservation of %d seats by %s for %s' % (self.ticketCount, self.passenger,
                                                          self.flight)
 
+    # ticketCount as it is stored in the database, tells how much the seat counter has to change
+    saved_ticket_count = 0
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_ticket_count = instance.__dict__.get('ticketCount', 0)
+        return instance
+
     def clean(self):
         """Check if we did exceed plane's seat limit"""
-        total_tickets = Reservation.objects \
-            .filter(flight=self.flight) \
-            .aggregate(total=Coalesce(models.Sum('ticketCount'), Value(0)))['total']
-        if self.flight.plane.passengerLimit < total_tickets:
+        reserved = self.flight.reservedSeats - self.saved_ticket_count + int(self.ticketCount)
+        if self.flight.plane.passengerLimit < reserved:
             raise ValidationError('Such reservation would exceed plane passenger capacity limit')
         return super().clean()
 
+    def save(self, *args, **kwargs):
+        """Move the change in ticket count onto the flight's seats in the same transaction,
+        refusing it if the plane would get overbooked"""
+        ticket_count = self._meta.get_field('ticketCount').to_python(self.ticketCount)
+        delta = ticket_count - self.saved_ticket_count
+        if not self._state.adding:
+            self.version += 1
+        with transaction.atomic():
+            super().save(*args, **kwargs)  # validated against the counter before it changes
+            if delta:
+                seat_maps = reseat(self.flight_id, [(self.seatMap, ticket_count)])
+                if seat_maps is None:
+                    raise ValidationError({NON_FIELD_ERRORS: [
+                        'Such reservation would exceed plane passenger capacity limit']})
+                self.seatMap = seat_maps[0]
+                Reservation.objects.filter(pk=self.pk).update(seatMap=self.seatMap)
+        self.saved_ticket_count = ticket_count
+        if delta and self._meta.get_field('flight').is_cached(self):
+            self.flight.reservedSeats += delta
+
+    def swap_tickets(self, ticket_count):
+        """Change the ticket count of a stored reservation unless it, or the seats of its
+        flight, have been changed since they were read (compare-and-swap on their versions), so
+        that neither needs to be locked; tell whether it was changed. Capacity is checked by
+        moving the flight's seats"""
+        self.ticketCount = ticket_count
+        self.clean_fields(exclude=['passenger', 'flight'])
+        delta = self.ticketCount - self.saved_ticket_count
+        seat_map = self.seatMap
+        with transaction.atomic():
+            if delta:  # writes the flight before the reservation, like lock_reservation() locks
+                seat_maps = swap_seats(self.flight_id, [(self.seatMap, self.ticketCount)])
+                if seat_maps is None:
+                    raise ValidationError({NON_FIELD_ERRORS: [
+                        'Such reservation would exceed plane passenger capacity limit']})
+                if seat_maps is False:
+                    return False
+                seat_map = seat_maps[0]
+            if not Reservation.objects.filter(pk=self.pk, version=self.version).update(
+                    ticketCount=self.ticketCount, seatMap=seat_map, version=F('version') + 1,
+                    updated=timezone.now()):
+                transaction.set_rollback(True)  # of the seats moved
+                return False
+        self.seatMap = seat_map
+        self.version += 1
+        self.saved_ticket_count = self.ticketCount
+        if delta:
+            schedule_changed(Reservation)
+            publish_seats([self.flight_id])
+        return True
+
+
+@receiver(post_delete, sender=Reservation)
+# pylint: disable=unused-argument
+# This format of function arguments is needed by Django
+def reservation_deleted(sender, instance, *args, **kwargs):
+    # pylint: enable=unused-argument
+    """Give seats of a cancelled reservation back to the flight"""
+    if instance.saved_ticket_count:
+        reseat(instance.flight_id, [(instance.seatMap, 0)])
+
+
+def move_seats(seat_map, capacity, holdings):
+    """Move seats of a flight's [seat_map] so that every (seat map, ticket count) pair of
+    [holdings], ones of its reservations, holds as many seats as tickets: seats held are kept,
+    cancelled tickets give back the highest ones and new tickets get the lowest free ones.
+    Return the flight's new seat bits and the new seat maps of holdings, or None if the plane
+    would get overbooked"""
+    taken = to_bits(seat_map)
+    held = [to_bits(seats) for seats, _ in holdings]
+    for index, (_, count) in enumerate(holdings):
+        given = last_seats(held[index], seat_count(held[index]) - count)
+        held[index] ^= given
+        taken &= ~given
+    for index, (_, count) in enumerate(holdings):
+        chosen = take_seats(taken, count - seat_count(held[index]), capacity)
+        if chosen is None:
+            return None
+        held[index] |= chosen
+        taken |= chosen
+    return taken, [to_map(bits) for bits in held]
+
+
+def rebuild_seats(capacity, holdings):
+    """Seat maps of a flight's reservations given as (seat map, ticket count) pairs in the order
+    they were made, each holding as many seats as tickets: a reservation keeps the seats it holds
+    that no earlier one does, within [capacity]. Tickets over the capacity get no seats. Return
+    the flight's new seat bits and the new seat maps"""
+    taken, seat_maps = 0, []
+    for seat_map, count in holdings:
+        held = to_bits(seat_map) & ~taken & ((1 << capacity) - 1)
+        count = min(count, capacity - seat_count(taken))
+        taken, (seats,) = move_seats(to_map(taken | held), capacity, [(to_map(held), count)])
+        seat_maps.append(seats)
+    return taken, seat_maps
+
+
+def reseat(flight_id, holdings):
+    """Lock the row of a flight and move its seats for [holdings] (see move_seats()), writing
+    the flight's seat map with its counter and version; return the new seat maps of holdings,
+    or None if the plane would get overbooked"""
+    seat_map, plane = Flight.objects.select_for_update().filter(pk=flight_id) \
+        .values_list('seatMap', 'plane_id').get()
+    capacity = Plane.objects.filter(pk=plane).values_list('passengerLimit', flat=True).get()
+    moved = move_seats(seat_map, capacity, holdings)
+    if moved is None:
+        return None
+    taken, seat_maps = moved
+    Flight.objects.filter(pk=flight_id).update(seatMap=to_map(taken),
+                                               reservedSeats=seat_count(taken),
+                                               seatsVersion=F('seatsVersion') + 1)
+    return seat_maps
+
+
+def swap_seats(flight_id, holdings):
+    """Move seats of a flight for [holdings] like reseat() does, without locking its row: the
+    flight is written only if its seats haven't changed since they were read. Return the new
+    seat maps of holdings, None if the plane would get overbooked, or False if the seats
+    changed meanwhile"""
+    seat_map, version, capacity = Flight.objects.filter(pk=flight_id) \
+        .values_list('seatMap', 'seatsVersion', 'plane__passengerLimit').get()
+    moved = move_seats(seat_map, capacity, holdings)
+    if moved is None:
+        return None
+    taken, seat_maps = moved
+    if not Flight.objects.filter(pk=flight_id, seatsVersion=version).update(
+            seatMap=to_map(taken), reservedSeats=seat_count(taken), seatsVersion=version + 1):
+        return False
+    return seat_maps
+
 
 def during(date, plane):
     """How many flights are done on a given day with a given airplane"""
+    begin, end = date_bounds(date)
     return Flight.objects \
-        .filter(plane=plane) \
-        .exclude(landingTime__date__lt=date) \
-        .exclude(takeoffTime__date__gt=date).count()
+        .filter(plane=plane, landingTime__gte=begin, takeoffTime__lt=end).count()
+
+
+class FlightQuerySet(models.QuerySet):
+    """Shapes of flight queries used by views, so that everything a view shows about a flight
+    comes with a single query no matter how many flights there are"""
+
+    def on_day(self, date):
+        """Flights that are in the air at some moment of a given day (a date or its ISO string),
+        all of them for no date. Compares plain datetimes so that indexes can be used"""
+        if not date:
+            return self
+        try:
+            day = parse_date(date) if isinstance(date, str) else date
+        except ValueError:
+            day = None
+        if day is None:
+            return self.none()
+        begin, end = date_bounds(day)
+        return self.filter(takeoffTime__lt=end, landingTime__gte=begin)
+
+    def for_listing(self):
+        """Flights shown in the timetable, with their airports"""
+        return self.select_related('takeoffAirport', 'landingAirport') \
+            .order_by('takeoffTime', 'landingTime')
+
+    def for_api(self):
+        """Flights sent as JSON, with everything that their titles mention"""
+        return self.select_related('plane', 'takeoffAirport', 'landingAirport', 'crew') \
+            .order_by('takeoffTime', 'landingTime')
+
+    def for_details(self):
+        """Flight shown on its own page, with its plane and airports"""
+        return self.select_related('plane', 'takeoffAirport', 'landingAirport')
 
 
 class Flight(models.Model):
@@ -112,6 +316,26 @@ class Flight(models.Model):
     plane = models.ForeignKey('Plane', on_delete=models.CASCADE)
     crew = models.ForeignKey('Crew', on_delete=models.CASCADE, null=True, blank=True, default=None)
 
+    # seats taken by reservations, see flights.seating; maintained by reseat() and
+    # swap_seats() only, like the number of them, equal to the sum of ticketCount of flight's
+    # reservations
+    seatMap = models.BinaryField(default=b'', editable=False)
+    reservedSeats = models.PositiveIntegerField(default=0, editable=False)
+    # incremented with every change of seats, which swap_seats() compares and swaps
+    seatsVersion = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = FlightQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['plane', 'takeoffTime'], name='flight_plane_takeoff_idx'),
+            models.Index(fields=['plane', 'landingTime'], name='flight_plane_landing_idx'),
+            models.Index(fields=['crew', 'takeoffTime'], name='flight_crew_takeoff_idx'),
+            models.Index(fields=['takeoffTime', 'landingTime'], name='flight_times_idx'),
+            models.Index(fields=['takeoffAirport', 'landingAirport', 'takeoffTime'],
+                         name='flight_route_takeoff_idx'),
+        ]
+
     def __str__(self):
         led_suffix = ''
         if self.crew and self.crew is not None:
@@ -124,25 +348,61 @@ class Flight(models.Model):
 
     def clean(self):
         """Check if all corner cases are met"""
-        if self.takeoffAirport == self.landingAirport:
-            raise ValidationError('Zero-length flight')
-        if self.landingTime <= self.takeoffTime:
-            raise ValidationError('Takeoff and landing times are invalid')
-        if self.landingTime - self.takeoffTime < timedelta(minutes=MIN_FLIGHT_MINUTES):
-            raise ValidationError('Flight time is too short')
-        if during(self.takeoffTime.date(), self.plane) > DAILY_FLIGHTS_PER_PLANE or during(
-                self.landingTime.date(), self.plane) > DAILY_FLIGHTS_PER_PLANE:
+        self.clean_route()
+        checks = schedule()
+        checks.lock_rows(self)
+        if checks.daily_flights(self, self.takeoffTime) > DAILY_FLIGHTS_PER_PLANE or \
+                checks.daily_flights(self, self.landingTime) > DAILY_FLIGHTS_PER_PLANE:
             raise ValidationError('Plane flight limit per day would be exceeded')
 
-        simultaneous_flights = Flight.objects.filter(
-            Q(takeoffTime__range=(self.takeoffTime, self.landingTime)) |
-            Q(landingTime__range=(self.takeoffTime, self.landingTime)) |
-            (Q(takeoffTime__lte=self.takeoffTime) & Q(landingTime__gte=self.landingTime)))
-
-        if self.crew and simultaneous_flights.filter(crew=self.crew).filter(~Q(pk=self.pk))\
-                .exists():
+        if checks.crew_conflicts(self):
             raise ValidationError('One crew would have to supervise two flights at the same time')
-        if simultaneous_flights.filter(plane=self.plane).filter(~Q(pk=self.pk)).exists():
+        if checks.plane_conflicts(self):
             raise ValidationError('There would be two simultaneous flights of a single plane')
 
         return super().clean()
+
+    def clean_route(self):
+        """Check rules concerning this flight alone, without looking at the rest of schedule"""
+        if self.takeoffAirport_id == self.landingAirport_id:
+            raise ValidationError('Zero-length flight')
+        if self.landingTime <= self.takeoffTime:
+            raise ValidationError('Takeoff and landing times are invalid')
+        if self.landingTime - self.takeoffTime < timedelta(minutes=MIN_FLIGHT_MINUTES):
+            raise ValidationError('Flight time is too short')
+
+    # crew_id as it is stored in the database, tells whether the crew changed
+    saved_crew_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.saved_crew_id = instance.__dict__.get('crew_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Never overwrite the seat counter with a possibly stale in-memory value; validate and
+        write in one transaction, so that locks taken by the checks last until the write"""
+        if not self._state.adding and not kwargs.get('force_insert') and \
+                kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and
+                                       field.name not in SEAT_FIELDS]
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Flight)):
+            super().save(*args, **kwargs)
+        self.saved_crew_id = self.crew_id
+
+
+for validated_model in (Airport, Plane, Crew, Passenger, Reservation, Flight):
+    pre_save.connect(pre_save_handler, sender=validated_model)
+
+for shown_model in (Airport, Plane, Crew, Reservation, Flight):
+    post_save.connect(schedule_changed, sender=shown_model)
+    post_delete.connect(schedule_changed, sender=shown_model)
+
+post_delete.connect(passenger_deleted, sender=Passenger)
+post_save.connect(flight_changed, sender=Flight)
+for seat_changing in (post_save, post_delete):
+    seat_changing.connect(reservation_changed, sender=Reservation)
+
+request_started.connect(check_connections)
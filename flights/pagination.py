@@ -0,0 +1,77 @@
+"""Split ordered flight lists into pages addressed by opaque cursors
+
+A cursor holds the (takeoffTime, landingTime, id) key of the flight that a page starts after
+(or ends before), so every page is a single indexed range query no matter how deep it is."""
+import base64
+import json
+from collections import namedtuple
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+ORDERING = ('takeoffTime', 'landingTime', 'id')
+
+Page = namedtuple('Page', ('items', 'next', 'prev'))
+
+
+class InvalidCursor(ValueError):
+    """Raised for page cursors that weren't made by encode_cursor"""
+
+
+def encode_cursor(flight, forward):
+    """Make a token pointing at the page after (or before) a given flight"""
+    key = [forward, flight.takeoffTime.isoformat(), flight.landingTime.isoformat(), flight.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Read the direction and the (takeoffTime, landingTime, id) key out of a token"""
+    try:
+        forward, takeoff, landing, pkey = json.loads(
+            base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode())
+        key = (parse_datetime(takeoff), parse_datetime(landing), int(pkey))
+    except (TypeError, ValueError) as err:
+        raise InvalidCursor('Invalid page cursor') from err
+    if None in key:
+        raise InvalidCursor('Invalid page cursor')
+    return bool(forward), key
+
+
+def beyond(key, forward):
+    """Condition for flights ordered after (or before) a given key"""
+    takeoff, landing, pkey = key
+    suffix = '__gt' if forward else '__lt'
+    return Q(**{'takeoffTime' + suffix: takeoff}) | \
+        Q(takeoffTime=takeoff, **{'landingTime' + suffix: landing}) | \
+        Q(takeoffTime=takeoff, landingTime=landing, **{'id' + suffix: pkey})
+
+
+def paginate(queryset, cursor=None, size=PAGE_SIZE):
+    """Return a Page of flights from a queryset, starting where a cursor points; raise
+    InvalidCursor for malformed cursors"""
+    forward, key = True, None
+    if cursor:
+        forward, key = decode_cursor(cursor)
+        queryset = queryset.filter(beyond(key, forward))
+
+    ordering = ORDERING if forward else tuple('-' + field for field in ORDERING)
+    items = list(queryset.order_by(*ordering)[:size + 1])
+    more = len(items) > size
+    items = items[:size]
+    if not forward:
+        items.reverse()
+    if not items:
+        return Page(items, None, None)
+
+    has_next, has_prev = (more, key is not None) if forward else (key is not None, more)
+    return Page(items, encode_cursor(items[-1], True) if has_next else None,
+                encode_cursor(items[0], False) if has_prev else None)
+
+
+def page_size(value, default=PAGE_SIZE):
+    """Read a requested page size, keeping it within limits"""
+    if not value:
+        return default
+    return max(1, min(int(value), MAX_PAGE_SIZE))
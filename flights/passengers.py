@@ -0,0 +1,170 @@
+"""Resolve passengers by their names to primary keys, creating missing ones without races
+
+Passengers are identified by a key of their case-folded names with whitespace collapsed, kept
+in a unique indexed column. A process keeps a bounded LRU map of keys to primary keys, so
+returning passengers cost no queries. Missing passengers are inserted with conflicts ignored and
+then read back, so concurrent bookings of a new passenger neither fail nor lock anything but
+the inserted row. Keys enter the map only once the transaction that saw them commits.
+
+The map belongs to one process and deletions only clear it in the deleting one, so a cached
+primary key may be gone: bookings check that their passengers exist, and resolve_for() runs
+them once more with such keys read from the database again."""
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, connections, router, transaction
+
+DEFAULT_CACHE_SIZE = 10000
+QUERY_CHUNK = 500  # keep "IN" lists below SQLite's limit of query parameters
+SEPARATOR = '\x1f'
+INSERT_IGNORING = {'sqlite': 'INSERT OR IGNORE INTO %s (%s) VALUES (%s)',
+                   'postgresql': 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT DO NOTHING',  # 9.5+
+                   'mysql': 'INSERT IGNORE INTO %s (%s) VALUES (%s)'}
+
+
+def normalize(text):
+    """Case-fold a name and collapse its whitespace"""
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+
+def passenger_key(name, surname):
+    """Key identifying a passenger of given names"""
+    return normalize(name) + SEPARATOR + normalize(surname)
+
+
+class PassengerDirectory:
+    """Bounded LRU map of passenger keys to primary keys, filled from the database on misses"""
+
+    def __init__(self, size=None):
+        self.size = size or getattr(settings, 'FLIGHTS_PASSENGER_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        self.lock = threading.Lock()
+        self.ids = OrderedDict()
+
+    def reset(self):
+        """Forget all passengers"""
+        with self.lock:
+            self.ids.clear()
+
+    def forget(self, key):
+        """Forget a passenger, e.g. a deleted one"""
+        with self.lock:
+            self.ids.pop(key, None)
+
+    def remember(self, ids):
+        """Map keys to primary keys, evicting the least recently used ones over the size"""
+        with self.lock:
+            for key, pkey in ids.items():
+                self.ids[key] = pkey
+                self.ids.move_to_end(key)
+            while len(self.ids) > self.size:
+                self.ids.popitem(last=False)
+
+    def cached(self, keys):
+        """Map those of given keys that are known to primary keys"""
+        found = {}
+        with self.lock:
+            for key in keys:
+                pkey = self.ids.get(key)
+                if pkey is not None:
+                    self.ids.move_to_end(key)
+                    found[key] = pkey
+        return found
+
+    def resolve_many(self, names):
+        """Map (name, surname) pairs to primary keys of their passengers, creating the missing
+        ones; raise ValidationError for invalid names"""
+        keys = {pair: passenger_key(*pair) for pair in set(names)}
+        ids = self.cached(keys.values())
+        missing = {key: pair for pair, key in keys.items() if key not in ids}
+        if missing:
+            found = stored_ids(missing)
+            created = [(pair, key) for key, pair in missing.items() if key not in found]
+            if created:
+                insert_ignoring(created)
+                found.update(stored_ids(key for _, key in created))
+            ids.update(found)
+            transaction.on_commit(lambda: self.remember(found),
+                                  using=router.db_for_write(passenger_model()))
+        return {pair: ids[key] for pair, key in keys.items()}
+
+    def resolve(self, name, surname):
+        """Primary key of the passenger of given names, who is created if missing"""
+        return self.resolve_many([(name, surname)])[name, surname]
+
+    def resolve_for(self, names, func):
+        """Return func() of the map of (name, surname) pairs to primary keys of their
+        passengers. If it raises IntegrityError or ObjectDoesNotExist in a savepoint, cached keys
+        of passengers deleted by another process are forgotten and func() runs once more"""
+        names = list(names)
+        ids = self.resolve_many(names)
+        try:
+            with transaction.atomic(using=router.db_for_write(passenger_model())):
+                return func(ids)
+        except (IntegrityError, ObjectDoesNotExist):
+            keys = {passenger_key(*pair): pkey for pair, pkey in ids.items()}
+            stored = stored_ids(keys)
+            stale = [key for key, pkey in keys.items() if stored.get(key) != pkey]
+            if not stale:
+                raise
+            for key in stale:
+                self.forget(key)
+        return func(self.resolve_many(names))
+
+
+def passenger_model():
+    """The Passenger model, which imports this module"""
+    return apps.get_model('flights', 'Passenger')
+
+
+def stored_ids(keys):
+    """Map those of given keys that are stored to primary keys, reading the database that
+    passengers are written to, as a replica could lag behind"""
+    model = passenger_model()
+    passengers = model.objects.using(router.db_for_write(model))
+    keys = list(keys)
+    found = {}
+    for i in range(0, len(keys), QUERY_CHUNK):
+        found.update(passengers.filter(nameKey__in=keys[i:i + QUERY_CHUNK])
+                     .values_list('nameKey', 'pk'))
+    return found
+
+
+def insert_ignoring(passengers):
+    """Insert ((name, surname), key) passengers, skipping ones whose keys already exist, also if
+    a concurrent transaction inserts them meanwhile; databases without an INSERT_IGNORING
+    statement insert them one by one, each in a savepoint"""
+    model = passenger_model()
+    for (name, surname), _ in passengers:
+        model(name=name, surname=surname).clean_fields(exclude=['nameKey'])
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor not in INSERT_IGNORING:
+        for (name, surname), _ in passengers:
+            try:
+                with transaction.atomic(using=connection.alias):
+                    model.objects.using(connection.alias).create(name=name, surname=surname)
+            except IntegrityError:
+                pass
+        return
+    columns = [model._meta.get_field(name).column for name in ('name', 'surname', 'nameKey')]
+    statement = INSERT_IGNORING[connection.vendor] % (
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.executemany(statement, [(name, surname, key)
+                                       for (name, surname), key in passengers])
+
+
+PASSENGERS = PassengerDirectory()
+
+
+# pylint: disable=unused-argument
+# This format of function arguments is needed by Django
+def passenger_deleted(sender, instance, *args, **kwargs):
+    # pylint: enable=unused-argument
+    """Stop resolving names of a deleted passenger to it"""
+    PASSENGERS.forget(instance.nameKey)
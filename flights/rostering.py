@@ -0,0 +1,168 @@
+"""Assign crews to many flights at once, as requested or automatically"""
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import datetime
+from functools import wraps
+
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from flights.booking import lock_flights
+from flights.caching import schedule_changed
+from flights.conflicts import IntervalIndex, date_bounds
+from flights.events import publish_crews
+from flights.indexing import flights_saved
+from flights.models import Crew, Flight
+from flights.validation import QUERY_CHUNK, validate_flights
+
+Assignment = namedtuple('Assignment', ('flight', 'crew'))
+STRATEGIES = ('tight', 'balanced')
+NEVER = timezone.make_aware(datetime.min.replace(year=2), timezone.utc)
+
+
+def on_write_database(func):
+    """Run a function in a transaction on the database that flights are written to, which the
+    function locks, reads and writes flights in"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with transaction.atomic(using=router.db_for_write(Flight)):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def parse_assignments(records):
+    """Read (flight, crew) pairs out of JSON objects, a null crew meaning no crew; return the
+    pairs and {position: ValidationError} of malformed ones"""
+    if not isinstance(records, list):
+        raise ValidationError('Expected a list of assignments')
+    assignments, errors = [], {}
+    for index, record in enumerate(records):
+        try:
+            crew = record['crew']
+            assignments.append(Assignment(int(record['flight']),
+                                          None if crew is None else int(crew)))
+        except (KeyError, TypeError, ValueError):
+            assignments.append(None)
+            errors[index] = ValidationError('Expected an object with flight and crew')
+    return assignments, errors
+
+
+def locked_flights(flight_ids):
+    """Lock flights in the order of their primary keys and map the keys to them"""
+    flight_ids = sorted(set(flight_ids))
+    using = router.db_for_write(Flight)
+    lock_flights(flight_ids, using)
+    flights = {}
+    for i in range(0, len(flight_ids), QUERY_CHUNK):
+        flights.update((flight.pk, flight) for flight in
+                       Flight.objects.using(using).filter(pk__in=flight_ids[i:i + QUERY_CHUNK]))
+    return flights
+
+
+def save_crews(flights):
+    """Write crews of flights with a prepared UPDATE executed for all of them, bypassing
+    Flight.save() and its checks; compiling a CASE expression or a query per flight takes far
+    longer for thousands of flights"""
+    if not flights:
+        return
+    connection = connections[router.db_for_write(Flight)]
+    meta = Flight._meta
+    statement = 'UPDATE %s SET %s = %%s WHERE %s = %%s' % tuple(
+        connection.ops.quote_name(name) for name in (
+            meta.db_table, meta.get_field('crew').column, meta.pk.column))
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.executemany(statement, [(flight.crew_id, flight.pk) for flight in flights])
+    flights_saved(flights)
+    for flight in flights:
+        flight.saved_crew_id = flight.crew_id
+    schedule_changed(Flight)
+    publish_crews(flight.pk for flight in flights)
+
+
+@on_write_database
+def assign_crews(records):
+    """Apply valid (flight, crew) assignments of JSON objects and reject the others; crews of
+    the whole batch are checked against each other and the stored schedule in memory, with a few
+    queries in total. Return {position: ValidationError} of rejected assignments"""
+    assignments, errors = parse_assignments(records)
+    flights = locked_flights(assignment.flight for index, assignment in enumerate(assignments)
+                             if index not in errors)
+
+    stored_crews = {pkey: flight.crew_id for pkey, flight in flights.items()}
+    batch, seen = {}, set()
+    for index, assignment in enumerate(assignments):
+        if index in errors:
+            continue
+        if assignment.flight not in flights:
+            errors[index] = ValidationError('Flight %d does not exist' % assignment.flight)
+        elif assignment.flight in seen:
+            errors[index] = ValidationError('Flight is assigned more than once in the batch')
+        else:
+            flights[assignment.flight].crew_id = assignment.crew
+            batch[index] = flights[assignment.flight]
+        seen.add(assignment.flight)
+
+    # flights of rejected assignments keep their stored crews, which the accepted ones have to
+    # be checked against again, until no more assignments get rejected
+    while batch:
+        indices = sorted(batch)
+        rejected = validate_flights([batch[index] for index in indices])
+        if not rejected:
+            break
+        for position, error in rejected.items():
+            errors[indices[position]] = error
+            flight = batch.pop(indices[position])
+            flight.crew_id = stored_crews[flight.pk]
+    save_crews([flight for flight in batch.values() if flight.crew_id != stored_crews[flight.pk]])
+    return errors
+
+
+def plan_roster(flights, crews, busy, strategy='tight'):
+    """Choose crews for [flights] sorted by takeoff time, in a single sweep over them. Crews
+    wait in a list sorted by the landing of their last flight given in this sweep; a flight gets
+    one of those that landed before its takeoff and have no [busy] IntervalIndex flights touching
+    it. The "tight" strategy takes the crew that landed last, keeping idle gaps short, the
+    "balanced" one takes the crew idle for the longest time. Return the flights with crew_id
+    set, the ones left without a crew have None"""
+    waiting = [(NEVER, crew) for crew in sorted(crews)]
+    tight = strategy == 'tight'
+    for flight in flights:
+        flight.crew_id = None
+        ready = bisect_left(waiting, (flight.takeoffTime,))
+        candidates = range(ready - 1, -1, -1) if tight else range(ready)
+        for position in candidates:
+            crew = waiting[position][1]
+            if not busy.count(crew, flight.takeoffTime, flight.landingTime):
+                del waiting[position]
+                insort(waiting, (flight.landingTime, crew))
+                flight.crew_id = crew
+                break
+    return flights
+
+
+@on_write_database
+def auto_roster(first_day, last_day, strategy='tight'):
+    """Give crews to crew-less flights taking off between two dates (inclusive), without
+    making any crew lead simultaneous flights. Crews are locked like set_crew does, then the
+    flights. Return how many flights got a crew and how many didn't"""
+    if strategy not in STRATEGIES:
+        raise ValidationError('Unknown strategy %s' % strategy)
+    using = router.db_for_write(Flight)
+    begin, end = date_bounds(first_day)[0], date_bounds(last_day)[1]
+    crews = list(Crew.objects.using(using).select_for_update().order_by('pk')
+                 .values_list('pk', flat=True))
+    flights = list(Flight.objects.using(using).select_for_update()
+                   .filter(crew__isnull=True, takeoffTime__gte=begin, takeoffTime__lt=end)
+                   .order_by('takeoffTime', 'pk'))
+    if not flights:
+        return 0, 0
+
+    busy = IntervalIndex()
+    busy.load(Flight.objects.using(using).filter(crew__isnull=False, takeoffTime__lte=max(
+        flight.landingTime for flight in flights), landingTime__gte=flights[0].takeoffTime)
+              .values_list('crew_id', 'pk', 'takeoffTime', 'landingTime').iterator())
+    rostered = [flight for flight in plan_roster(flights, crews, busy, strategy)
+                if flight.crew_id is not None]
+    save_crews(rostered)
+    return len(rostered), len(flights) - len(rostered)
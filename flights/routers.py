@@ -0,0 +1,61 @@
+"""Route read-only traffic to a replica database and run it without taking locks"""
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+REPLICA = 'replica'
+
+
+def read_alias():
+    """Database that read-only views should query: the replica if one is configured"""
+    return REPLICA if REPLICA in settings.DATABASES else DEFAULT_DB_ALIAS
+
+
+class ReadReplicaRouter:
+    """Send reads to the replica alias unless they happen inside a transaction on the primary
+    database, as those may be followed by writes depending on them (reserve, set_crew)"""
+
+    # pylint: disable=unused-argument,no-self-use
+    # This format of methods is needed by Django
+    def db_for_read(self, model, **hints):
+        """Replica for reads outside write transactions, no preference otherwise"""
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        """All writes go to the primary database"""
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Both databases hold the same data"""
+        aliases = {DEFAULT_DB_ALIAS, REPLICA}
+        return obj1._state.db in aliases and obj2._state.db in aliases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """The replica gets its schema from the primary database"""
+        return db != REPLICA
+    # pylint: enable=unused-argument,no-self-use
+
+
+def snapshot(view, any_database=False):
+    """Run a read-only view in a single transaction on the read database, so that all of its
+    queries see one committed state without locking rows: a READ ONLY one at REPEATABLE READ
+    isolation on PostgreSQL. On other databases views run as they are unless [any_database],
+    since e.g. SQLite keeps writers from completing their commits while a read transaction is
+    open; commands reading a whole schedule set it. Streamed content is read after the view
+    returns, outside of the snapshot"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        alias = read_alias()
+        connection = connections[alias]
+        if connection.vendor != 'postgresql' and not any_database:
+            return view(*args, **kwargs)
+        outermost = not connection.in_atomic_block
+        with transaction.atomic(using=alias):
+            if outermost and connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+            return view(*args, **kwargs)
+    return wrapper
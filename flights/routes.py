@@ -0,0 +1,122 @@
+"""Find flights of a route taking off within a time window without querying the database
+
+Every (takeoff airport, landing airport) pair gets a list of its flights' (takeoffTime,
+landingTime, id) keys, sorted like pages of flights are (see flights.pagination), so a window or
+a page of it takes two bisections. The index is built lazily with a single query and then kept
+in sync with flights committed by the current process (see flights.indexing), so it's only used
+when FLIGHTS_ROUTE_INDEX is set, like the schedule index. Transactions that changed flights
+search them with queries, which see their changes."""
+from bisect import bisect_left, bisect_right, insort
+from threading import RLock
+
+from django.apps import apps
+from django.conf import settings
+
+from flights.dates import stored_datetime, stored_time
+from flights.indexing import PENDING, track
+from flights.pagination import PAGE_SIZE, Page, decode_cursor, encode_cursor, paginate
+
+
+class RouteIndex:
+    """Sorted keys of flights grouped by their routes"""
+
+    def __init__(self):
+        self.lock = RLock()
+        self.routes = {}
+        self.entries = {}  # flight pk -> (route, key)
+        self.loaded = False
+
+    def reset(self):
+        """Drop the index so that it gets rebuilt from the database on next use"""
+        with self.lock:
+            self.routes, self.entries = {}, {}
+            self.loaded = False
+
+    def ensure_loaded(self):
+        """Build the index with a single query if it's not there yet"""
+        if self.loaded:
+            return
+        with self.lock:
+            if self.loaded:
+                return
+            routes, entries = {}, {}
+            rows = apps.get_model('flights', 'Flight').objects.values_list(
+                'pk', 'takeoffAirport_id', 'landingAirport_id', stored_time('takeoffTime'),
+                stored_time('landingTime'))
+            for pkey, origin, destination, takeoff, landing in rows.iterator():
+                key = (stored_datetime(takeoff), stored_datetime(landing), pkey)
+                routes.setdefault((origin, destination), []).append(key)
+                entries[pkey] = ((origin, destination), key)
+            for keys in routes.values():
+                keys.sort()
+            self.routes, self.entries = routes, entries
+            self.loaded = True
+
+    def update(self, flight):
+        """Reflect a saved flight in the index"""
+        with self.lock:
+            if not self.loaded:
+                return
+            self.discard(flight.pk)
+            route = (flight.takeoffAirport_id, flight.landingAirport_id)
+            key = (flight.takeoffTime, flight.landingTime, flight.pk)
+            insort(self.routes.setdefault(route, []), key)
+            self.entries[flight.pk] = (route, key)
+
+    def discard(self, pkey):
+        """Reflect a deleted flight in the index"""
+        with self.lock:
+            entry = self.entries.pop(pkey, None)
+            if entry is None:
+                return
+            keys = self.routes[entry[0]]
+            del keys[bisect_left(keys, entry[1])]
+
+    def search(self, origin, destination, begin, end, size, cursor=None):
+        """Find ids of a page of flights from [origin] to [destination] airports taking off in
+        the [begin, end) window, with no end if it's None, ordered by takeoff and landing
+        times; [cursor] is a (forward, key) pair of a decoded page cursor. Return the ids and
+        whether there are next and previous pages, in the sense paginate() has"""
+        self.ensure_loaded()
+        with self.lock:
+            keys = self.routes.get((origin, destination), [])
+            low = bisect_left(keys, (begin,))
+            high = len(keys) if end is None else bisect_left(keys, (end,))
+            forward, key = cursor or (True, None)
+            if forward:
+                start = low if key is None else max(low, bisect_right(keys, key))
+                page = keys[start:min(high, start + size + 1)]
+                more = len(page) > size
+                page = page[:size]
+            else:
+                stop = min(high, bisect_left(keys, key))
+                page = keys[max(low, stop - size - 1):stop]
+                more = len(page) > size
+                page = page[-size:]
+        has_next, has_prev = (more, key is not None) if forward else (key is not None, more)
+        return [pkey for _, _, pkey in page], has_next, has_prev
+
+
+ROUTES = track(RouteIndex())
+
+
+def search_route(origin, destination, begin, end=None, cursor=None, size=PAGE_SIZE):
+    """Return a Page of flights between airports taking off in the [begin, end) window (with
+    no end if it's None), the way paginate() pages them. The route index is used if the
+    FLIGHTS_ROUTE_INDEX setting is True and the ongoing transaction hasn't changed flights,
+    otherwise an indexed query is; raise InvalidCursor for malformed cursors"""
+    flights = apps.get_model('flights', 'Flight').objects.for_api()
+    if not getattr(settings, 'FLIGHTS_ROUTE_INDEX', False) or PENDING.untracked() or \
+            PENDING.flights():
+        flights = flights.filter(takeoffAirport=origin, landingAirport=destination,
+                                 takeoffTime__gte=begin)
+        return paginate(flights if end is None else flights.filter(takeoffTime__lt=end),
+                        cursor, size)
+    pkeys, has_next, has_prev = ROUTES.search(origin, destination, begin, end, size,
+                                              decode_cursor(cursor) if cursor else None)
+    found = {flight.pk: flight for flight in flights.filter(pk__in=pkeys)}
+    items = [found[pkey] for pkey in pkeys if pkey in found]
+    if not items:
+        return Page(items, None, None)
+    return Page(items, encode_cursor(items[-1], True) if has_next else None,
+                encode_cursor(items[0], False) if has_prev else None)
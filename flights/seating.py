@@ -0,0 +1,67 @@
+"""Seat maps: which seats of a plane are taken on a flight, or held by a reservation
+
+A seat map is a bitmap stored as bytes, bit i (little-endian) standing for seat i of the plane,
+seats numbered row by row. Planes lay their seats out in rows of seatsPerRow seats lettered
+from A, the last row possibly shorter. Maps are handled as Python integers: the lowest free
+seat is the lowest zero bit, found with a single addition, and a count of seats is a popcount."""
+
+SEAT_LETTERS = 'ABCDEFGHJK'  # no I, which looks like 1
+DEFAULT_SEATS_PER_ROW = 6
+
+
+def to_bits(seat_map):
+    """Integer of a stored seat map, empty maps included"""
+    return int.from_bytes(bytes(seat_map or b''), 'little')
+
+
+def to_map(bits):
+    """Stored seat map of an integer"""
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+
+
+def seat_count(bits):
+    """Number of seats of a map"""
+    return bin(bits).count('1')
+
+
+def take_seats(taken, count, capacity):
+    """Bits of the [count] lowest seats free in [taken] among [capacity] seats, None if there
+    are not that many"""
+    chosen = 0
+    for _ in range(count):
+        seat = ~taken & (taken + 1)
+        if seat.bit_length() > capacity:
+            return None
+        chosen |= seat
+        taken |= seat
+    return chosen
+
+
+def last_seats(held, count):
+    """Bits of the [count] highest seats of [held], to be given back first"""
+    chosen = 0
+    for _ in range(min(count, seat_count(held))):
+        seat = 1 << (held.bit_length() - 1)
+        chosen |= seat
+        held ^= seat
+    return chosen
+
+
+def seat_label(index, per_row):
+    """Name of a seat, e.g. 12C"""
+    return '%d%s' % (index // per_row + 1, SEAT_LETTERS[index % per_row])
+
+
+def seat_labels(seat_map, per_row):
+    """Names of seats of a stored map, in order"""
+    bits = to_bits(seat_map)
+    return [seat_label(index, per_row) for index in range(bits.bit_length())
+            if bits >> index & 1]
+
+
+def seat_rows(seat_map, capacity, per_row):
+    """Rows of a plane's layout as lists of (seat name, whether it's taken)"""
+    bits = to_bits(seat_map)
+    return [[(seat_label(index, per_row), bool(bits >> index & 1))
+             for index in range(start, min(start + per_row, capacity))]
+            for start in range(0, capacity, per_row)]
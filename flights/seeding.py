@@ -0,0 +1,98 @@
+"""Generate random airports, planes and flight schedules of a chosen size"""
+import random
+from datetime import datetime as dt, timedelta
+
+from django.db.models import Count
+from django.utils import timezone
+
+from flights.importer import ScheduleImport
+from flights.models import Airport, Flight, Plane
+
+AIRPORTS = ['Moscow', 'Paris', 'Berlin', 'London', 'Warsaw', 'Stockholm', 'Kopenhagen', 'Madrid',
+            'New York', 'Lviv', 'Budapest', 'Athens', 'Cairo', 'Tokyo', 'Praha', 'Sydney', 'Oslo']
+
+PLANE_COUNT = 50
+FLIGHTS_PER_PLANE = 50
+FLIGHT_LENGTH_MINUTE_RANGE = 30, 720
+FLIGHT_SPAN_MINUTE_RANGE = 30, 1440
+
+
+def rand_char(rand=random):
+    """Get a random letter"""
+    return chr(ord('A') + rand.randrange(ord('z') - ord('a')))
+
+
+def rand_id(rand=random):
+    """Generate a random plane ID"""
+    return str(rand.randrange(9))
+
+
+def str_rep(i: int, funct):
+    """Concatenate [i] results of calling a [funct] by using recursion"""
+    if i <= 0:
+        return ''
+    return funct() + str_rep(i - 1, funct)
+
+
+def seed_planes(plane_count=PLANE_COUNT, rand=random):
+    """Create all airports and [plane_count] planes of random identifiers and sizes, return the
+    identifiers"""
+    Airport.objects.bulk_create(Airport(name=airport_name) for airport_name in AIRPORTS)
+
+    identifiers = set()
+    while len(identifiers) < plane_count:
+        identifiers.add(str_rep(2, lambda: rand_char(rand)) + str_rep(3, lambda: rand_id(rand)))
+    Plane.objects.bulk_create(Plane(identifier=identifier, passengerLimit=rand.randint(20, 120))
+                              for identifier in identifiers)
+    return identifiers
+
+
+def generate_schedule(counts, rand=random, after=None):
+    """Make a validated, not yet saved import of consecutive flights between random airports,
+    [counts] mapping plane identifiers to numbers of flights, starting after the times that
+    [after] maps identifiers to, or now; [after] gets updated to the last generated landings"""
+    schedule = ScheduleImport()
+    line = 0
+    now = dt.now(tz=timezone.utc)
+    after = {} if after is None else after
+    for identifier in sorted(counts):
+        landing_time = after.get(identifier, now)
+        for _ in range(counts[identifier]):
+            takeoff_airport_id = rand.randrange(len(AIRPORTS))
+            landing_airport_id = rand.randrange(len(AIRPORTS) - 1)
+            if landing_airport_id >= takeoff_airport_id:
+                landing_airport_id += 1
+
+            takeoff_time = landing_time + timedelta(
+                minutes=rand.randrange(*FLIGHT_SPAN_MINUTE_RANGE))
+            landing_time = takeoff_time + timedelta(
+                minutes=rand.randrange(*FLIGHT_LENGTH_MINUTE_RANGE))
+
+            line += 1
+            schedule.add(line, {'plane': identifier,
+                                'takeoffAirport': AIRPORTS[takeoff_airport_id],
+                                'landingAirport': AIRPORTS[landing_airport_id],
+                                'takeoffTime': takeoff_time.isoformat(),
+                                'landingTime': landing_time.isoformat()})
+        after[identifier] = landing_time
+
+    schedule.validate()
+    return schedule
+
+
+def seed_schedule(identifiers, flights_per_plane=FLIGHTS_PER_PLANE, rand=random):
+    """Save [flights_per_plane] flights for each of given planes, generating flights in place of
+    rejected ones after the previously generated ones until none are missing; return the
+    numbers of saved and rejected flights"""
+    saved = rejected = 0
+    counts = {identifier: flights_per_plane for identifier in identifiers}
+    last_landings = {}
+    while counts:
+        schedule = generate_schedule(counts, rand, last_landings)
+        rejected += len(schedule.rejected)
+        saved += schedule.save()
+        have = dict(Flight.objects.filter(plane__in=counts).values_list('plane')
+                    .annotate(Count('pk')))
+        counts = {identifier: flights_per_plane - have.get(identifier, 0)
+                  for identifier in counts if have.get(identifier, 0) < flights_per_plane}
+    return saved, rejected
@@ -6,6 +6,8 @@ const defaultStateContainer = { 'Please wait': { title: 'Fetching...' } };
 const state = {
   flights: defaultStateContainer,
   crews: defaultStateContainer,
+  flightDate: '',
+  nextFlights: null,
   timeout: null,
 };
 
@@ -13,6 +15,8 @@ const stateBackup = {};
 
 let isLoaded = false;
 
+let events = null; // EventSource of flight changes, if the browser has one
+
 function keysHaveKey(obj, requestedKey) {
   return Object.keys(obj).reduce((acc, key) => acc && obj[key][requestedKey]);
 }
@@ -54,14 +58,17 @@ updateFields = () => {
     document.getElementById('crewSelection').innerHTML = createOptions(state.crews);
     document.getElementById('flightSelection').innerHTML = createOptions(state.flights);
     document.getElementById('crewFlights').innerHTML = createList(state.flights);
+    document.getElementById('moreFlights').hidden = !state.nextFlights;
   }
 };
 
-function fetchResource(path, updateWith) {
+function fetchResource(path, updateWith, showPlaceholder = true) {
   try {
     backupState();
-    updateWith(defaultStateContainer);
-    updateFields();
+    if (showPlaceholder) {
+      updateWith(defaultStateContainer, {});
+      updateFields();
+    }
   } catch (e) {
     popup.error(e);
   }
@@ -72,7 +79,8 @@ function fetchResource(path, updateWith) {
     try {
       if (req.readyState === 4) {
         if (req.status === 200) {
-          updateWith(JSON.parse(req.response).response);
+          const body = JSON.parse(req.response);
+          updateWith(body.response, body);
           updateFields();
         } else {
           restoreState();
@@ -103,16 +111,36 @@ function formatDate(date) {
 }
 
 function fetchFlights(date = document.getElementById('dateInput').value || new Date()) {
+  state.flightDate = formatDate(date);
+  fetchResource(
+    `/REST/flights?search=${state.flightDate}`,
+    (result, body) => {
+      state.flights = result;
+      state.nextFlights = body.next;
+    },
+  );
+}
+
+// Flights come in pages, the following ones are fetched only when asked for
+function fetchMoreFlights() {
+  if (!state.nextFlights) return;
   fetchResource(
-    `/REST/flights?search=${formatDate(date)}`,
-    (result) => { state.flights = result; },
+    `/REST/flights?search=${state.flightDate}&cursor=${encodeURIComponent(state.nextFlights)}`,
+    (result, body) => {
+      state.flights = Object.assign({}, state.flights, result);
+      state.nextFlights = body.next;
+    },
+    false,
   );
 }
 
 function fetchCrews() {
   fetchResource(
     '/REST/crews',
-    (result) => { state.crews = result; },
+    (result, body) => {
+      state.crews = result;
+      if (body.liveUpdates && !events) listenForChanges();
+    },
   );
 }
 
@@ -167,8 +195,10 @@ function setCrew(e) {
           popup.red(`There was an issue with the request\n${req.getResponseHeader('error-message') || 'An error occurred - maybe the server is down?'}`);
           return;
         }
-        fetchFlights();
-        fetchCrews();
+        if (!events || events.readyState !== EventSource.OPEN) {
+          fetchFlights();
+          fetchCrews();
+        }
       }
     } catch (err) {
       popup.error(err);
@@ -181,10 +211,26 @@ function setCrew(e) {
   }
 }
 
+// Flights with changed crews are pushed by the server instead of fetching all of them again, if
+// it serves live updates (see fetchCrews())
+function listenForChanges() {
+  if (!window.EventSource) return;
+  events = new EventSource('/REST/events');
+  events.addEventListener('crew', (event) => {
+    const flight = JSON.parse(event.data);
+    if (state.flights[flight.id]) {
+      state.flights = Object.assign({}, state.flights, { [flight.id]: flight });
+      updateFields();
+    }
+  });
+  events.addEventListener('reset', () => fetchFlights());
+}
+
 window.onload = () => {
   isLoaded = true;
   fetchFlights();
   fetchCrews();
   document.getElementById('flightForm').onsubmit = searchFlights;
   document.getElementById('crewForm').onsubmit = setCrew;
+  document.getElementById('moreFlights').onclick = fetchMoreFlights;
 };
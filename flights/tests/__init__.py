@@ -0,0 +1,56 @@
+"""Unit and Selenium test package for Flights app, with data that tests start from"""
+from django.utils import timezone
+
+from flights.models import Plane, Crew, Flight, Airport
+
+
+def init_database():
+    """Fill database with initial data"""
+    now = timezone.now()
+    airport1 = Airport.objects.create(name="a1")
+    airport2 = Airport.objects.create(name="a2")
+    plane1 = Plane.objects.create(identifier="p1", passengerLimit=20)
+    plane2 = Plane.objects.create(identifier="p2", passengerLimit=20)
+    # @formatter:off
+    flight1 = Flight.objects \
+        .create(plane=plane1,
+                takeoffAirport=airport1, takeoffTime=now.replace(hour=13, minute=13),
+                landingAirport=airport2, landingTime=now.replace(hour=16, minute=48),
+               )
+    flight2 = Flight.objects \
+        .create(plane=plane2,
+                takeoffAirport=airport2, takeoffTime=now.replace(hour=15, minute=52),
+                landingAirport=airport1, landingTime=now.replace(hour=17, minute=12),
+               )
+    flight3 = Flight.objects \
+        .create(plane=plane2,
+                takeoffAirport=airport1, takeoffTime=now.replace(hour=18, minute=6),
+                landingAirport=airport2, landingTime=now.replace(hour=20, minute=17),
+               )
+    # @formatter:on
+    crews = map(lambda num: Crew.objects.create(cptName='n%d' % num, cptSurname='s%d' % num),
+                (range(6)))
+
+    for elem in [airport1, airport2, plane1, plane2, flight1, flight2, flight3,
+                 *crews]:
+        elem.save()
+
+
+def check_crew_simultaneous_flights(self):
+    """Don't allow a crew to fly two flights at the same time"""
+    self.check_binding_response(2, 0, True, 2)  # 2 . .
+    self.check_binding_response(2, 1, False, None)  # flights 0 and 1 at same time
+    self.check_binding_response(0, 2, True, 0)  # 2 . 0
+    self.check_binding_response(1, 1, True, 1)  # 2 1 0
+    self.check_binding_response(2, 1, False, 1)
+    self.check_binding_response(1, 0, False, 2)
+
+
+def check_crew_reassignment(self):
+    """Check if reassigning flight crews works as expected"""
+    self.check_binding_response(0, 0, True, 0)  # 0 . .
+    self.check_binding_response(1, 2, True, 1)  # 0 . 1
+    self.check_binding_response(1, 1, True, 1)  # 0 1 1
+    self.check_binding_response(0, 2, True, 0)  # 0 1 0
+    self.check_binding_response(2, 0, True, 2)  # 2 1 0
+    self.check_binding_response(0, 1, True, 0)  # 2 0 0
@@ -0,0 +1,26 @@
+"""Tests of benchmark reports"""
+from django.test import SimpleTestCase
+
+from flights.benchmark.runner import compare, summarize
+
+
+class BenchmarkReportTest(SimpleTestCase):
+    """Unit tests for summaries and baseline comparisons of benchmark runs"""
+
+    def test_summary(self):
+        """Percentiles are nearest-rank ones, in milliseconds"""
+        report = summarize([i / 1000 for i in range(100, 0, -1)], [2, 3], 1, elapsed=4)
+        self.assertEqual(report, {'requests': 100, 'errors': 1, 'rps': 25.0,
+                                  'queries_per_request': 2.5,
+                                  'p50_ms': 50.0, 'p95_ms': 95.0, 'p99_ms': 99.0})
+
+    def test_compare(self):
+        """Only changes for the worse beyond the tolerance are regressions"""
+        baseline = {'details': {'requests': 10, 'errors': 0, 'rps': 100.0,
+                                'queries_per_request': 3.0,
+                                'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0}}
+        results = {'details': dict(baseline['details'], rps=85.0, p50_ms=5.0, p99_ms=40.0),
+                   'reserve': baseline['details']}
+        self.assertEqual(compare(results, baseline, .2),
+                         ['details: p99_ms went up from 30.0 to 40.0'])
+        self.assertEqual(len(compare(results, baseline, .1)), 2)
@@ -0,0 +1,380 @@
+"""Tests of reserving seats and resolving passengers"""
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.six import StringIO
+
+from flights.booking import book_reservation, save_reservations
+from flights.models import Flight, Reservation, Passenger, move_seats
+from flights.passengers import PASSENGERS, PassengerDirectory, passenger_key
+from flights.seating import last_seats, seat_labels, take_seats, to_map
+from flights.tests import init_database
+
+
+class ReservationTest(TestCase):
+    """Unit tests for keeping flight seat counters in line with reservations"""
+
+    def setUp(self):
+        """Add initial data to db and authenticate future POST requests"""
+        init_database()
+        self.flight = Flight.objects.get(plane__identifier='p1')
+
+        user = User.objects.create(username='asdf', password='qwer')
+        user.save()
+        self.client.force_login(user)
+
+    def reserve(self, name, ticket_count):
+        """Post a reservation form for the test flight"""
+        return self.client.post('/reserve', data={
+            'name': name, 'surname': 'Nowak', 'flight': self.flight.pk,
+            'ticketCount': ticket_count})
+
+    def reserved_seats(self):
+        """Read the seat counter of the test flight"""
+        return Flight.objects.get(pk=self.flight.pk).reservedSeats
+
+    def test_counter_follows_reservations(self):
+        """Creating, changing and deleting reservations moves the seat counter"""
+        self.assertEqual(self.reserve('Jan', 8).status_code, 302)
+        self.assertEqual(self.reserve('Ewa', 9).status_code, 302)
+        self.assertEqual(self.reserved_seats(), 17)
+        self.assertEqual(self.reserve('Jan', 3).status_code, 302)
+        self.assertEqual(self.reserved_seats(), 12)
+
+        Reservation.objects.get(passenger__name='Ewa').delete()
+        self.assertEqual(self.reserved_seats(), 3)
+        self.assertContains(self.client.get('/details/%d' % self.flight.pk),
+                            '<td id="freeSeats">17</td>')
+
+    def test_overbooking(self):
+        """A reservation exceeding plane capacity is rejected and leaves the counter intact"""
+        self.assertEqual(self.reserve('Jan', 15).status_code, 302)
+        self.assertEqual(self.reserve('Ewa', 6).status_code, 400)
+        self.assertEqual(self.reserved_seats(), 15)
+        self.assertFalse(Reservation.objects.filter(passenger__name='Ewa', ticketCount__gt=0))
+
+    def test_reconcile_command(self):
+        """Broken counters are reported, and recounted with --fix"""
+        self.reserve('Jan', 5)
+        Flight.objects.filter(pk=self.flight.pk).update(reservedSeats=11)
+
+        out = StringIO()
+        call_command('reconcile_seats', stdout=out)
+        self.assertIn('1 flights with stale seats found', out.getvalue())
+        self.assertEqual(self.reserved_seats(), 11)
+
+        call_command('reconcile_seats', '--fix', stdout=out)
+        self.assertEqual(self.reserved_seats(), 5)
+
+    def test_reconcile_seat_maps(self):
+        """Seat maps disagreeing with tickets are reported and rebuilt with --fix, keeping the
+        seats reservations hold where they can"""
+        self.reserve('Jan', 2)
+        self.reserve('Ewa', 3)
+        jan = Reservation.objects.get(passenger__name='Jan')
+        Reservation.objects.filter(pk=jan.pk).update(seatMap=to_map(0b10100))
+        Flight.objects.filter(pk=self.flight.pk).update(seatMap=to_map(0b11))
+
+        out = StringIO()
+        call_command('reconcile_seats', stdout=out)
+        self.assertIn('Flight %d: 5 seats counted, 2 in its seat map, 3 held by reservations, '
+                      '5 reserved' % self.flight.pk, out.getvalue())
+        call_command('reconcile_seats', '--fix', stdout=out)
+        self.assertEqual(seat_labels(Reservation.objects.get(pk=jan.pk).seatMap, 6), ['1C', '1E'])
+        self.assertEqual(seat_labels(Reservation.objects.get(passenger__name='Ewa').seatMap, 6),
+                         ['1A', '1B', '1D'])
+        self.assertEqual(Flight.objects.get(pk=self.flight.pk).seatMap, to_map(0b11111))
+        self.assertEqual(self.reserved_seats(), 5)
+
+        out = StringIO()
+        call_command('reconcile_seats', stdout=out)
+        self.assertIn('0 flights with stale seats found', out.getvalue())
+
+    def test_reconcile_overbooked(self):
+        """Reservations with more tickets than seats, e.g. from before seat maps, are reported"""
+        self.reserve('Jan', 2)
+        jan = Reservation.objects.get(passenger__name='Jan')
+        Reservation.objects.filter(pk=jan.pk).update(ticketCount=25)
+
+        out = StringIO()
+        call_command('reconcile_seats', '--fix', stdout=out)
+        self.assertIn('reservations %d hold other numbers of seats than tickets' % jan.pk,
+                      out.getvalue())
+        self.assertIn('1 flights have more tickets than seats', out.getvalue())
+        self.assertEqual(self.reserved_seats(), 20)
+
+
+@override_settings(FLIGHTS_OPTIMISTIC_RESERVATIONS=True)
+class OptimisticReservationTest(ReservationTest):
+    """The same as ReservationTest, with reservations changed by compare-and-swap"""
+
+    def test_stale_version(self):
+        """A reservation changed since it was read isn't overwritten, bookings try again"""
+        self.reserve('Jan', 5)
+        stale = Reservation.objects.get(passenger__name='Jan')
+        self.reserve('Jan', 7)
+        self.assertFalse(stale.swap_tickets(2))
+        self.assertEqual((Reservation.objects.get(pk=stale.pk).ticketCount,
+                          Reservation.objects.get(pk=stale.pk).version,
+                          self.reserved_seats()), (7, 2, 7))
+
+        passenger = Passenger.objects.get(name='Jan').pk
+        with mock.patch.object(Reservation, 'swap_tickets', autospec=True,
+                               side_effect=[False, True]) as swap:
+            book_reservation(passenger, self.flight.pk, 2)
+        self.assertEqual(swap.call_count, 2)
+        with mock.patch.object(Reservation, 'swap_tickets', return_value=False):
+            self.assertRaises(ValidationError, book_reservation, passenger, self.flight.pk, 2)
+
+    def test_versions(self):
+        """Every change of a reservation and of a seat counter moves their versions"""
+        self.reserve('Jan', 5)
+        self.reserve('Jan', 6)
+        reservation = Reservation.objects.get(passenger__name='Jan')
+        reservation.ticketCount = 4
+        reservation.save()
+        self.assertEqual(Reservation.objects.get(pk=reservation.pk).version, 3)
+        self.assertEqual(Flight.objects.get(pk=self.flight.pk).seatsVersion, 3)
+
+    def test_no_row_locks(self):
+        """Bookings of different passengers of a flight don't lock its row"""
+        self.reserve('Jan', 5)
+        with mock.patch.object(QuerySet, 'select_for_update') as select_for_update:
+            self.assertEqual(self.reserve('Jan', 3).status_code, 302)
+            self.assertEqual(self.reserve('Ewa', 4).status_code, 302)
+        select_for_update.assert_not_called()
+        self.assertEqual(self.reserved_seats(), 7)
+
+    def test_stale_seats(self):
+        """Seats changed since they were read aren't overwritten, bookings try again"""
+        self.reserve('Jan', 5)
+        passenger = Passenger.objects.get(name='Jan').pk
+        changes = [1]
+
+        def concurrent_change(*args):
+            """Let another booking change the seats after they were read"""
+            if changes:
+                changes.pop()
+                Flight.objects.filter(pk=self.flight.pk).update(
+                    seatsVersion=F('seatsVersion') + 1)
+            return move_seats(*args)
+
+        with mock.patch('flights.models.move_seats', side_effect=concurrent_change):
+            self.assertFalse(Reservation.objects.get(passenger=passenger).swap_tickets(2))
+            self.assertEqual(self.reserved_seats(), 5)
+            changes.append(1)
+            book_reservation(passenger, self.flight.pk, 2)
+        self.assertEqual((self.reserved_seats(), changes), (2, []))
+
+
+class SeatMapTest(TestCase):
+    """Unit tests for giving reservations seats of their flights"""
+
+    def setUp(self):
+        """Add initial data to db and authenticate future POST requests"""
+        init_database()
+        self.flight = Flight.objects.get(plane__identifier='p1')
+
+        user = User.objects.create(username='asdf', password='qwer')
+        user.save()
+        self.client.force_login(user)
+
+    def reserve(self, name, ticket_count):
+        """Post a reservation form for the test flight"""
+        return self.client.post('/reserve', data={
+            'name': name, 'surname': 'Nowak', 'flight': self.flight.pk,
+            'ticketCount': ticket_count})
+
+    def seats(self):
+        """Names of seats held by every passenger of the test flight"""
+        return {reservation.passenger.name: seat_labels(reservation.seatMap, 6)
+                for reservation in Reservation.objects.filter(flight=self.flight)
+                .select_related('passenger')}
+
+    def test_bits(self):
+        """Free seats are taken lowest first and given back highest first"""
+        self.assertEqual(take_seats(0b1011, 2, 20), 0b10100)
+        self.assertIsNone(take_seats(0b1011, 2, 4))
+        self.assertEqual(last_seats(0b1011, 2), 0b1010)
+        self.assertEqual(seat_labels(to_map(0b1000001), 6), ['1A', '2A'])
+
+    def test_reserve(self):
+        """Reservations hold as many seats as tickets, the counter is the number of seats taken"""
+        self.reserve('Jan', 3)
+        self.reserve('Ewa', 2)
+        self.reserve('Jan', 1)
+        self.reserve('Ola', 3)
+        self.assertEqual(self.seats(), {'Jan': ['1A'], 'Ewa': ['1D', '1E'],
+                                        'Ola': ['1B', '1C', '1F']})
+        Reservation.objects.get(passenger__name='Ewa').delete()
+        flight = Flight.objects.get(pk=self.flight.pk)
+        self.assertEqual((seat_labels(flight.seatMap, 6), flight.reservedSeats),
+                         (['1A', '1B', '1C', '1F'], 4))
+
+        self.assertEqual(self.reserve('Ewa', 17).status_code, 400)
+        self.assertEqual(self.reserve('Ewa', 16).status_code, 302)
+        self.assertEqual(self.seats()['Ewa'][:3] + self.seats()['Ewa'][-2:],
+                         ['1D', '1E', '2A', '4A', '4B'])
+        page = self.client.get('/details/%d' % self.flight.pk)
+        self.assertContains(page, '<td id="freeSeats">0</td>')
+        self.assertContains(page, '<td>1A</td>')
+
+    def test_batch(self):
+        """Batches tell seats of their reservations and move seats like single ones do"""
+        response = self.client.post('/REST/reservations/batch', content_type='application/json',
+                                    data=json.dumps({'reservations': [
+                                        {'name': name, 'surname': 'Nowak',
+                                         'flight': self.flight.pk, 'ticketCount': count}
+                                        for name, count in (('Jan', 2), ('Ewa', 1))]}))
+        self.assertEqual([item['seats'] for item in response.json()['response']],
+                         [['1A', '1B'], ['1C']])
+        self.assertEqual(Flight.objects.get(pk=self.flight.pk).reservedSeats, 3)
+
+
+class PassengerDirectoryTest(TransactionTestCase):
+    """Unit tests for resolving passengers by their names"""
+
+    def setUp(self):
+        """Start with no passengers known"""
+        PASSENGERS.reset()
+
+    def test_resolve(self):
+        """Names differing in letter case and whitespace resolve to one passenger, which is
+        found without queries from then on"""
+        pkey = PASSENGERS.resolve('Jan', 'Nowak')
+        self.assertEqual(PASSENGERS.resolve_many([(' JAN ', 'nowak'), ('Ewa', 'Kowalska')])[
+            ' JAN ', 'nowak'], pkey)
+        self.assertEqual(Passenger.objects.get(pk=pkey).name, 'Jan')
+        with self.assertNumQueries(0):
+            PASSENGERS.resolve('jan', 'NOWAK')
+        self.assertRaises(ValidationError, PASSENGERS.resolve, '', 'Nowak')
+
+    def test_rolled_back_and_deleted_passengers(self):
+        """Passengers created by rolled back transactions or deleted are not remembered"""
+        try:
+            with transaction.atomic():
+                PASSENGERS.resolve('Jan', 'Nowak')
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        pkey = PASSENGERS.resolve('Jan', 'Nowak')
+        self.assertTrue(Passenger.objects.filter(pk=pkey).exists())
+        Passenger.objects.filter(pk=pkey).delete()
+        self.assertNotEqual(PASSENGERS.resolve('Jan', 'Nowak'), pkey)
+
+    def test_deleted_by_another_process(self):
+        """Bookings of a passenger deleted elsewhere, still cached, run again with a new one"""
+        pkey = PASSENGERS.resolve('Jan', 'Nowak')
+        with mock.patch.object(PASSENGERS, 'forget'):  # the deleting process has its own map
+            Passenger.objects.filter(pk=pkey).delete()
+        self.assertRaises(Passenger.DoesNotExist, book_reservation, pkey, 1, 1)
+
+        booked = []
+
+        def book(ids):
+            booked.append(ids['Jan', 'Nowak'])
+            return Passenger.objects.get(pk=ids['Jan', 'Nowak'])
+
+        def fail(_):
+            raise IntegrityError
+
+        passenger = PASSENGERS.resolve_for([('Jan', 'Nowak')], book)
+        self.assertEqual(booked, [pkey, passenger.pk])
+        self.assertNotEqual(passenger.pk, pkey)
+        self.assertEqual(PASSENGERS.resolve('Jan', 'Nowak'), passenger.pk)
+        self.assertRaises(IntegrityError, PASSENGERS.resolve_for, [('Jan', 'Nowak')], fail)
+
+    @mock.patch.dict('flights.passengers.INSERT_IGNORING', clear=True)
+    def test_savepoint_inserts(self):
+        """Databases without a statement ignoring conflicts skip existing passengers too"""
+        pkey = PASSENGERS.resolve('Jan', 'Nowak')
+        PASSENGERS.reset()
+        ids = PASSENGERS.resolve_many([('jan', 'NOWAK'), ('Ewa', 'Kowalska')])
+        self.assertEqual(ids['jan', 'NOWAK'], pkey)
+        self.assertEqual(Passenger.objects.count(), 2)
+
+    def test_eviction(self):
+        """The least recently used passengers are forgotten over the size limit"""
+        directory = PassengerDirectory(size=2)
+        for name in ('a', 'b', 'a', 'c'):
+            directory.resolve(name, 'Nowak')
+        self.assertEqual(list(directory.ids), [passenger_key(name, 'Nowak')
+                                               for name in ('a', 'c')])
+
+
+class BatchReservationTest(TestCase):
+    """Unit tests for reserving seats on many flights at once"""
+
+    def setUp(self):
+        """Add initial data to db and authenticate future requests"""
+        init_database()
+        self.first, self.second = Flight.objects.order_by('takeoffTime')[:2]
+
+        user = User.objects.create(username='asdf', password='qwer')
+        user.save()
+        self.client.force_login(user)
+
+    def book(self, *items):
+        """Post a batch of (name, flight, ticketCount) reservations"""
+        return self.client.post('/REST/reservations/batch', content_type='application/json',
+                                data=json.dumps({'reservations': [
+                                    {'name': name, 'surname': 'Nowak', 'flight': flight.pk,
+                                     'ticketCount': count} for name, flight, count in items]}))
+
+    def seats(self):
+        """Read seat counters of both test flights"""
+        return [Flight.objects.get(pk=flight.pk).reservedSeats
+                for flight in (self.first, self.second)]
+
+    def test_all_saved(self):
+        """New and changed reservations move counters of all their flights"""
+        response = self.book(('Jan', self.first, 5), ('Jan', self.second, 5),
+                             ('Ewa', self.first, 2))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['ticketCount'] for item in response.json()['response']], [5, 5, 2])
+        self.assertEqual(self.seats(), [7, 5])
+
+        self.assertEqual(self.book(('Jan', self.first, 1), ('Ewa', self.first, 20)).status_code,
+                         400)
+        self.assertEqual(self.book(('Jan', self.first, 1), ('Ewa', self.first, 19)).status_code,
+                         200)
+        self.assertEqual(self.seats(), [20, 5])
+        self.assertEqual(Reservation.objects.get(passenger__name='Jan', flight=self.first)
+                         .ticketCount, 1)
+
+    def test_concurrent_change(self):
+        """A batch doesn't overwrite reservations changed since it read them"""
+        self.book(('Jan', self.first, 5))
+        stale = Reservation.objects.get(passenger__name='Jan')
+        Reservation.objects.get(pk=stale.pk).swap_tickets(6)
+        stale.ticketCount = 2
+        self.assertRaises(ValidationError, save_reservations, [stale])
+        self.assertEqual(Reservation.objects.get(pk=stale.pk).ticketCount, 6)
+
+    def test_all_rejected(self):
+        """One invalid item rejects the whole batch and every invalid item gets its errors"""
+        response = self.book(('Jan', self.first, 5), ('Ewa', self.second, 21),
+                             ('Ewa', self.second, 1), ('Ola', self.first, -1))
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(sorted(errors), ['1', '2', '3'])
+        self.assertIn('capacity', errors['1'][0])
+        self.assertIn('in the batch', errors['2'][0])
+        self.assertEqual(self.seats(), [0, 0])
+        self.assertFalse(Passenger.objects.exists())
+
+        response = self.client.post('/REST/reservations/batch', content_type='application/json',
+                                    data=json.dumps({'reservations': [{'name': 'Jan'}]}))
+        self.assertEqual(list(response.json()['errors']), ['0'])
+
+    def test_requires_login(self):
+        """Anonymous users can't reserve"""
+        self.client.logout()
+        self.assertEqual(self.book(('Jan', self.first, 1)).status_code, 403)
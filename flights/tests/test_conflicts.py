@@ -0,0 +1,193 @@
+"""Tests of schedule conflict checks, in-memory indexes and validation"""
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+
+from flights.conflicts import QUERIES, SCHEDULE
+from flights.models import Crew, Flight, Reservation, Passenger
+from flights.rostering import assign_crews
+from flights.tests import init_database
+from flights.validation import validate_flights, validate_reservations
+
+
+@override_settings(FLIGHTS_SCHEDULE_INDEX=True)
+class ScheduleIndexTest(TestCase):
+    """Unit tests for in-memory detection of plane and crew schedule conflicts"""
+
+    def setUp(self):
+        """Load the index of the empty schedule, then add initial data to db, which the index
+        learns about as changes of the ongoing transaction"""
+        SCHEDULE.ensure_loaded()
+        init_database()
+        self.first = Flight.objects.get(plane__identifier='p1')
+
+    def make_flight(self, takeoff_delta, landing_delta, plane='p1', **kwargs):
+        """Build a flight relative to the first one without saving it"""
+        return Flight(plane_id=plane, takeoffAirport_id=self.first.takeoffAirport_id,
+                      landingAirport_id=self.first.landingAirport_id,
+                      takeoffTime=self.first.takeoffTime + takeoff_delta,
+                      landingTime=self.first.takeoffTime + landing_delta, **kwargs)
+
+    def test_plane_overlaps(self):
+        """Touching or overlapping intervals of the same plane are conflicts"""
+        hour = timedelta(hours=1)
+        self.assertEqual(SCHEDULE.plane_conflicts(self.first), 0)
+        self.assertEqual(SCHEDULE.plane_conflicts(self.make_flight(-hour, hour)), 1)
+        self.assertEqual(SCHEDULE.plane_conflicts(self.make_flight(-2 * hour, 0 * hour)), 1)
+        self.assertEqual(SCHEDULE.plane_conflicts(self.make_flight(-3 * hour, -hour)), 0)
+        self.assertEqual(SCHEDULE.plane_conflicts(self.make_flight(-hour, hour, plane='p2')),
+                         0)
+        self.assertRaises(ValidationError, self.make_flight(hour, 2 * hour).full_clean)
+
+    def test_index_follows_saves_and_deletes(self):
+        """Moving and deleting flights is reflected without rebuilding the index"""
+        hour = timedelta(hours=1)
+        probe = self.make_flight(-hour, hour)
+        self.assertEqual(SCHEDULE.plane_conflicts(probe), 1)
+
+        self.first.takeoffTime -= 10 * hour
+        self.first.landingTime -= 10 * hour
+        self.first.save()
+        self.assertEqual(SCHEDULE.plane_conflicts(probe), 0)
+
+        self.first.delete()
+        self.assertEqual(SCHEDULE.plane_conflicts(self.make_flight(-10 * hour, -9 * hour)), 0)
+
+    def test_crew_overlaps(self):
+        """A crew can't be assigned to a flight overlapping another of its flights"""
+        crew = Crew.objects.first()
+        self.first.crew = crew
+        self.first.save()
+        other = Flight.objects.filter(plane__identifier='p2').earliest('takeoffTime')
+        other.crew = crew
+        self.assertEqual(SCHEDULE.crew_conflicts(other), 1)
+        self.assertRaises(ValidationError, other.save)
+
+    def test_rolled_back_changes(self):
+        """Changes of flights rolled back are forgotten, committed ones wait for the commit"""
+        crew = Crew.objects.first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.first.crew = crew
+            self.first.save()
+            Flight.objects.get(pk=self.first.pk).delete()
+            raise IntegrityError
+        probe = self.make_flight(timedelta(0), timedelta(hours=1))
+        self.assertEqual(SCHEDULE.plane_conflicts(probe), 1)
+        other = Flight.objects.filter(plane__identifier='p2').earliest('takeoffTime')
+        other.crew = crew
+        other.save()
+        self.assertEqual(SCHEDULE.crew.intervals, {})
+
+    def test_batch_crews(self):
+        """Crews written in bulk count in their transaction and are forgotten if it rolls back"""
+        crew = Crew.objects.first()
+        other = Flight.objects.filter(plane__identifier='p2').earliest('takeoffTime')
+        other.crew = crew
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.assertEqual(assign_crews([{'flight': self.first.pk, 'crew': crew.pk}]), {})
+            self.assertEqual(SCHEDULE.crew_conflicts(other), 1)
+            raise IntegrityError
+        self.assertEqual(SCHEDULE.crew_conflicts(other), 0)
+
+    def test_daily_limit(self):
+        """Planes can't be used for more than DAILY_FLIGHTS_PER_PLANE flights a day"""
+        with self.assertNumQueries(0):
+            SCHEDULE.daily_flights(self.first, self.first.takeoffTime)
+        self.assertEqual(SCHEDULE.daily_flights(self.first, self.first.takeoffTime), 1)
+        self.assertEqual(SCHEDULE.daily_flights(self.make_flight(
+            timedelta(hours=5), timedelta(hours=6)), self.first.takeoffTime), 2)
+
+
+@override_settings(FLIGHTS_SCHEDULE_INDEX=False)
+class QueryScheduleTest(ScheduleIndexTest):
+    """The same as ScheduleIndexTest, with flights validated by queries"""
+
+    def test_daily_limit(self):
+        """Flights of a day are counted without loading the index"""
+        SCHEDULE.reset()
+        probe = self.make_flight(timedelta(hours=5), timedelta(hours=6))
+        self.assertEqual(QUERIES.daily_flights(probe, self.first.takeoffTime), 2)
+        self.assertFalse(SCHEDULE.loaded)
+        self.assertEqual(QUERIES.daily_flights(self.first, self.first.takeoffTime), 1)
+
+    def test_same_answers(self):
+        """Queries find the same conflicts as the index does"""
+        hour = timedelta(hours=1)
+        crew = Crew.objects.first()
+        self.first.crew = crew
+        self.first.save()
+        for takeoff, landing in ((-hour, hour), (-2 * hour, 0 * hour), (-3 * hour, -hour),
+                                 (5 * hour, 6 * hour), (-20 * hour, -19 * hour)):
+            for plane in ('p1', 'p2'):
+                probe = self.make_flight(takeoff, landing, plane=plane, crew=crew)
+                for check in ('plane_conflicts', 'crew_conflicts'):
+                    self.assertEqual(getattr(QUERIES, check)(probe),
+                                     getattr(SCHEDULE, check)(probe))
+                self.assertEqual(QUERIES.daily_flights(probe, probe.landingTime),
+                                 SCHEDULE.daily_flights(probe, probe.landingTime))
+
+
+class ValidationTest(TestCase):
+    """Unit tests for validation before saves and for validating batches"""
+
+    def setUp(self):
+        """Add initial data to db"""
+        init_database()
+        self.first = Flight.objects.get(plane__identifier='p1')
+
+    def test_only_app_models_validated(self):
+        """Saving users or sessions doesn't run model validation"""
+        with mock.patch.object(User, 'full_clean') as user_clean:
+            User.objects.create(username='asdf', password='qwer')
+        user_clean.assert_not_called()
+
+        with mock.patch.object(Flight, 'full_clean') as flight_clean:
+            self.first.save()
+        flight_clean.assert_called_once_with(validate_unique=False)
+
+    def test_invalid_flight_not_written(self):
+        """A flight breaking the rules is rejected before it reaches the database"""
+        self.first.landingTime = self.first.takeoffTime
+        self.assertRaises(ValidationError, self.first.save)
+        self.assertNotEqual(Flight.objects.get(pk=self.first.pk).landingTime,
+                            self.first.takeoffTime)
+
+    def test_flight_batch(self):
+        """Flights of a batch are checked against each other and the stored schedule"""
+        other = Flight.objects.filter(plane__identifier='p2').earliest('takeoffTime')
+        moved = Flight(pk=self.first.pk, plane_id='p1', takeoffAirport_id=other.landingAirport_id,
+                       landingAirport_id=other.takeoffAirport_id,
+                       takeoffTime=self.first.takeoffTime + timedelta(minutes=30),
+                       landingTime=self.first.landingTime + timedelta(minutes=30))
+        clashing = Flight(plane_id='p1', takeoffAirport_id=other.takeoffAirport_id,
+                          landingAirport_id=other.landingAirport_id,
+                          takeoffTime=self.first.landingTime,
+                          landingTime=self.first.landingTime + timedelta(hours=1))
+        other.crew = Crew.objects.first()
+        unknown_plane = Flight(plane_id='p9', takeoffAirport_id=other.takeoffAirport_id,
+                               landingAirport_id=other.landingAirport_id,
+                               takeoffTime=other.takeoffTime, landingTime=other.landingTime)
+
+        with self.assertNumQueries(6):
+            errors = validate_flights([moved, clashing, other, unknown_plane])
+        self.assertEqual(sorted(errors), [1, 3])
+        self.assertIn('simultaneous flights', errors[1].messages[0])
+        self.assertIn('plane', errors[3].message_dict)
+
+    def test_reservation_batch(self):
+        """Seat capacity is checked for all reservations of a flight together"""
+        passengers = [Passenger.objects.create(name='n%d' % i, surname='s') for i in range(3)]
+        reservations = [Reservation(passenger=passengers[0], flight=self.first, ticketCount=12),
+                        Reservation(passenger=passengers[1], flight=self.first, ticketCount=9),
+                        Reservation(passenger=passengers[2], flight_id=self.first.pk + 9,
+                                    ticketCount=1)]
+        errors = validate_reservations(reservations)
+        self.assertEqual(sorted(errors), [0, 1, 2])
+        self.assertIn('flight', errors[2].message_dict)
+
+        reservations[1].ticketCount = 8
+        self.assertEqual(validate_reservations(reservations[:2]), {})
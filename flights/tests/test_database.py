@@ -0,0 +1,45 @@
+"""Tests of database routing and connection handling"""
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from flights.database import check_connections
+from flights.models import Flight
+from flights.routers import ReadReplicaRouter
+
+
+class ReadReplicaRouterTest(SimpleTestCase):
+    """Unit tests for sending reads to a replica database"""
+    replica = dict(ENGINE='django.db.backends.sqlite3', NAME='replica.sqlite3')
+
+    def test_reads(self):
+        """Reads go to the replica only when it exists and no write transaction is open"""
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(Flight), 'default')
+        with override_settings(DATABASES=dict(default={}, replica=self.replica)):
+            self.assertEqual(router.db_for_read(Flight), 'replica')
+            self.assertEqual(router.db_for_write(Flight), 'default')
+            with mock.patch.object(connection, 'in_atomic_block', True):
+                self.assertEqual(router.db_for_read(Flight), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'flights'))
+
+
+class ConnectionHealthTest(TestCase):
+    """Check that broken persistent connections are dropped when requests start"""
+
+    def check(self, checks, usable, in_atomic_block=False):
+        """Whether a request closes the connection in given circumstances"""
+        with override_settings(FLIGHTS_DB_HEALTH_CHECKS=checks), \
+                mock.patch.object(connection, 'in_atomic_block', in_atomic_block), \
+                mock.patch.object(connection, 'is_usable', return_value=usable), \
+                mock.patch.object(connection, 'close') as close:
+            check_connections(sender=self.__class__)
+        return close.called
+
+    def test_health_checks(self):
+        """Only unusable connections, when checks are on, outside transactions"""
+        self.assertTrue(self.check(True, False))
+        self.assertFalse(self.check(True, True))
+        self.assertFalse(self.check(False, False))
+        self.assertFalse(self.check(True, False, in_atomic_block=True))
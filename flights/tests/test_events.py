@@ -0,0 +1,150 @@
+"""Tests of event streams and ASGI serving"""
+import asyncio
+import json
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+
+from flights.asgi import ASGIHandler
+from flights.conflicts import SCHEDULE
+from flights.events import LocalEventBackend, backend as event_backend
+from flights.models import Crew, Flight
+from flights.passengers import PASSENGERS
+from flights.tests import init_database
+
+
+@override_settings(FLIGHTS_LIVE_UPDATES=True)
+class EventsTest(TransactionTestCase):
+    """Unit tests for pushing seat and crew changes to event stream subscribers"""
+
+    def setUp(self):
+        """Add initial data to db, subscribe to events and authenticate future requests"""
+        SCHEDULE.reset()
+        init_database()
+        PASSENGERS.reset()
+        self.flight = Flight.objects.get(plane__identifier='p1')
+        self.events = event_backend().subscribe()
+        self.addCleanup(self.events.close)
+
+        user = User.objects.create(username='asdf', password='qwer')
+        user.save()
+        self.client.force_login(user)
+
+    def test_changes_published_on_commit(self):
+        """Reservations publish seat counters, crew changes publish whole flights"""
+        self.client.post('/reserve', data={'name': 'Jan', 'surname': 'Nowak',
+                                           'flight': self.flight.pk, 'ticketCount': 5})
+        event = self.events.get(timeout=1)
+        self.assertEqual((event.kind, event.data), ('seats', {
+            'flight': self.flight.pk, 'reservedSeats': 5, 'freeSeats': 15, 'version': 1}))
+
+        crew = Crew.objects.first()
+        for _ in range(2):
+            self.client.post('/REST/setCrew', content_type='application/json',
+                             data=json.dumps({'crew': crew.pk, 'flight': self.flight.pk}))
+        event = self.events.get(timeout=1)
+        self.assertEqual((event.kind, event.data['id'], event.data['crew']),
+                         ('crew', self.flight.pk, crew.pk))
+        self.assertIn('led by', event.data['title'])
+        self.assertIsNone(self.events.get(timeout=0))
+
+    def test_stream(self):
+        """The stream encodes events of a chosen flight and unsubscribes when closed"""
+        response = self.client.get('/REST/events', {'flight': self.flight.pk})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = iter(response.streaming_content)
+        self.assertTrue(next(stream).startswith(b'retry:'))
+        event_backend().publish('seats', {'flight': self.flight.pk + 1})
+        event_backend().publish('seats', {'flight': self.flight.pk})
+        self.assertRegex(next(stream).decode(),
+                         r'^id: \d+\nevent: seats\ndata: {"flight": %d}\n\n$' % self.flight.pk)
+
+        subscribers = len(event_backend().subscribers)
+        response.close()
+        self.assertEqual(len(event_backend().subscribers), subscribers - 1)
+
+    def test_live_updates_off(self):
+        """Without live updates the stream isn't served and pages don't subscribe to it"""
+        self.assertContains(self.client.get('/details/%d' % self.flight.pk), 'EventSource')
+        self.assertTrue(self.client.get('/REST/crews').json()['liveUpdates'])
+        with self.settings(FLIGHTS_LIVE_UPDATES=False):
+            self.assertEqual(self.client.get('/REST/events').status_code, 404)
+            self.assertNotContains(self.client.get('/details/%d' % self.flight.pk),
+                                   'EventSource')
+
+    def test_resume(self):
+        """Subscribers can continue after the last event they got, or learn that it's too late"""
+        backend = LocalEventBackend()
+        for i in range(3):
+            backend.publish('seats', {'flight': i})
+        events = backend.subscribe(last_id=1)
+        self.assertEqual([events.get(timeout=0).id for _ in range(2)], [2, 3])
+        self.assertIsNone(events.get(timeout=0))
+
+        backend.history.popleft()
+        self.assertEqual(backend.subscribe(last_id=0).get(timeout=0).kind, 'reset')
+
+
+@override_settings(FLIGHTS_LIVE_UPDATES=True)
+class ASGITest(TransactionTestCase):
+    """Unit tests for serving the project through ASGI"""
+
+    def setUp(self):
+        """Add initial data to db and start an application with its own event loop"""
+        SCHEDULE.reset()
+        init_database()
+        self.application = ASGIHandler(2)
+        self.addCleanup(self.application.pool.shutdown)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def call(self, path, receive):
+        """Run a GET request of [path]; return messages the application sent"""
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+                 'headers': [(b'host', b'localhost')]}
+        self.loop.run_until_complete(asyncio.wait_for(
+            self.application(scope, receive, send), timeout=10))
+        return sent
+
+    def test_request(self):
+        """Requests are handled by Django, response bodies sent as they are produced"""
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+        sent = self.call('/REST/crews', receive)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'application/json'), sent[0]['headers'])
+        body = json.loads(b''.join(message.get('body', b'') for message in sent[1:]).decode())
+        self.assertEqual(len(body['response']), 6)
+        self.assertFalse(sent[-1].get('more_body'))
+
+    def test_event_stream(self):
+        """Event streams are served by a coroutine until the client disconnects"""
+        messages = []
+        subscribers = len(event_backend().subscribers)
+
+        async def receive():
+            messages.append(None)
+            if len(messages) == 1:
+                return {'type': 'http.request', 'body': b''}
+            await asyncio.sleep(0.1)
+            # publish from another thread, like a Django view would
+            await self.loop.run_in_executor(None, event_backend().publish, 'seats', {'flight': 1})
+            await asyncio.sleep(0.1)
+            return {'type': 'http.disconnect'}
+        sent = self.call('/REST/events', receive)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertTrue(sent[1]['body'].startswith(b'retry:'))
+        self.assertRegex(sent[2]['body'].decode(),
+                         r'^id: \d+\nevent: seats\ndata: {"flight": 1}\n\n$')
+        self.assertEqual(len(event_backend().subscribers), subscribers)
+
+    @override_settings(FLIGHTS_LIVE_UPDATES=False)
+    def test_live_updates_off(self):
+        """Without live updates the event stream isn't served"""
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+        self.assertEqual(self.call('/REST/events', receive)[0]['status'], 404)
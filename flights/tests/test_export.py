@@ -0,0 +1,111 @@
+"""Tests of NumPy schedule exports and audits"""
+import os
+from datetime import timedelta
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from flights.audit import audit_schedule
+from flights.models import Crew, Flight, Reservation, Passenger
+from flights.tests import init_database
+
+try:
+    import numpy
+except ImportError:  # tests that need it are skipped
+    numpy = None
+
+
+@skipUnless(numpy, 'NumPy is not installed')
+class ExportTest(TestCase):
+    """Unit tests for exporting the schedule as NumPy arrays"""
+
+    def setUp(self):
+        """Add initial data to db, with a crew and a reservation"""
+        init_database()
+        self.flight = Flight.objects.get(plane__identifier='p1')
+        self.flight.crew = Crew.objects.first()
+        self.flight.save()
+        Reservation.objects.create(passenger=Passenger.objects.create(name='Jan', surname='Nowak'),
+                                   flight=self.flight, ticketCount=3)
+
+    def check_export(self, arrays):
+        """Compare exported columns with the database"""
+        flights = list(Flight.objects.order_by('pk'))
+        self.assertEqual(list(arrays['flights.id']), [flight.pk for flight in flights])
+        planes = arrays['planes.identifier']
+        self.assertEqual([planes[code] for code in arrays['flights.plane']],
+                         [flight.plane_id for flight in flights])
+        airports = arrays['airports.name']
+        self.assertEqual([airports[code] for code in arrays['flights.landingAirport']],
+                         [flight.landingAirport.name for flight in flights])
+        self.assertEqual(list(arrays['flights.takeoffTime']),
+                         [int(flight.takeoffTime.timestamp() * 10 ** 6) for flight in flights])
+        self.assertEqual(list(arrays['flights.crew']),
+                         [flight.crew_id or -1 for flight in flights])
+        self.assertEqual(list(arrays['reservations.flight']), [self.flight.pk])
+        self.assertEqual(list(arrays['reservations.ticketCount']), [3])
+
+    def test_command(self):
+        """Columns can be memory-mapped and no temporary files are left"""
+        with TemporaryDirectory() as directory:
+            call_command('export_schedule', directory, stdout=StringIO())
+            self.assertTrue(all(name.endswith('.npy') for name in os.listdir(directory)))
+            arrays = {name[:-len('.npy')]: numpy.load(os.path.join(directory, name),
+                                                      mmap_mode='r')
+                      for name in os.listdir(directory)}
+            self.assertIsInstance(arrays['flights.takeoffTime'], numpy.memmap)
+            self.check_export(arrays)
+            del arrays
+
+    def test_endpoint(self):
+        """The endpoint returns the same arrays in an .npz archive"""
+        response = self.client.get('/REST/export')
+        self.assertEqual(response.status_code, 200)
+        self.check_export(numpy.load(BytesIO(b''.join(response.streaming_content))))
+
+
+@skipUnless(numpy, 'NumPy is not installed')
+class AuditTest(TestCase):
+    """Unit tests for auditing the whole stored schedule"""
+
+    def setUp(self):
+        """Add initial data to db"""
+        init_database()
+        self.first = Flight.objects.get(plane__identifier='p1')
+
+    def test_valid_schedule(self):
+        """Nothing is reported about a schedule that passed validation"""
+        self.assertEqual(audit_schedule(), [])
+        output = StringIO()
+        call_command('audit_schedule', stdout=output)
+        self.assertIn('0 violations found', output.getvalue())
+
+    def test_violations(self):
+        """Every rule broken by rows written past validation is reported"""
+        second = Flight.objects.filter(plane__identifier='p2').earliest('takeoffTime')
+        Flight.objects.filter(pk__in=[self.first.pk, second.pk]).update(crew=Crew.objects.first())
+        after = self.first.landingTime
+        airports = (self.first.takeoffAirport_id, self.first.landingAirport_id)
+        added = Flight.objects.bulk_create([
+            Flight(plane_id='p1', takeoffAirport_id=start, landingAirport_id=end,
+                   takeoffTime=after + timedelta(hours=hours),
+                   landingTime=after + timedelta(hours=hours, minutes=minutes))
+            for hours, minutes, start, end in (
+                (0, 40, *airports), (1, 60, airports[0], airports[0]), (3, 10, *airports),
+                (5, 60, *airports))])
+        touching = Flight.objects.get(plane_id='p1', takeoffTime=after)
+        Reservation.objects.bulk_create([Reservation(
+            passenger=Passenger.objects.create(name='Jan', surname='Nowak'), flight=second,
+            ticketCount=25)])
+
+        violations = {violation.rule: violation for violation in audit_schedule()}
+        self.assertEqual(set(violations), {'route', 'duration', 'plane overlap', 'crew overlap',
+                                           'daily limit', 'capacity'})
+        self.assertEqual(violations['plane overlap'].flights, (self.first.pk, touching.pk))
+        self.assertEqual(violations['crew overlap'].flights, (self.first.pk, second.pk))
+        self.assertEqual(len(violations['daily limit'].flights), 1 + len(added))
+        self.assertEqual(violations['capacity'].flights, (second.pk,))
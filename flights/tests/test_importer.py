@@ -0,0 +1,121 @@
+"""Tests of importing and seeding flight schedules"""
+import json
+from datetime import timedelta
+from random import Random
+from tempfile import NamedTemporaryFile
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from flights.conflicts import SCHEDULE
+from flights.importer import COLUMNS
+from flights.models import Crew, Flight
+from flights.seeding import seed_planes, seed_schedule
+from flights.tests import init_database
+
+
+class ImportScheduleTest(TestCase):
+    """Unit tests for validating and bulk loading schedule files"""
+
+    def setUp(self):
+        """Add initial data to db"""
+        init_database()
+        self.first = Flight.objects.get(plane__identifier='p1')
+
+    def import_file(self, suffix, content):
+        """Run the import command on a file, return its standard and error outputs"""
+        out, err = StringIO(), StringIO()
+        with NamedTemporaryFile('w', suffix=suffix) as schedule:
+            schedule.write(content)
+            schedule.flush()
+            call_command('import_schedule', schedule.name, batch_size=2, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def at(self, hours):
+        """Format a time relative to takeoff of the first flight"""
+        return (self.first.takeoffTime + timedelta(hours=hours)).isoformat()
+
+    def test_csv(self):
+        """Valid rows are saved, rows breaking the rules are reported"""
+        rows = [
+            ('p1', 'a2', self.at(10), 'a1', self.at(11), ''),  # fine
+            ('p1', 'a1', self.at(11.5), 'a2', self.at(12), ''),  # fine
+            ('p1', 'a1', self.at(1), 'a2', self.at(2), ''),  # overlaps with the first flight
+            ('p1', 'a1', self.at(10.5), 'a2', self.at(11.2), ''),  # overlaps with the import
+            ('p1', 'a1', self.at(20), 'a2', self.at(20.1), ''),  # too short
+            ('p1', 'a1', self.at(20), 'a3', self.at(21), ''),  # unknown airport
+        ]
+        out, err = self.import_file('.csv', 'plane,takeoffAirport,takeoffTime,landingAirport,'
+                                            'landingTime,crew\n' +
+                                    ''.join('%s\n' % ','.join(row) for row in rows))
+
+        self.assertIn('2 flights imported, 4 rejected', out)
+        self.assertIn('Line 4 rejected: There would be two simultaneous flights', err)
+        self.assertIn('Line 5 rejected: There would be two simultaneous flights', err)
+        self.assertIn('Line 6 rejected: Flight time is too short', err)
+        self.assertIn('Line 7 rejected: Unknown airport', err)
+        self.assertEqual(Flight.objects.filter(plane__identifier='p1').count(), 3)
+        self.assertEqual(SCHEDULE.plane_conflicts(Flight(
+            plane_id='p1', takeoffTime=self.first.takeoffTime + timedelta(hours=10),
+            landingTime=self.first.takeoffTime + timedelta(hours=10.5))), 1)
+
+    def test_json_lines_daily_limit(self):
+        """No more than DAILY_FLIGHTS_PER_PLANE flights per day get imported for a plane"""
+        crew = Crew.objects.first()
+        lines = [json.dumps({'plane': 'p1', 'takeoffAirport': 'a1', 'landingAirport': 'a2',
+                             'takeoffTime': self.at(-12 + hours), 'crew': crew.pk,
+                             'landingTime': self.at(-11.5 + hours)})
+                 for hours in range(5)] + ['{broken']
+        out, err = self.import_file('.jsonl', '\n'.join(lines))
+
+        self.assertIn('3 flights imported, 3 rejected', out)
+        self.assertIn('Line 4 rejected: Plane flight limit per day would be exceeded', err)
+        self.assertIn('Line 6 rejected: Malformed record', err)
+        self.assertEqual(Flight.objects.filter(crew=crew).count(), 3)
+
+    @mock.patch('flights.importer.JSON_CHUNK', 16)
+    def test_json_array(self):
+        """JSON arrays are read object by object, a malformed object ends the file"""
+        flights = [{'plane': 'p1', 'takeoffAirport': 'a1', 'landingAirport': 'a2',
+                    'takeoffTime': self.at(hours), 'landingTime': self.at(hours + 0.5)}
+                   for hours in (10, 12, 14)]
+        out, err = self.import_file('.json', '[\n%s,\n{"broken"\n]' % ',\n'.join(
+            json.dumps(flight) for flight in flights))
+
+        self.assertIn('3 flights imported, 1 rejected', out)
+        self.assertIn('Line 5 rejected: Malformed record', err)
+        self.assertEqual(Flight.objects.filter(plane__identifier='p1').count(), 4)
+
+    def test_unknown_format(self):
+        """Files of other extensions aren't guessed to be JSON lines"""
+        with self.assertRaisesMessage(CommandError, 'Cannot tell the format'):
+            self.import_file('.txt', '')
+
+    def test_dry_run_across_batches(self):
+        """Batches of a dry run are checked against earlier ones, and nothing is saved"""
+        rows = ''.join('p1,a1,%s,a2,%s,\n' % (self.at(hours), self.at(hours + 0.5))
+                       for hours in (10, 12, 10.2))
+        out, err = StringIO(), StringIO()
+        with NamedTemporaryFile('w', suffix='.csv') as schedule:
+            schedule.write(','.join(COLUMNS) + '\n' + rows)
+            schedule.flush()
+            call_command('import_schedule', schedule.name, batch_size=2, dry_run=True,
+                         stdout=out, stderr=err)
+
+        self.assertIn('0 flights imported, 1 rejected', out.getvalue())
+        self.assertIn('Line 4 rejected: There would be two simultaneous flights', err.getvalue())
+        self.assertEqual(Flight.objects.filter(plane__identifier='p1').count(), 1)
+
+    def test_seed_until_complete(self):
+        """Seeding generates flights in place of rejected ones until every plane has enough"""
+        identifiers = seed_planes(2, Random(0))
+        shortest = mock.Mock(randrange=lambda start, stop=None: 0 if stop is None else start)
+        saved, rejected = seed_schedule(identifiers, 10, shortest)
+
+        self.assertGreater(rejected, 0)
+        self.assertEqual(saved, 20)
+        for identifier in identifiers:
+            self.assertEqual(Flight.objects.filter(plane=identifier).count(), 10)
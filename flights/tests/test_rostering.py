@@ -0,0 +1,166 @@
+"""Tests of assigning crews to flights"""
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from flights.indexing import flights_written
+from flights.models import Crew, Flight
+from flights.rostering import assign_crews
+from flights.tests import check_crew_reassignment, check_crew_simultaneous_flights, init_database
+
+
+class CrewsTest(TestCase):
+    """Unit tests for crew assignment code correctness"""
+
+    def setUp(self):
+        """Add initial data to db and authenticate future POST requests"""
+        init_database()
+
+        # all requests made will be authenticated
+        user = User.objects.create(username='asdf', password='qwer')
+        user.save()
+        self.client.force_login(user)
+
+    def bind_crew(self, crew_index, flight_index):
+        """Send request to REST api that will attempt binding a crew to a flight"""
+        return self.client.post('/REST/setCrew', data=json.dumps({
+            'crew': Crew.objects.all()[crew_index].pk,
+            'flight': Flight.objects.all()[flight_index].pk,
+        }), content_type='json/application', follow=True)
+
+    def check_binding_response(self, crew_index, flight_index, should_succeed, expected_crew):
+        """Make a request and check if its results are relevant to what we expected"""
+        response = self.bind_crew(crew_index, flight_index)
+        if should_succeed:
+            self.assertEqual(response.status_code, 200)
+        else:
+            self.assertEqual(response.status_code, 400)
+
+        if isinstance(expected_crew, int):
+            expected_crew = Crew.objects.all()[expected_crew]
+        self.assertEqual(Flight.objects.all()[flight_index].crew, expected_crew)
+
+    def test_captain_name_surname(self):
+        """Don't allow two crews to have captains of same name"""
+        crew = Crew.objects.all()[0]
+        self.assertRaises(IntegrityError, Crew.objects.create,
+                          cptName=crew.cptName, cptSurname=crew.cptSurname)
+
+    def test_crew_simultaneous_flights(self):
+        """Don't allow a crew to fly two flights at the same time - backend"""
+        check_crew_simultaneous_flights(self)
+
+    def test_crew_reassignment(self):
+        """Check if reassigning flight crews works as expected - backend"""
+        check_crew_reassignment(self)
+
+
+class BatchCrewsTest(TestCase):
+    """Unit tests for binding crews to many flights at once"""
+
+    def setUp(self):
+        """Add initial data to db and authenticate future requests"""
+        init_database()
+        self.flights = list(Flight.objects.order_by('takeoffTime'))
+        self.crews = list(Crew.objects.order_by('pk'))
+
+        user = User.objects.create(username='asdf', password='qwer')
+        user.save()
+        self.client.force_login(user)
+
+    def assign(self, *pairs):
+        """Post (flight index, crew index or None) assignments, return their statuses"""
+        response = self.client.post('/REST/setCrews', content_type='application/json',
+                                    data=json.dumps({'assignments': [
+                                        {'flight': self.flights[flight].pk,
+                                         'crew': None if crew is None else self.crews[crew].pk}
+                                        for flight, crew in pairs]}))
+        self.assertEqual(response.status_code, 200)
+        return [item['status'] for item in response.json()['response']]
+
+    def stored_crews(self):
+        """Indices of crews of test flights in the database"""
+        return [None if flight.crew is None else self.crews.index(flight.crew)
+                for flight in Flight.objects.order_by('takeoffTime')]
+
+    def test_conflicts_in_batch(self):
+        """Earlier flights win a crew, flights can't be assigned twice"""
+        self.assertEqual(self.assign((1, 0), (0, 0), (2, 0), (2, 1)),
+                         ['rejected', 'OK', 'OK', 'rejected'])
+        self.assertEqual(self.stored_crews(), [0, None, 0])
+        self.assertEqual(self.assign((0, None), (1, 0)), ['OK', 'OK'])
+        self.assertEqual(self.stored_crews(), [None, 0, 0])
+
+    def test_rejected_keep_stored_crews(self):
+        """Accepted assignments are checked against crews that rejected ones keep"""
+        takeoff = self.flights[1].landingTime - timedelta(minutes=20)
+        Flight.objects.create(plane=self.flights[0].plane, crew=self.crews[0],
+                              takeoffAirport=self.flights[0].landingAirport,
+                              landingAirport=self.flights[0].takeoffAirport,
+                              takeoffTime=takeoff, landingTime=takeoff + timedelta(minutes=40))
+        self.flights[1].crew = self.crews[3]
+        self.flights[1].save()
+
+        self.assertEqual(self.assign((0, 3), (1, 0)), ['rejected', 'rejected'])
+        self.assertEqual(self.stored_crews(), [None, 3, 0, None])
+
+    def test_routed_database(self):
+        """Crews are locked, checked and written on the database that flights are routed to"""
+        with mock.patch('flights.rostering.router') as router:
+            router.db_for_write.return_value = 'default'
+            self.assertEqual(assign_crews([{'flight': self.flights[0].pk,
+                                            'crew': self.crews[0].pk}]), {})
+        router.db_for_write.assert_called_with(Flight)
+        self.assertEqual(router.db_for_write.call_count, 3)  # transaction, locks and UPDATE
+        self.assertEqual(self.stored_crews(), [0, None, None])
+
+
+class AutoRosterTest(TestCase):
+    """Unit tests for giving crews to crew-less flights automatically"""
+
+    def setUp(self):
+        """Add initial data to db, leave two crews, authenticate future requests"""
+        init_database()
+        Crew.objects.exclude(pk__in=Crew.objects.order_by('pk').values('pk')[:2]).delete()
+        self.crews = list(Crew.objects.order_by('pk'))
+        self.day = str(timezone.localtime(Flight.objects.earliest('takeoffTime').takeoffTime)
+                       .date())
+
+        user = User.objects.create(username='asdf', password='qwer')
+        user.save()
+        self.client.force_login(user)
+
+    def roster(self, strategy):
+        """Ask for crews of the test day, return the crews flights got"""
+        response = self.client.post('/REST/autoRoster', content_type='application/json',
+                                    data=json.dumps({'from': self.day, 'strategy': strategy}))
+        self.assertEqual(response.status_code, 200)
+        return [flight.crew for flight in Flight.objects.order_by('takeoffTime')]
+
+    def test_strategies(self):
+        """Tight rosters reuse the crew that landed last, balanced ones the one idle longest"""
+        first, second = self.crews
+        self.assertEqual(self.roster('tight'), [second, first, first])
+        Flight.objects.update(crew=None)
+        flights_written()
+        self.assertEqual(self.roster('balanced'), [first, second, first])
+
+    def test_busy_crews(self):
+        """Crews don't get flights overlapping the ones they already lead"""
+        flights = list(Flight.objects.order_by('takeoffTime'))
+        flights[0].crew = self.crews[0]
+        flights[0].save()
+        self.crews[1].delete()
+
+        out = StringIO()
+        call_command('auto_roster', self.day, stdout=out)
+        self.assertIn('1 flights got crews, 1 left without one', out.getvalue())
+        self.assertEqual([flight.crew for flight in Flight.objects.order_by('takeoffTime')],
+                         [self.crews[0], None, self.crews[0]])
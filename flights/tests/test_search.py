@@ -0,0 +1,181 @@
+"""Tests of route and connection searches"""
+from datetime import timedelta
+from unittest import mock
+
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from flights.connections import TIMETABLE
+from flights.dates import stored_datetime
+from flights.models import Plane, Flight, Airport
+from flights.routes import ROUTES
+from flights.tests import init_database
+
+
+@override_settings(FLIGHTS_ROUTE_INDEX=True)
+class RouteSearchTest(TransactionTestCase):
+    """Unit tests for searching flights by route and takeoff time, with changes committed"""
+
+    def setUp(self):
+        """Drop the index of flushed flights, add initial data to db"""
+        ROUTES.reset()
+        init_database()
+        self.first = Airport.objects.get(name='a1')
+        self.second = Airport.objects.get(name='a2')
+        self.today = timezone.now().date().isoformat()
+
+    def search(self, origin, destination, **params):
+        """Ids of flights found on a route today, and the whole response"""
+        response = self.client.get('/REST/searchFlights', dict(
+            {'from': origin.pk, 'to': destination.pk, 'after': self.today,
+             'before': self.today}, **params)).json()
+        return [flight['id'] for flight in response['response'].values()], response
+
+    def test_search(self):
+        """Flights of a route are found in takeoff order, within the window, page by page"""
+        outbound = list(Flight.objects.filter(takeoffAirport=self.first)
+                        .order_by('takeoffTime').values_list('pk', flat=True))
+        self.assertEqual(self.search(self.first, self.second)[0], outbound)
+        self.assertEqual(self.search(self.first, self.second,
+                                     after='%sT14:00:00+00:00' % self.today)[0], outbound[1:])
+        self.assertEqual(self.search(self.second, self.first, before='2000-01-01')[0], [])
+
+        found, page = self.search(self.first, self.second, limit=1)
+        self.assertEqual(found, outbound[:1])
+        found, page = self.search(self.first, self.second, limit=1, cursor=page['next'])
+        self.assertEqual((found, page['next']), (outbound[1:], None))
+        self.assertEqual(self.search(self.first, self.second, limit=1,
+                                     cursor=page['prev'])[0], outbound[:1])
+
+        with self.assertNumQueries(0):
+            ROUTES.search(self.first.pk, self.second.pk, timezone.now(), None, 10)
+        self.assertEqual(self.client.get('/REST/searchFlights', {'to': 1}).status_code, 400)
+
+    def test_index_follows_changes(self):
+        """Saved and deleted flights move in the index; the database fallback agrees"""
+        self.search(self.first, self.second)
+        flights = Flight.objects.filter(takeoffAirport=self.first).order_by('takeoffTime')
+        flights[0].delete()
+        turned = flights[0]
+        turned.takeoffAirport, turned.landingAirport = self.second, self.first
+        turned.save()
+
+        for use_index in (True, False):
+            with self.settings(FLIGHTS_ROUTE_INDEX=use_index):
+                self.assertEqual(self.search(self.first, self.second)[0], [])
+                self.assertEqual(self.search(self.second, self.first)[0], list(
+                    Flight.objects.filter(takeoffAirport=self.second)
+                    .order_by('takeoffTime').values_list('pk', flat=True)))
+
+    def test_rolled_back_changes(self):
+        """Transactions see flights they change, which the index learns about on commit"""
+        outbound = self.search(self.first, self.second)[0]
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Flight.objects.get(pk=outbound[0]).delete()
+            self.assertEqual(self.search(self.first, self.second)[0], outbound[1:])
+            raise IntegrityError
+        with self.assertNumQueries(0):
+            found = ROUTES.search(self.first.pk, self.second.pk, timezone.now().replace(
+                hour=0, minute=0, second=0, microsecond=0), None, 10)[0]
+        self.assertEqual(found, outbound)
+
+
+@override_settings(FLIGHTS_TIMETABLE_INDEX=True)
+class ConnectionSearchTest(TransactionTestCase):
+    """Unit tests for finding itineraries of connected flights, with changes committed"""
+
+    def setUp(self):
+        """Drop the timetable of flushed flights, add a network of airports: a direct flight
+        and longer ways arriving earlier"""
+        TIMETABLE.reset()
+        self.day = (timezone.now() + timedelta(days=2)).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        self.airports = {name: Airport.objects.create(name=name) for name in 'ABCDE'}
+        self.flights = {}
+        for number, (route, takeoff, landing) in enumerate((
+                ('AB', (20, 0), (22, 0)),
+                ('AC', (8, 0), (9, 0)), ('CB', (9, 20), (10, 0)), ('CB', (10, 0), (11, 0)),
+                ('AD', (7, 0), (7, 40)), ('DE', (8, 10), (8, 40)), ('EB', (9, 10), (10, 30)))):
+            self.flights[route + str(takeoff[0])] = Flight.objects.create(
+                plane=Plane.objects.create(identifier='p%d' % number, passengerLimit=20),
+                takeoffAirport=self.airports[route[0]], landingAirport=self.airports[route[1]],
+                takeoffTime=self.day.replace(hour=takeoff[0], minute=takeoff[1]),
+                landingTime=self.day.replace(hour=landing[0], minute=landing[1]))
+
+    def search(self, **params):
+        """Itineraries from A to B found on the day, as lists of flight keys"""
+        names = {flight.pk: name for name, flight in self.flights.items()}
+        response = self.client.get('/REST/connections', dict(
+            {'from': self.airports['A'].pk, 'to': self.airports['B'].pk,
+             'after': self.day.date().isoformat()}, **params))
+        self.assertEqual(response.status_code, 200)
+        itineraries = response.json()['response']
+        for itinerary in itineraries:
+            self.assertEqual(itinerary['connections'], len(itinerary['flights']) - 1)
+        return [[names[flight['id']] for flight in itinerary['flights']]
+                for itinerary in itineraries]
+
+    def test_search(self):
+        """More connections are offered only if they arrive earlier, with time for transfers"""
+        self.assertEqual(self.search(), [['AB20'], ['AC8', 'CB10'], ['AD7', 'DE8', 'EB9']])
+        self.assertEqual(self.search(connections=1), [['AB20'], ['AC8', 'CB10']])
+        self.assertEqual(self.search(connections=0), [['AB20']])
+        self.assertEqual(self.search(transfer=15), [['AB20'], ['AC8', 'CB9']])
+        self.assertEqual(self.search(after=self.day.replace(hour=7, minute=30).isoformat()),
+                         [['AB20'], ['AC8', 'CB10']])
+        for params in ({'to': 1}, {'connections': 4}, {'seats': 0}, {'transfer': 'x'}):
+            self.assertEqual(self.client.get('/REST/connections', params).status_code, 400)
+
+    def test_free_seats(self):
+        """Flights without enough free seats are not taken"""
+        Flight.objects.filter(pk=self.flights['CB10'].pk).update(reservedSeats=18)
+        self.assertEqual(self.search(seats=2), [['AB20'], ['AC8', 'CB10'], ['AD7', 'DE8', 'EB9']])
+        self.assertEqual(self.search(seats=3), [['AB20'], ['AD7', 'DE8', 'EB9']])
+        with mock.patch('flights.connections.SEAT_ATTEMPTS', 0):
+            self.assertEqual(self.search(seats=3), [['AB20'], ['AD7', 'DE8', 'EB9']])
+
+    def test_timetable_follows_changes(self):
+        """Saved and deleted flights move in the timetable, which needs no queries"""
+        self.search()
+        self.flights.pop('DE8').delete()
+        moved = self.flights['AC8']
+        moved.takeoffTime, moved.landingTime = (self.day.replace(hour=6),
+                                                self.day.replace(hour=7))
+        moved.save()
+        self.assertEqual(self.search(), [['AB20'], ['AC8', 'CB9']])
+        with self.assertNumQueries(0):
+            TIMETABLE.window(0, int(self.day.timestamp()))
+
+    def test_rolled_back_changes(self):
+        """Transactions see flights they change, which the timetable learns about on commit"""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Flight.objects.get(pk=self.flights['AB20'].pk).delete()
+            self.assertEqual(self.search(), [['AC8', 'CB10'], ['AD7', 'DE8', 'EB9']])
+            raise IntegrityError
+        self.assertEqual(self.search(), [['AB20'], ['AC8', 'CB10'], ['AD7', 'DE8', 'EB9']])
+
+
+@override_settings(FLIGHTS_TIMETABLE_INDEX=False)
+class QueryConnectionSearchTest(ConnectionSearchTest):
+    """The same as ConnectionSearchTest, with flights of the window queried"""
+
+    def test_timetable_follows_changes(self):
+        """Changed flights are found without loading the timetable"""
+        self.flights.pop('DE8').delete()
+        self.flights['AB20'].delete()
+        self.assertEqual(self.search(), [['AC8', 'CB10']])
+        self.assertFalse(TIMETABLE.loaded)
+
+
+class StoredTimesTest(SimpleTestCase):
+    """Unit tests for reading datetimes as they are stored"""
+
+    def test_stored_times(self):
+        """Times stored as text are read without datetime.fromisoformat() too"""
+        moment = timezone.now().replace(microsecond=0)
+        text = moment.strftime('%Y-%m-%d %H:%M:%S')
+        self.assertEqual(stored_datetime(text), moment)
+        with mock.patch('flights.dates.datetime') as fast:
+            fast.fromisoformat.side_effect = AttributeError
+            self.assertEqual(stored_datetime(text), moment)
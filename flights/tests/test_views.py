@@ -0,0 +1,281 @@
+"""Tests of REST endpoints and pages: caching, queries, pagination and indexes"""
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from flights.conflicts import date_bounds
+from flights.instrumentation import METRICS
+from flights.models import Plane, Crew, Flight, Airport, Reservation, Passenger, during
+from flights.routers import snapshot
+from flights.tests import init_database
+
+
+class RestFlightsTest(TestCase):
+    """Unit tests for JSON timetable output"""
+
+    def setUp(self):
+        """Add initial data to db"""
+        init_database()
+
+    def test_streaming_matches_plain(self):
+        """Both streamed encodings carry the same flights as the plain response"""
+        plain = self.client.get('/REST/flights').json()['response']
+        self.assertEqual(len(plain), 3)
+
+        response = self.client.get('/REST/flights', {'stream': 'json'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content).decode())['response'],
+                         plain)
+
+        response = self.client.get('/REST/flights', {'stream': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual({str(flight['id']): flight for flight in map(json.loads, lines)},
+                         plain)
+
+
+class ResponseCacheTest(TestCase):
+    """Unit tests for reusing timetable and crew list responses"""
+
+    def setUp(self):
+        """Add initial data to db"""
+        init_database()
+
+    def test_reuse_and_not_modified(self):
+        """Repeated requests don't read the database; matching ETags get empty responses"""
+        for path in ['/', '/REST/flights', '/REST/crews']:
+            first = self.client.get(path)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(path).status_code, 200)
+            self.assertFalse([query for query in queries if 'SELECT' in query['sql']])
+        self.assertEqual(self.client.get('/REST/crews').content, first.content)
+
+        response = self.client.get('/REST/crews', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_invalidation(self):
+        """Saving and deleting shown models makes responses fresh again"""
+        etag = self.client.get('/REST/flights')['ETag']
+        flight = Flight.objects.first()
+        flight.crew = Crew.objects.first()
+        flight.save()
+        response = self.client.get('/REST/flights', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['response'][str(flight.pk)]['crew'], flight.crew.pk)
+
+        link = 'details/%d' % flight.pk
+        self.assertContains(self.client.get('/'), link)
+        flight.delete()
+        self.assertNotContains(self.client.get('/'), link)
+
+
+class QueryCountTest(TestCase):
+    """Check that no endpoint makes more queries when there are more rows to show"""
+
+    def setUp(self):
+        """Add initial data to db and authenticate future requests"""
+        init_database()
+        self.flight = Flight.objects.get(plane__identifier='p1')
+        self.added = 0
+
+        user = User.objects.create(username='asdf', password='qwer')
+        user.save()
+        self.client.force_login(user)
+
+    def add_rows(self):
+        """Add flights led by crews and reservations of new passengers for the test flight"""
+        airports = Airport.objects.all()
+        for _ in range(2):
+            self.added += 1
+            plane = Plane.objects.create(identifier='added%d' % self.added, passengerLimit=20)
+            crew = Crew.objects.create(cptName='added', cptSurname=str(self.added))
+            Flight.objects.create(plane=plane, crew=crew, takeoffAirport=airports[0],
+                                  landingAirport=airports[1], takeoffTime=self.flight.takeoffTime,
+                                  landingTime=self.flight.landingTime)
+            Reservation.objects.create(
+                passenger=Passenger.objects.create(name='n%d' % self.added, surname='s'),
+                flight=self.flight, ticketCount=1)
+
+    def count_queries(self, path):
+        """Fetch a whole page, return how many queries did it take"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, path):
+        """Check that more rows don't mean more queries for a given page"""
+        before = self.count_queries(path)
+        self.add_rows()
+        self.assertEqual(before, self.count_queries(path), 'Queries of %s grow with rows' % path)
+
+    def test_endpoints(self):
+        """Timetable, flight details and REST endpoints"""
+        for path in ['/', '/?search=%s' % self.flight.takeoffTime.date(),
+                     '/details/%d' % self.flight.pk, '/REST/flights', '/REST/flights?stream=json',
+                     '/REST/flights?stream=ndjson', '/REST/crews']:
+            self.assert_constant_queries(path)
+
+
+class InstrumentationTest(TestCase):
+    """Unit tests for per-request measurements and their Prometheus export"""
+
+    def setUp(self):
+        """Add initial data to db, start with no recorded requests"""
+        init_database()
+        METRICS.reset()
+
+    def test_server_timing(self):
+        """Responses tell how many queries they took and how long did rendering take"""
+        flight = Flight.objects.first()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/details/%d' % flight.pk)
+        self.assertIn('desc="%d queries"' % len(queries), response['Server-Timing'])
+        self.assertNotIn('tpl;dur=0.00,', response['Server-Timing'])
+
+    def test_metrics(self):
+        """Totals are kept per view name"""
+        flight = Flight.objects.first()
+        for _ in range(2):
+            self.client.get('/details/%d' % flight.pk)
+        self.client.get('/missing')
+        response = self.client.get('/REST/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        metrics = response.content.decode().splitlines()
+        self.assertIn('flights_requests_total{view="details"} 2', metrics)
+        self.assertIn('flights_requests_total{view="unresolved"} 1', metrics)
+        self.assertIn('flights_request_duration_seconds_count{view="details"} 2', metrics)
+        self.assertIn('flights_request_duration_seconds_bucket{view="details",le="+Inf"} 2',
+                      metrics)
+
+
+class PaginationTest(TestCase):
+    """Unit tests for walking the timetable page by page with cursors"""
+
+    def setUp(self):
+        """Add initial data to db with a few flights sharing takeoff and landing times"""
+        init_database()
+        first = Flight.objects.get(plane__identifier='p1')
+        airports = Airport.objects.all()
+        for i in range(4):
+            plane = Plane.objects.create(identifier='twin%d' % i, passengerLimit=20)
+            Flight.objects.create(plane=plane, takeoffAirport=airports[0],
+                                  landingAirport=airports[1], takeoffTime=first.takeoffTime,
+                                  landingTime=first.landingTime)
+        self.ordered = list(Flight.objects.order_by('takeoffTime', 'landingTime', 'id')
+                            .values_list('id', flat=True))
+
+    def get_page(self, cursor=None):
+        """Fetch a page of two flights from the REST api"""
+        params = {'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        response = self.client.get('/REST/flights', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_walk_both_ways(self):
+        """Following next cursors visits every flight once, prev cursors lead back"""
+        pages = [self.get_page()]
+        self.assertIsNone(pages[0]['prev'])
+        while pages[-1]['next']:
+            pages.append(self.get_page(pages[-1]['next']))
+        self.assertEqual(len(pages), 4)
+        self.assertEqual([int(pkey) for page in pages for pkey in page['response']],
+                         self.ordered)
+
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = self.get_page(page['prev'])
+            self.assertEqual(page['response'], expected['response'])
+        self.assertIsNone(page['prev'])
+
+    def test_invalid_cursor(self):
+        """Tampered cursors are rejected"""
+        self.assertEqual(self.client.get('/REST/flights', {'cursor': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/', {'cursor': 'abc'}).status_code, 400)
+
+    def test_html_pages(self):
+        """The timetable page continues where a cursor points and links back"""
+        response = self.client.get('/', {'cursor': self.get_page()['next']})
+        self.assertEqual([flight.id for flight in response.context['flight_list']],
+                         self.ordered[2:])
+        self.assertIsNone(response.context['page'].next)
+        self.assertContains(response, response.context['page'].prev)
+
+
+def explain(queryset):
+    """Return the query plan of a queryset as text"""
+    sql, params = queryset.query.sql_with_params()
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':  # tables of tests are too small to use indexes
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute(prefix + sql, params)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+
+class IndexUsageTest(TestCase):
+    """Check that time range filters are answered with composite indexes"""
+
+    def setUp(self):
+        """Add initial data to db"""
+        init_database()
+        self.flight = Flight.objects.get(plane__identifier='p1')
+        self.begin, self.end = date_bounds(self.flight.takeoffTime.date())
+
+    def assert_uses(self, queryset, index):
+        """Check that the plan of a query mentions a given index"""
+        plan = explain(queryset)
+        self.assertIn(index, plan, plan)
+
+    def test_plane_day(self):
+        """Counting plane flights of a day, as during() does"""
+        self.assert_uses(Flight.objects.filter(plane=self.flight.plane, takeoffTime__lt=self.end,
+                                               landingTime__gte=self.begin),
+                         'flight_plane_')
+
+    def test_crew_range(self):
+        """Finding flights of a crew in a time window"""
+        self.assert_uses(Flight.objects.filter(crew_id=1, takeoffTime__gte=self.begin,
+                                               takeoffTime__lt=self.end),
+                         'flight_crew_takeoff_idx')
+
+    def test_timetable_day(self):
+        """Listing flights of a day in the timetable order"""
+        self.assert_uses(Flight.objects.for_listing().on_day(self.begin.date()),
+                         'flight_times_idx')
+        self.assertEqual(during(self.begin.date(), self.flight.plane), 1)
+
+
+class ReadOnlyViewsTest(TestCase):
+    """Check that pages which only show data don't lock rows"""
+
+    def setUp(self):
+        """Add initial data to db"""
+        init_database()
+
+    def test_no_row_locks(self):
+        """Timetable, flight details and REST endpoints"""
+        flight = Flight.objects.first()
+        with mock.patch.object(QuerySet, 'select_for_update') as select_for_update:
+            for path in ['/', '/details/%d' % flight.pk, '/REST/flights', '/REST/crews']:
+                self.assertEqual(self.client.get(path).status_code, 200)
+        select_for_update.assert_not_called()
+
+    def test_snapshot_transactions(self):
+        """Views get a snapshot transaction on PostgreSQL only, commands asking for one get it
+        on any database"""
+        with mock.patch('flights.routers.transaction.atomic') as atomic:
+            self.assertEqual(self.client.get('/').status_code, 200)
+            atomic.assert_not_called()
+            snapshot(Flight.objects.count, any_database=True)()
+            atomic.assert_called_once_with(using='default')
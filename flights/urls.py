@@ -6,8 +6,16 @@ from . import views
 urlpatterns = [
     path('', views.flights, name='flights'),
     path('reserve', login_required(views.reserve), name='reserve'),
+    path('REST/reservations/batch', views.reserve_batch, name='REST/reservations/batch'),
     path('REST/flights', views.get_flights, name='REST/flights'),
+    path('REST/searchFlights', views.search_flights, name='REST/searchFlights'),
+    path('REST/connections', views.search_itineraries, name='REST/connections'),
     path('REST/crews', views.get_crews, name='REST/crews'),
     path('REST/setCrew', views.set_crew, name='REST/setCrew'),
+    path('REST/setCrews', views.set_crews, name='REST/setCrews'),
+    path('REST/autoRoster', views.roster, name='REST/autoRoster'),
+    path('REST/events', views.get_events, name='REST/events'),
+    path('REST/export', views.get_export, name='REST/export'),
+    path('REST/metrics', views.get_metrics, name='REST/metrics'),
     path('details/<int:pkey>', views.details, name='details'),
 ]
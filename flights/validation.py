@@ -0,0 +1,189 @@
+"""Validate many flights or reservations at once, with a few queries for the whole batch
+instead of a few for each of its members"""
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from flights.models import Flight, DAILY_FLIGHTS_PER_PLANE
+
+QUERY_CHUNK = 500  # keep "IN" lists below SQLite's limit of query parameters
+SWEEP_ERRORS = {
+    'overlap': 'There would be two simultaneous flights of a single plane',
+    'daily limit': 'Plane flight limit per day would be exceeded',
+    'crew overlap': 'One crew would have to supervise two flights at the same time',
+}
+
+Candidate = namedtuple('Candidate', ('index', 'takeoffTime', 'landingTime'))
+
+
+def flight_days(takeoff, landing):
+    """List days that a flight touches, takes times already converted to current timezone"""
+    day = takeoff.date()
+    last = landing.date()
+    days = [day]
+    while day < last:
+        day += timedelta(days=1)
+        days.append(day)
+    return days
+
+
+def sweep(flights, existing, daily_limit=None):
+    """Split [flights] into accepted and rejected ones, so that accepted flights overlap neither
+    each other nor the [existing] (takeoff, landing) intervals; earlier takeoffs win. When
+    [daily_limit] is given, no day gets touched by more flights than that"""
+    events = sorted([(takeoff, 0, landing, None) for takeoff, landing in existing] +
+                    [(flight.takeoffTime, 1, flight.landingTime, flight) for flight in flights],
+                    key=lambda event: event[:2])
+
+    next_fixed = [None] * len(events)
+    upcoming = None
+    for i in range(len(events) - 1, -1, -1):
+        next_fixed[i] = upcoming
+        if events[i][3] is None:
+            upcoming = events[i][0]
+
+    per_day = defaultdict(int)
+    if daily_limit is not None:
+        for takeoff, landing in existing:
+            for day in flight_days(takeoff, landing):
+                per_day[day] += 1
+
+    accepted, rejected = [], []
+    last_landing = None
+    for i, (takeoff, _, landing, flight) in enumerate(events):
+        if flight is None:
+            last_landing = landing if last_landing is None else max(last_landing, landing)
+            continue
+        if (last_landing is not None and takeoff <= last_landing) or (
+                next_fixed[i] is not None and landing >= next_fixed[i]):
+            rejected.append((flight, 'overlap'))
+            continue
+        if daily_limit is not None:
+            days = flight_days(takeoff, landing)
+            if any(per_day[day] >= daily_limit for day in days):
+                rejected.append((flight, 'daily limit'))
+                continue
+            for day in days:
+                per_day[day] += 1
+        last_landing = landing
+        accepted.append(flight)
+    return accepted, rejected
+
+
+def existing_intervals(field, keys, exclude=(), within=None):
+    """Group (takeoff, landing) of flights in the database by their plane or crew, skipping
+    flights with primary keys in [exclude], only ones in the air during a [within] (begin, end)
+    range if it's given"""
+    keys = list(keys)
+    local = timezone.get_current_timezone()
+    intervals = defaultdict(list)
+    flights = Flight.objects.all()
+    if within is not None:
+        flights = flights.filter(landingTime__gte=within[0], takeoffTime__lt=within[1])
+    for i in range(0, len(keys), QUERY_CHUNK):
+        rows = flights.filter(**{field + '__in': keys[i:i + QUERY_CHUNK]}) \
+            .values_list('pk', field, 'takeoffTime', 'landingTime').iterator()
+        for pkey, key, takeoff, landing in rows:
+            if pkey not in exclude:
+                intervals[key].append((takeoff.astimezone(local), landing.astimezone(local)))
+    return intervals
+
+
+def existing_pks(model, pkeys):
+    """Tell which of given primary keys exist in a model's table"""
+    pkeys = list(pkeys)
+    found = set()
+    for i in range(0, len(pkeys), QUERY_CHUNK):
+        found.update(model._default_manager.filter(pk__in=pkeys[i:i + QUERY_CHUNK])
+                     .values_list('pk', flat=True))
+    return found
+
+
+def clean_fields_in_bulk(instances):
+    """Run clean_fields() on model instances of one kind, checking that referenced rows exist
+    with a query per foreign key instead of one per instance and key; return
+    {position: ValidationError}"""
+    if not instances:
+        return {}
+    relations = [field for field in instances[0]._meta.concrete_fields if field.is_relation]
+    errors = defaultdict(dict)
+    for index, instance in enumerate(instances):
+        try:
+            instance.clean_fields(exclude=[field.name for field in relations])
+        except ValidationError as err:
+            errors[index].update(err.message_dict)
+
+    for field in relations:
+        values = [getattr(instance, field.attname) for instance in instances]
+        found = existing_pks(field.related_model, {value for value in values if value is not None})
+        for index, value in enumerate(values):
+            if value is None and not field.null:
+                errors[index][field.name] = [str(field.error_messages['null'])]
+            elif value is not None and value not in found:
+                errors[index][field.name] = ['%s %r does not exist' % (
+                    field.related_model._meta.verbose_name.capitalize(), value)]
+    return {index: ValidationError(messages) for index, messages in errors.items()}
+
+
+def validate_flights(flights):
+    """Validate a batch of flights to be saved together, with the rules of Flight.clean()
+    checked against each other and against the rest of the stored schedule; uniqueness is left
+    to the database. Return {position in batch: ValidationError}"""
+    errors = clean_fields_in_bulk(flights)
+    local = timezone.get_current_timezone()
+    by_plane = defaultdict(list)
+    for index, flight in enumerate(flights):
+        if index in errors:
+            continue
+        try:
+            flight.clean_route()
+        except ValidationError as err:
+            errors[index] = err
+            continue
+        by_plane[flight.plane_id].append(Candidate(index, flight.takeoffTime.astimezone(local),
+                                                   flight.landingTime.astimezone(local)))
+    batch = {flight.pk for flight in flights if flight.pk is not None}
+
+    existing = existing_intervals('plane', by_plane.keys(), exclude=batch)
+    by_crew = defaultdict(list)
+    for plane, candidates in by_plane.items():
+        accepted, rejected = sweep(candidates, existing.get(plane, ()), DAILY_FLIGHTS_PER_PLANE)
+        errors.update((candidate.index, ValidationError(SWEEP_ERRORS[reason]))
+                      for candidate, reason in rejected)
+        for candidate in accepted:
+            if flights[candidate.index].crew_id is not None:
+                by_crew[flights[candidate.index].crew_id].append(candidate)
+
+    existing = existing_intervals('crew', by_crew.keys(), exclude=batch)
+    for crew, candidates in by_crew.items():
+        _, rejected = sweep(candidates, existing.get(crew, ()))
+        errors.update((candidate.index, ValidationError(SWEEP_ERRORS['crew ' + reason]))
+                      for candidate, reason in rejected)
+    return errors
+
+
+def validate_reservations(reservations):
+    """Validate a batch of reservations to be saved together, checking seat capacity of all
+    their flights with a single query; return {position in batch: ValidationError}"""
+    errors = clean_fields_in_bulk(reservations)
+    change = defaultdict(int)
+    for index, reservation in enumerate(reservations):
+        if index not in errors:
+            change[reservation.flight_id] += \
+                reservation.ticketCount - reservation.saved_ticket_count
+
+    flight_ids = list(change)
+    overbooked = set()
+    for i in range(0, len(flight_ids), QUERY_CHUNK):
+        seats = Flight.objects.filter(pk__in=flight_ids[i:i + QUERY_CHUNK]) \
+            .values_list('pk', 'reservedSeats', 'plane__passengerLimit')
+        overbooked.update(pkey for pkey, reserved, limit in seats
+                          if reserved + change[pkey] > limit)
+
+    for index, reservation in enumerate(reservations):
+        if index not in errors and reservation.flight_id in overbooked:
+            errors[index] = ValidationError(
+                'Such reservation would exceed plane passenger capacity limit')
+    return errors
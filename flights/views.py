@@ -1,18 +1,41 @@
 """Provide data for templates"""
 import ast
 import json
+import tempfile
+from datetime import timedelta
 
 from django.contrib.auth.decorators import login_required
-from django.core.exceptions import ValidationError, SuspiciousOperation
+from django.core.exceptions import ValidationError, SuspiciousOperation, NON_FIELD_ERRORS, \
+    ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
-from django.db.models import Sum, Value
-from django.db.models.functions import Coalesce
 from django.forms import model_to_dict
-from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, HttpResponseForbidden
+from django.http import JsonResponse, HttpResponseBadRequest, HttpResponse, \
+    HttpResponseForbidden, StreamingHttpResponse, FileResponse, Http404
 from django.shortcuts import get_object_or_404, render, redirect
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.http import require_POST, require_GET
 
-from flights.models import Flight, Reservation, Passenger, Crew
+from flights.booking import book_reservation, book_reservations
+from flights.caching import cached, cached_response
+from flights.conflicts import date_bounds
+from flights.connections import MAX_CONNECTIONS, MIN_TRANSFER, search_connections
+from flights.events import STREAM_START, KEEPALIVE_SECONDS, backend as event_backend, \
+    encode_event, live_updates
+from flights.export import archive, export_schedule
+from flights.instrumentation import METRICS
+from flights.models import Flight, Reservation, Crew
+from flights.pagination import InvalidCursor, paginate, page_size
+from flights.passengers import PASSENGERS
+from flights.rostering import assign_crews, auto_roster
+from flights.routes import search_route
+from flights.routers import snapshot
+from flights.seating import seat_count, seat_labels, seat_rows, to_bits
+
+REST_PAGE_SIZE = 100
+STREAM_CHUNK_SIZE = 500
+STREAM_CONTENT_TYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
 
 
 class DbIntegrityError(ValidationError, SuspiciousOperation):
@@ -24,27 +47,37 @@ class DbIntegrityError(ValidationError, SuspiciousOperation):
 # Create your views here.
 
 
+@snapshot
 def flights(request):
-    """Show all flights, optionally filtered by day"""
+    """Show a page of flights, optionally filtered by day"""
     date_query = request.GET.get('search')
-    flight_list = Flight.objects.select_for_update().order_by('takeoffTime', 'landingTime')
-    if date_query:
-        flight_list = flight_list.filter(takeoffTime__date__lte=date_query,
-                                         landingTime__date__gte=date_query)
+    flight_list = Flight.objects.for_listing().on_day(date_query)
+    try:
+        page = cached('timetable', request,
+                      lambda: paginate(flight_list, request.GET.get('cursor')))
+    except InvalidCursor as err:
+        return HttpResponseBadRequest(str(err))
 
-    return render(request, 'flights.html', {'flight_list': flight_list})
+    return render(request, 'flights.html', {'flight_list': page.items, 'page': page,
+                                            'date_query': date_query or ''})
 
 
+@snapshot
 def details(request, **kwargs):
     """Show details of a flight, allow for reserving seats by authorized passengers"""
-    flight = get_object_or_404(Flight, pk=kwargs.get('pkey'))
-    reservations = Reservation.objects.select_for_update() \
-        .filter(flight=flight, ticketCount__gt=0).order_by('-updated')
-    ticks = reservations.aggregate(total=Coalesce(Sum('ticketCount'), Value(0)))
-    free_seats = flight.plane.passengerLimit - ticks.get('total')
+    flight = get_object_or_404(Flight.objects.for_details(), pk=kwargs.get('pkey'))
+    reservations = list(Reservation.objects.for_details().filter(flight=flight))
+    per_row = flight.plane.seatsPerRow
+    for reservation in reservations:
+        reservation.seat_names = ', '.join(seat_labels(reservation.seatMap, per_row))
+    taken = seat_count(to_bits(flight.seatMap))
+    ticks = {'total': taken}
+    free_seats = flight.plane.passengerLimit - taken
+    seats = seat_rows(flight.seatMap, flight.plane.passengerLimit, per_row)
 
     return render(request, 'details.html', {'flight': flight, 'reservations': reservations,
-                                            'ticks': ticks, 'free_seats': free_seats})
+                                            'ticks': ticks, 'free_seats': free_seats,
+                                            'seat_rows': seats, 'live_updates': live_updates()})
 
 
 @transaction.atomic
@@ -53,19 +86,42 @@ def details(request, **kwargs):
 def reserve(request):
     """Attempt a new reservation of tickets by an authorized passenger"""
     try:
-        passenger, _ = Passenger.objects.select_for_update() \
-            .get_or_create(name=request.POST['name'], surname=request.POST['surname'])
-        flight = Flight.objects.select_for_update().get(pk=request.POST['flight'])
-        reservation, _ = Reservation.objects.select_for_update() \
-            .get_or_create(passenger=passenger, flight=flight)
-        reservation.ticketCount = request.POST['ticketCount']
-        reservation.save()
+        names = (request.POST['name'], request.POST['surname'])
+        PASSENGERS.resolve_for([names], lambda ids: book_reservation(
+            ids[names], request.POST['flight'], request.POST['ticketCount']))
     except (SuspiciousOperation, ValidationError) as err:
         raise DbIntegrityError(err)
 
     return redirect('details', request.POST['flight'])
 
 
+@transaction.atomic
+@require_POST
+def reserve_batch(request):
+    """Create or change many reservations of authorized passengers at once, all or none of
+    them, telling which seats they hold; tell what is wrong with each rejected one"""
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden(request)
+    try:
+        reservations, errors = book_reservations(json.loads(request.body)['reservations'])
+    except (ValueError, KeyError, TypeError) as err:
+        return HttpResponseBadRequest('Expected a JSON object with a list of reservations: %s'
+                                      % err)
+    except ValidationError as err:
+        errors = {NON_FIELD_ERRORS: err}
+    if errors:
+        transaction.set_rollback(True)
+        return JsonResponse({'errors': dict((index, error.messages)
+                                            for index, error in errors.items())}, status=400)
+    per_row = dict(Flight.objects.filter(pk__in={reservation.flight_id
+                                                 for reservation in reservations})
+                   .values_list('pk', 'plane__seatsPerRow'))
+    return JsonResponse({'response': [
+        dict(model_to_dict(reservation),
+             seats=seat_labels(reservation.seatMap, per_row[reservation.flight_id]))
+        for reservation in reservations]}, status=200)
+
+
 def my_error_handler(request, exception, template_name='400.html'):
     """Show a 400 page with details of a cause if provided"""
     err_except = ast.literal_eval(str(exception))['__all__']
@@ -75,34 +131,207 @@ def my_error_handler(request, exception, template_name='400.html'):
     return response
 
 
+def make_json_detailed_model(obj):
+    """Create model details that are extended by a result of __str__ call on a model obj"""
+    return dict(model_to_dict(obj), **{'title': obj.__str__()})
+
+
 def make_json_detailed_model_list(model_list):
     """Create a list of model details that is extended by a result of __str__ call on a model obj"""
-    return dict((obj.id, dict(model_to_dict(obj), **{'title': obj.__str__()}))
-                for obj in model_list)
+    return dict((obj.id, make_json_detailed_model(obj)) for obj in model_list)
+
+
+def stream_json_detailed_model_list(model_list, ndjson=False):
+    """Encode the same data as make_json_detailed_model_list does, one database chunk at a time;
+    either as a {"response": {...}} document or as a JSON object per line"""
+    encoder = DjangoJSONEncoder()
+    if not ndjson:
+        yield '{"response": {'
+    separator = ''
+    chunk = []
+    for obj in model_list.iterator(chunk_size=STREAM_CHUNK_SIZE):
+        if ndjson:
+            chunk.append('%s\n' % encoder.encode(make_json_detailed_model(obj)))
+        else:
+            chunk.append('%s"%d": %s' % (separator, obj.id,
+                                         encoder.encode(make_json_detailed_model(obj))))
+            separator = ', '
+        if len(chunk) == STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+    if not ndjson:
+        yield '}}'
 
 
 @require_GET
+@cached_response('flights')
+@snapshot
 def get_flights(request):
-    """Return a JSON of all flights, optionally filtered by date"""
+    """Return a JSON of a page of flights, optionally filtered by date, with cursors of next
+    and previous pages; all flights are streamed if asked to with stream=json (same document)
+    or stream=ndjson (a flight per line)"""
     date_query = request.GET.get('search')
-    flight_list = Flight.objects.select_for_update().order_by('takeoffTime', 'landingTime')
-    if date_query:
-        flight_list = flight_list.filter(takeoffTime__date__lte=date_query,
-                                         landingTime__date__gte=date_query)
+    stream = request.GET.get('stream')
+    flight_list = Flight.objects.for_api().on_day(date_query)
+
+    if stream in STREAM_CONTENT_TYPES:
+        return StreamingHttpResponse(
+            stream_json_detailed_model_list(flight_list, ndjson=stream == 'ndjson'),
+            content_type=STREAM_CONTENT_TYPES[stream])
+
+    try:
+        page = paginate(flight_list, request.GET.get('cursor'),
+                        page_size(request.GET.get('limit'), REST_PAGE_SIZE))
+    except ValueError as err:
+        return HttpResponseBadRequest(str(err))
+    out = make_json_detailed_model_list(page.items)
+    return JsonResponse({'response': out, 'next': page.next, 'prev': page.prev}, status=200)
 
-    out = make_json_detailed_model_list(flight_list)
+
+def window_bound(value, end=False):
+    """Read an ISO datetime bounding a time window, or a date standing for its beginning, or
+    for the beginning of the next day if it ends the window"""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('Invalid date or time %s' % value)
+        return date_bounds(day)[1 if end else 0]
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
+
+@require_GET
+@snapshot
+def search_flights(request):
+    """Return a JSON of a page of flights from one airport ("from" id) to another ("to" id)
+    taking off after a moment ("after", now by default) and before another ("before"), with
+    cursors of next and previous pages like REST/flights"""
+    try:
+        origin, destination = int(request.GET['from']), int(request.GET['to'])
+        begin = window_bound(request.GET['after']) if 'after' in request.GET \
+            else timezone.now()
+        end = window_bound(request.GET['before'], end=True) if 'before' in request.GET \
+            else None
+        page = search_route(origin, destination, begin, end, request.GET.get('cursor'),
+                            page_size(request.GET.get('limit'), REST_PAGE_SIZE))
+    except KeyError:
+        return HttpResponseBadRequest('Expected ids of airports in "from" and "to"')
+    except ValueError as err:
+        return HttpResponseBadRequest(str(err))
+    out = make_json_detailed_model_list(page.items)
+    return JsonResponse({'response': out, 'next': page.next, 'prev': page.prev}, status=200)
+
+
+@require_GET
+@snapshot
+def search_itineraries(request):
+    """Return a JSON of itineraries from one airport ("from" id) to another ("to" id) taking
+    off after a moment ("after", now by default), changing flights at most "connections" times
+    (up to 3) with at least "transfer" minutes for every change and with at least "seats" free
+    seats on every flight; the earliest arriving itinerary is listed first for every number of
+    connections that arrives earlier than fewer connections do"""
+    try:
+        origin, destination = int(request.GET['from']), int(request.GET['to'])
+        after = window_bound(request.GET['after']) if 'after' in request.GET \
+            else timezone.now()
+        seats = int(request.GET.get('seats', 1))
+        changes = int(request.GET.get('connections', MAX_CONNECTIONS))
+        transfer = timedelta(minutes=int(request.GET['transfer'])) \
+            if 'transfer' in request.GET else MIN_TRANSFER
+    except KeyError:
+        return HttpResponseBadRequest('Expected ids of airports in "from" and "to"')
+    except ValueError as err:
+        return HttpResponseBadRequest(str(err))
+    if seats < 1 or not 0 <= changes <= MAX_CONNECTIONS or transfer < timedelta(0):
+        return HttpResponseBadRequest('Expected positive "seats", "connections" up to %d and '
+                                      'non-negative "transfer"' % MAX_CONNECTIONS)
+    out = [{'takeoffTime': legs[0].takeoffTime, 'landingTime': legs[-1].landingTime,
+            'connections': len(legs) - 1, 'flights': [make_json_detailed_model(leg)
+                                                      for leg in legs]}
+           for legs in search_connections(origin, destination, after, seats, changes, transfer)]
     return JsonResponse({'response': out}, status=200)
 
 
 @require_GET
+@cached_response('crews')
+@snapshot
 # pylint: disable=unused-argument
 # Needed for a view to be valid
 def get_crews(request):
     # pylint: enable=unused-argument
-    """Return a JSON of all crews"""
-    crew_list = Crew.objects.select_for_update()
+    """Return a JSON of all crews, telling whether changes of flights can be subscribed to"""
+    crew_list = Crew.objects.all()
     out = make_json_detailed_model_list(crew_list)
-    return JsonResponse({'response': out}, status=200)
+    return JsonResponse({'response': out, 'liveUpdates': live_updates()}, status=200)
+
+
+def stream_events(subscription, flight=None):
+    """Encode events of a subscription as a text/event-stream, optionally only the ones of a
+    single flight; comments keep the connection alive while nothing happens"""
+    try:
+        yield STREAM_START
+        while True:
+            chunk = encode_event(subscription.get(timeout=KEEPALIVE_SECONDS), flight)
+            if chunk:
+                yield chunk
+    finally:
+        subscription.close()
+
+
+@require_GET
+def get_events(request):
+    """Stream changes of seat counters ("seats" events) and of flight crews ("crew" events, with
+    flights as REST/flights lists them) as Server-Sent Events, optionally only of one flight; a
+    "reset" event means some were lost and the data has to be fetched again; not found unless
+    live updates are on"""
+    if not live_updates():
+        raise Http404('Live updates are off')
+    try:
+        flight = request.GET.get('flight')
+        flight = None if flight is None else int(flight)
+        last_id = request.META.get('HTTP_LAST_EVENT_ID')
+        last_id = None if last_id is None else int(last_id)
+    except ValueError:
+        return HttpResponseBadRequest('Flight and event ids have to be numbers')
+    response = StreamingHttpResponse(stream_events(event_backend().subscribe(last_id), flight),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+@snapshot
+# pylint: disable=unused-argument
+# Needed for a view to be valid
+def get_export(request):
+    # pylint: enable=unused-argument
+    """Return airports, planes, flights and reservations as an .npz archive of column arrays,
+    see flights.export for its layout"""
+    target = tempfile.TemporaryFile()
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            export_schedule(directory)
+        except ImproperlyConfigured as err:
+            target.close()
+            return HttpResponse(str(err), status=501)
+        archive(directory, target)
+    response = FileResponse(target, content_type='application/octet-stream')
+    response['Content-Length'] = target.tell()
+    response['Content-Disposition'] = 'attachment; filename="schedule.npz"'
+    target.seek(0)
+    return response
+
+
+@require_GET
+# pylint: disable=unused-argument
+# Needed for a view to be valid
+def get_metrics(request):
+    # pylint: enable=unused-argument
+    """Return query counts and timings of requests per view in Prometheus text format"""
+    return HttpResponse(METRICS.prometheus(), content_type='text/plain; version=0.0.4')
 
 
 @transaction.atomic
@@ -121,3 +350,46 @@ def set_crew(request):
         raise DbIntegrityError(err)
 
     return HttpResponse('OK')
+
+
+@transaction.atomic
+@require_POST
+def set_crews(request):
+    """Bind crews to lead many flights, tell which of the assignments were applied and why the
+    others were not"""
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden(request)
+    try:
+        records = json.loads(request.body)['assignments']
+        errors = assign_crews(records)
+    except (ValueError, KeyError, TypeError) as err:
+        return HttpResponseBadRequest('Expected a JSON object with a list of assignments: %s'
+                                      % err)
+    except ValidationError as err:
+        return HttpResponseBadRequest('; '.join(err.messages))
+    out = [{'status': 'OK'} if index not in errors else
+           {'status': 'rejected', 'errors': errors[index].messages}
+           for index in range(len(records))]
+    return JsonResponse({'response': out}, status=200)
+
+
+@transaction.atomic
+@require_POST
+def roster(request):
+    """Give crews to crew-less flights taking off between two dates, tell how many got one"""
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden(request)
+    try:
+        body = json.loads(request.body)
+        first_day = parse_date(body['from'])
+        last_day = parse_date(body.get('to', body['from']))
+        if first_day is None or last_day is None:
+            raise ValueError('Dates have to be in YYYY-MM-DD format')
+        assigned, unassigned = auto_roster(first_day, last_day,
+                                           body.get('strategy', 'tight'))
+    except (ValueError, KeyError, TypeError) as err:
+        return HttpResponseBadRequest('Expected a JSON object with a date range: %s' % err)
+    except ValidationError as err:
+        return HttpResponseBadRequest('; '.join(err.messages))
+    return JsonResponse({'response': {'assigned': assigned, 'unassigned': unassigned}},
+                        status=200)
@@ -0,0 +1,21 @@
+"""
+ASGI config for task2 project.
+
+It exposes the ASGI callable as a module-level variable named ``application``, e.g. for
+``uvicorn task2.asgi:application``. Django requests run in a bounded pool of threads (the
+ASGI_THREADS setting), event streams don't take threads while they wait, so live updates are
+on unless FLIGHTS_LIVE_UPDATES says otherwise.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "task2.settings")
+os.environ.setdefault("FLIGHTS_LIVE_UPDATES", "1")
+django.setup(set_prefix=False)
+
+# Django has to be set up before the handler, which uses the models, is imported
+from flights.asgi import ASGIHandler  # noqa: E402 pylint: disable=wrong-import-position
+
+application = ASGIHandler()
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'flights.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,14 +49,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    # 'task2.flights.middleware',
 ]
 
 ROOT_URLCONF = 'task2.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django templates timing their rendering for the instrumentation middleware
+        'BACKEND': 'flights.instrumentation.TimedDjangoTemplates',
         'DIRS': ['flights/templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -71,6 +72,24 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'task2.wsgi.application'
 
+# Threads running Django requests when served through task2.asgi
+ASGI_THREADS = 16
+
+# In-memory indexes of flights only see writes of their own process, so they are used only when
+# a single process serves the site (FLIGHTS_SINGLE_PROCESS=1), e.g. runserver; otherwise
+# flights are checked with queries
+FLIGHTS_SINGLE_PROCESS = os.environ.get('FLIGHTS_SINGLE_PROCESS') == '1'
+FLIGHTS_SCHEDULE_INDEX = FLIGHTS_ROUTE_INDEX = FLIGHTS_TIMETABLE_INDEX = \
+    FLIGHTS_SINGLE_PROCESS
+
+# Passengers are resolved by name through a map of each process (flights.passengers), which
+# only sees deletions of its own process; bookings check that the passengers they get exist
+FLIGHTS_PASSENGER_CACHE_SIZE = 10000
+
+# Pages subscribe to live updates of seats and crews (FLIGHTS_LIVE_UPDATES=1) only when served
+# through task2.asgi by default, as a WSGI server holds a thread for every open event stream
+FLIGHTS_LIVE_UPDATES = os.environ.get('FLIGHTS_LIVE_UPDATES') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
@@ -80,6 +99,40 @@ DATABASES = {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
+    # Read-only views use a 'replica' alias when there is one, e.g.
+    # 'replica': {..., 'TEST': {'MIRROR': 'default'}},
+}
+
+# FLIGHTS_DB=postgresql switches to PostgreSQL, configured with FLIGHTS_DB_* variables; tests
+# then run against the same server, in a database named after FLIGHTS_DB_NAME
+if os.environ.get('FLIGHTS_DB') == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('FLIGHTS_DB_NAME', 'flights'),
+        'USER': os.environ.get('FLIGHTS_DB_USER', 'flights'),
+        'PASSWORD': os.environ.get('FLIGHTS_DB_PASSWORD', ''),
+        'HOST': os.environ.get('FLIGHTS_DB_HOST', 'localhost'),
+        'PORT': os.environ.get('FLIGHTS_DB_PORT', '5432'),
+        # connections are kept open between requests and pinged before reuse (flights.database)
+        'CONN_MAX_AGE': int(os.environ.get('FLIGHTS_DB_CONN_MAX_AGE', '60')),
+        'OPTIONS': {'connect_timeout': int(os.environ.get('FLIGHTS_DB_CONNECT_TIMEOUT', '5'))},
+    }
+    FLIGHTS_DB_HEALTH_CHECKS = True
+    if os.environ.get('FLIGHTS_DB_POOL'):
+        # HOST:PORT of a pooler in transaction mode (e.g. PgBouncer), which can't keep server-side
+        # cursors open across transactions; connections to it are cheap to keep
+        _pool_host, _, _pool_port = os.environ['FLIGHTS_DB_POOL'].partition(':')
+        DATABASES['default'].update(HOST=_pool_host, PORT=_pool_port or '6432',
+                                    DISABLE_SERVER_SIDE_CURSORS=True)
+
+DATABASE_ROUTERS = ['flights.routers.ReadReplicaRouter']
+
+# Timetable and crew list responses; processes only see each other's invalidations with a
+# shared backend, e.g. memcached or django.core.cache.backends.filebased.FileBasedCache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
 }
 
 